@@ -0,0 +1,49 @@
+"""add updated_at watermarks and tombstones for incremental backups
+
+Revision ID: 0003_incremental_backup
+Revises: 0002_add_pinned_to_conversations
+Create Date: 2026-10-19 12:00:00
+
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0003_incremental_backup'
+down_revision = '0002_add_pinned_to_conversations'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('conversations', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('messages', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    # Backfill so existing rows are covered by the first incremental export
+    op.execute("UPDATE conversations SET updated_at = created_at WHERE updated_at IS NULL")
+    op.execute("UPDATE messages SET updated_at = coalesce(completed_at, started_at) WHERE updated_at IS NULL")
+    op.create_index('ix_conversations_updated_at', 'conversations', ['updated_at'], unique=False)
+    op.create_index('ix_messages_updated_at', 'messages', ['updated_at'], unique=False)
+    op.create_index('ix_message_streams_created_at', 'message_streams', ['created_at'], unique=False)
+
+    op.create_table(
+        'tombstones',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('entity', sa.String(length=32), nullable=False),
+        sa.Column('entity_id', sa.String(length=32), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_deleted_at', 'tombstones', ['deleted_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tombstones_deleted_at', table_name='tombstones')
+    op.drop_table('tombstones')
+    op.drop_index('ix_message_streams_created_at', table_name='message_streams')
+    op.drop_index('ix_messages_updated_at', table_name='messages')
+    op.drop_index('ix_conversations_updated_at', table_name='conversations')
+    op.drop_column('messages', 'updated_at')
+    op.drop_column('conversations', 'updated_at')
@@ -0,0 +1,40 @@
+"""add token_usage table for token quotas
+
+Revision ID: 0004_token_usage
+Revises: 0003_incremental_backup
+Create Date: 2026-10-19 12:00:00
+
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0004_token_usage'
+down_revision = '0003_incremental_backup'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'token_usage',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('subject', sa.String(length=64), nullable=False),
+        sa.Column('model', sa.String(length=200), nullable=False),
+        sa.Column('day', sa.String(length=10), nullable=False),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+        sa.Column('completion_tokens', sa.Integer(), nullable=False),
+        sa.Column('requests', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('subject', 'model', 'day', name='uq_token_usage_subject_model_day')
+    )
+    op.create_index('ix_token_usage_day', 'token_usage', ['day'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_token_usage_day', table_name='token_usage')
+    op.drop_table('token_usage')
@@ -0,0 +1,44 @@
+"""add api_keys table for per-client keys
+
+Revision ID: 0005_api_keys
+Revises: 0004_token_usage
+Create Date: 2026-10-19 12:00:00
+
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0005_api_keys'
+down_revision = '0004_token_usage'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'api_keys',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('prefix', sa.String(length=16), nullable=False),
+        sa.Column('key_hash', sa.String(length=200), nullable=False),
+        sa.Column('scopes', sa.JSON(), nullable=False),
+        sa.Column('priority', sa.String(length=32), nullable=False),
+        sa.Column('rate_limit_per_min', sa.Integer(), nullable=True),
+        sa.Column('quota_tpm', sa.Integer(), nullable=True),
+        sa.Column('quota_daily_tokens', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+        sa.Column('revoked_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('prefix')
+    )
+    op.create_index('ix_api_keys_revoked_at', 'api_keys', ['revoked_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_api_keys_revoked_at', table_name='api_keys')
+    op.drop_table('api_keys')
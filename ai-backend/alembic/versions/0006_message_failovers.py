@@ -0,0 +1,26 @@
+"""add failovers to messages
+
+Revision ID: 0006_message_failovers
+Revises: 0005_api_keys
+Create Date: 2026-10-19 18:00:00
+
+"""
+from __future__ import annotations
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '0006_message_failovers'
+down_revision = '0005_api_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('messages', sa.Column('failovers', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'failovers')
@@ -0,0 +1,363 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import structlog
+from sqlalchemy import func, select
+
+from .config import get_settings
+
+logger = structlog.get_logger()
+
+KEY_TAG = "gw"
+HASH_ALGORITHM = "pbkdf2_sha256"
+MAX_CACHE_ENTRIES = 10_000
+
+
+def generate_key() -> Tuple[str, str]:
+    """Return ``(plaintext, prefix)``; the plaintext looks like ``gw_<prefix>_<secret>``."""
+    prefix = secrets.token_hex(6)
+    return f"{KEY_TAG}_{prefix}_{secrets.token_urlsafe(32)}", prefix
+
+
+def parse_prefix(key: str) -> Optional[str]:
+    parts = key.split("_", 2)
+    if len(parts) != 3 or parts[0] != KEY_TAG or not parts[1]:
+        return None
+    return parts[1]
+
+
+def hash_key(key: str, iterations: Optional[int] = None) -> str:
+    iterations = iterations or get_settings().api_key_hash_iterations
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", key.encode(), salt, iterations)
+    return f"{HASH_ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def verify_key(key: str, stored: str) -> bool:
+    try:
+        algorithm, iterations, salt, expected = stored.split("$")
+    except ValueError:
+        return False
+    if algorithm != HASH_ALGORITHM:
+        return False
+    digest = hashlib.pbkdf2_hmac("sha256", key.encode(), bytes.fromhex(salt), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+class KeyIdentity:
+    """The caller behind a verified key, as seen by auth, rate limiting, quotas and logs."""
+
+    __slots__ = ("id", "name", "scopes", "priority", "rate_limit_per_min", "quota_tpm", "quota_daily_tokens")
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        scopes: FrozenSet[str],
+        priority: str = "default",
+        rate_limit_per_min: Optional[int] = None,
+        quota_tpm: Optional[int] = None,
+        quota_daily_tokens: Optional[int] = None,
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.scopes = scopes
+        self.priority = priority
+        self.rate_limit_per_min = rate_limit_per_min
+        self.quota_tpm = quota_tpm
+        self.quota_daily_tokens = quota_daily_tokens
+
+    def allows(self, scope: str) -> bool:
+        return "*" in self.scopes or scope in self.scopes
+
+
+# The single API_KEY from settings keeps working with every scope
+STATIC_IDENTITY = KeyIdentity("static", "static", frozenset({"*"}))
+
+
+def _identity(row: Any) -> KeyIdentity:
+    return KeyIdentity(
+        row.id,
+        row.name,
+        frozenset(row.scopes or ()),
+        row.priority or "default",
+        row.rate_limit_per_min,
+        row.quota_tpm,
+        row.quota_daily_tokens,
+    )
+
+
+class KeyStore:
+    """Verifies keys against ``api_keys`` with an in-memory cache.
+
+    Cache entries are keyed by a fast digest of the presented key, so a hit
+    costs one blake2b and a dict lookup: no DB query and no PBKDF2. Misses
+    (and unknown keys, cached for ``negative_ttl``) are resolved on a worker
+    thread. Every ``poll_seconds`` a background refresh drops cached entries
+    for keys revoked since the last poll; revocations through this process
+    take effect immediately.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 30.0,
+        negative_ttl: float = 5.0,
+        poll_seconds: float = 5.0,
+        max_entries: int = MAX_CACHE_ENTRIES,
+    ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.poll_seconds = poll_seconds
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[bytes, Tuple[Optional[KeyIdentity], float]]" = OrderedDict()
+        self._active_keys: Optional[int] = None
+        self._polled_at = 0.0
+        self._polled_wall: Optional[datetime] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def enabled(self) -> bool:
+        """True once at least one active key exists (checked on the first call, then polled)."""
+        if self._active_keys is None:
+            await self.refresh()
+        else:
+            self._maybe_refresh()
+        return bool(self._active_keys)
+
+    async def refresh(self) -> None:
+        # The query runs on a thread; the cache is only touched on the event loop
+        for key_id in await asyncio.to_thread(self._refresh):
+            self.invalidate(key_id)
+
+    async def authenticate(self, provided: str) -> Optional[KeyIdentity]:
+        digest = hashlib.blake2b(provided.encode(), digest_size=16).digest()
+        now = time.monotonic()
+        cached = self._cache.get(digest)
+        if cached is not None and cached[1] > now:
+            self.hits += 1
+            self._maybe_refresh()
+            return cached[0]
+        self.misses += 1
+        identity = await asyncio.to_thread(self._lookup, provided)
+        self._cache[digest] = (identity, now + (self.ttl if identity is not None else self.negative_ttl))
+        self._cache.move_to_end(digest)
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return identity
+
+    def invalidate(self, key_id: str) -> None:
+        for digest in [d for d, (ident, _) in self._cache.items() if ident is not None and ident.id == key_id]:
+            del self._cache[digest]
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._active_keys = None
+
+    def _lookup(self, provided: str) -> Optional[KeyIdentity]:
+        from .db.base import get_session
+        from .db.models import ApiKey
+
+        prefix = parse_prefix(provided)
+        if prefix is None:
+            return None
+        db = get_session()
+        try:
+            row = db.execute(select(ApiKey).where(ApiKey.prefix == prefix)).scalar_one_or_none()
+            if row is None or row.revoked_at is not None:
+                return None
+            if row.expires_at is not None and row.expires_at <= datetime.utcnow():
+                return None
+            return _identity(row) if verify_key(provided, row.key_hash) else None
+        finally:
+            db.close()
+
+    def _maybe_refresh(self) -> None:
+        if time.monotonic() - self._polled_at < self.poll_seconds:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._polled_at = time.monotonic()
+            self._refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+
+    def _refresh(self) -> List[str]:
+        """Count active keys and return ids revoked or expired since the last poll."""
+        from .db.base import get_session
+        from .db.models import ApiKey
+
+        now = datetime.utcnow()
+        changed: List[str] = []
+        db = get_session()
+        try:
+            self._active_keys = db.execute(
+                select(func.count()).select_from(ApiKey).where(ApiKey.revoked_at.is_(None))
+            ).scalar_one()
+            if self._polled_wall is not None:
+                # Small overlap so a revocation committed during the last poll is not missed
+                since = self._polled_wall - timedelta(seconds=1)
+                changed = list(db.execute(
+                    select(ApiKey.id).where(
+                        ((ApiKey.revoked_at >= since) & (ApiKey.revoked_at.is_not(None)))
+                        | ((ApiKey.expires_at >= since) & (ApiKey.expires_at <= now))
+                    )
+                ).scalars())
+        except Exception as exc:  # noqa: B902
+            logger.warning("api_key_refresh_failed", error=str(exc))
+            if self._active_keys is None:
+                self._active_keys = 0
+        finally:
+            db.close()
+        self._polled_wall = now
+        self._polled_at = time.monotonic()
+        return changed
+
+    # Management (sync; call from a worker thread or the CLI)
+
+    def create_key(
+        self,
+        name: str,
+        scopes: List[str],
+        priority: str = "default",
+        rate_limit_per_min: Optional[int] = None,
+        quota_tpm: Optional[int] = None,
+        quota_daily_tokens: Optional[int] = None,
+        expires_at: Optional[datetime] = None,
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Create a key and return ``(plaintext, description)``; the plaintext is not stored."""
+        from .db.base import get_session
+        from .db.models import ApiKey
+
+        plaintext, prefix = generate_key()
+        db = get_session()
+        try:
+            row = ApiKey(
+                name=name,
+                prefix=prefix,
+                key_hash=hash_key(plaintext),
+                scopes=sorted(set(scopes)),
+                priority=priority,
+                rate_limit_per_min=rate_limit_per_min,
+                quota_tpm=quota_tpm,
+                quota_daily_tokens=quota_daily_tokens,
+                expires_at=expires_at,
+            )
+            db.add(row)
+            db.commit()
+            info = describe_key(row)
+        finally:
+            db.close()
+        self._active_keys = (self._active_keys or 0) + 1
+        return plaintext, info
+
+    def revoke_key(self, key_id: str) -> Optional[Dict[str, Any]]:
+        """Mark a key revoked; callers on the event loop should then ``invalidate`` it."""
+        from .db.base import get_session
+        from .db.models import ApiKey
+
+        db = get_session()
+        try:
+            row = db.get(ApiKey, key_id)
+            if row is None:
+                return None
+            if row.revoked_at is None:
+                row.revoked_at = datetime.utcnow()
+                db.commit()
+            info = describe_key(row)
+        finally:
+            db.close()
+        self._active_keys = None
+        return info
+
+    def list_keys(self) -> List[Dict[str, Any]]:
+        from .db.base import get_session
+        from .db.models import ApiKey
+
+        db = get_session()
+        try:
+            return [describe_key(row) for row in db.execute(select(ApiKey).order_by(ApiKey.created_at)).scalars()]
+        finally:
+            db.close()
+
+
+def describe_key(row: Any) -> Dict[str, Any]:
+    return {
+        "id": row.id,
+        "name": row.name,
+        "prefix": row.prefix,
+        "scopes": list(row.scopes or []),
+        "priority": row.priority,
+        "rate_limit_per_min": row.rate_limit_per_min,
+        "quota_tpm": row.quota_tpm,
+        "quota_daily_tokens": row.quota_daily_tokens,
+        "created_at": row.created_at,
+        "expires_at": row.expires_at,
+        "revoked_at": row.revoked_at,
+    }
+
+
+_store: Optional[KeyStore] = None
+
+
+def configure_key_store() -> KeyStore:
+    global _store
+    s = get_settings()
+    _store = KeyStore(s.api_key_cache_ttl_seconds, s.api_key_negative_ttl_seconds, s.api_key_poll_seconds)
+    return _store
+
+
+def get_key_store() -> KeyStore:
+    return _store if _store is not None else configure_key_store()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage gateway API keys")
+    sub = parser.add_subparsers(dest="command", required=True)
+    create = sub.add_parser("create")
+    create.add_argument("--name", required=True)
+    create.add_argument("--scopes", default="chat,embeddings", help="Comma-separated, or * for all")
+    create.add_argument("--priority", default="default")
+    create.add_argument("--rate-limit-per-min", type=int)
+    create.add_argument("--quota-tpm", type=int)
+    create.add_argument("--quota-daily-tokens", type=int)
+    create.add_argument("--expires-days", type=int)
+    sub.add_parser("list")
+    revoke = sub.add_parser("revoke")
+    revoke.add_argument("key_id")
+    args = parser.parse_args()
+
+    from .db.base import create_all
+
+    create_all()
+    store = get_key_store()
+    if args.command == "create":
+        expires = datetime.utcnow() + timedelta(days=args.expires_days) if args.expires_days else None
+        plaintext, info = store.create_key(
+            args.name,
+            [s.strip() for s in args.scopes.split(",") if s.strip()],
+            args.priority,
+            args.rate_limit_per_min,
+            args.quota_tpm,
+            args.quota_daily_tokens,
+            expires,
+        )
+        print(json.dumps({"key": plaintext, **info}, default=str))
+    elif args.command == "list":
+        print(json.dumps(store.list_keys(), default=str))
+    else:
+        info = store.revoke_key(args.key_id)
+        if info is None:
+            raise SystemExit(f"No such key: {args.key_id}")
+        print(json.dumps(info, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import time
 from typing import Any, Dict
 
 import httpx
@@ -7,6 +8,8 @@ from fastapi import HTTPException, status
 
 from ..config import get_settings
 from ..deps import route_registry
+from ..metrics import observe_upstream
+from ..tracing import span, trace_headers
 
 
 class UpstreamError(Exception):
@@ -29,41 +32,73 @@ def _map_upstream_error(exc: Exception) -> HTTPException:
 
 async def list_models(route_key: str) -> Dict[str, Any]:
     client = route_registry.get_client(route_key)
-    try:
-        resp = await client.get("/models")
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as exc:  # noqa: B902
-        raise _map_upstream_error(exc)  # type: ignore[misc]
+    with span("upstream.models", route=route_key):
+        started = time.perf_counter()
+        try:
+            resp = await client.get("/models", headers=trace_headers())
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as exc:  # noqa: B902
+            observe_upstream(route_key, None, "models", started, exc)
+            raise _map_upstream_error(exc)  # type: ignore[misc]
+        observe_upstream(route_key, None, "models", started)
+        return data
 
 
 async def create_chat_completion(route_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     client = route_registry.get_client(route_key)
-    try:
-        resp = await client.post("/chat/completions", json=payload)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as exc:  # noqa: B902
-        raise _map_upstream_error(exc)  # type: ignore[misc]
+    with span("upstream.chat", route=route_key, model=payload.get("model")):
+        started = time.perf_counter()
+        try:
+            resp = await client.post("/chat/completions", json=payload, headers=trace_headers())
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as exc:  # noqa: B902
+            observe_upstream(route_key, payload.get("model"), "chat", started, exc)
+            raise _map_upstream_error(exc)  # type: ignore[misc]
+        observe_upstream(route_key, payload.get("model"), "chat", started)
+        return data
 
 
 async def stream_chat_completion(route_key: str, payload: Dict[str, Any]) -> httpx.Response:
     client = route_registry.get_client(route_key)
-    # Build request and send with stream=True so caller can iterate lines
-    try:
-        request = client.build_request("POST", "/chat/completions", json=payload)
-        resp = await client.send(request, stream=True, timeout=httpx.Timeout(None, read=get_settings().read_timeout_seconds))
-        resp.raise_for_status()
+    with span("upstream.chat_stream", route=route_key, model=payload.get("model")):
+        started = time.perf_counter()
+        # Build request and send with stream=True so caller can iterate lines
+        try:
+            request = client.build_request(
+                "POST",
+                "/chat/completions",
+                json=payload,
+                headers=trace_headers(),
+                timeout=httpx.Timeout(None, read=get_settings().read_timeout_seconds),
+            )
+            resp = await client.send(request, stream=True)
+            if resp.is_error:
+                try:
+                    # Read the error body for the mapped detail
+                    await resp.aread()
+                finally:
+                    # Nobody relays this response: close it to free the connection and in-flight slot
+                    await resp.aclose()
+                resp.raise_for_status()
+        except Exception as exc:  # noqa: B902
+            observe_upstream(route_key, payload.get("model"), "chat_stream", started, exc)
+            raise _map_upstream_error(exc)  # type: ignore[misc]
+        observe_upstream(route_key, payload.get("model"), "chat_stream", started)
         return resp
-    except Exception as exc:  # noqa: B902
-        raise _map_upstream_error(exc)  # type: ignore[misc]
 
 
 async def create_embedding(route_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     client = route_registry.get_client(route_key)
-    try:
-        resp = await client.post("/embeddings", json=payload)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as exc:  # noqa: B902
-        raise _map_upstream_error(exc)  # type: ignore[misc]
+    with span("upstream.embeddings", route=route_key, model=payload.get("model")):
+        started = time.perf_counter()
+        try:
+            resp = await client.post("/embeddings", json=payload, headers=trace_headers())
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as exc:  # noqa: B902
+            observe_upstream(route_key, payload.get("model"), "embeddings", started, exc)
+            raise _map_upstream_error(exc)  # type: ignore[misc]
+        observe_upstream(route_key, payload.get("model"), "embeddings", started)
+        return data
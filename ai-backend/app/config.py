@@ -15,6 +15,30 @@ def _parse_csv(value: Optional[str]) -> List[str]:
     return [item.strip() for item in value.split(",") if item.strip()]
 
 
+def _parse_int_map(value: Optional[str]) -> Dict[str, int]:
+    """Parse ``name=int`` pairs, e.g. ``"chat=20,embeddings=120"``; invalid items are skipped."""
+    result: Dict[str, int] = {}
+    for item in _parse_csv(value):
+        name, _, number = item.rpartition("=")
+        try:
+            result[name.strip()] = int(number)
+        except ValueError:
+            continue
+    return result
+
+
+def _parse_float_map(value: Optional[str]) -> Dict[str, float]:
+    """Parse ``name=float`` pairs, e.g. ``"/api/chat/stream=0.1"``; invalid items are skipped."""
+    result: Dict[str, float] = {}
+    for item in _parse_csv(value):
+        name, _, number = item.rpartition("=")
+        try:
+            result[name.strip()] = float(number)
+        except ValueError:
+            continue
+    return result
+
+
 def find_free_port(start_port: int = 5050, max_attempts: int = 100) -> int:
     """Find a free port starting from start_port"""
     for port in range(start_port, start_port + max_attempts):
@@ -34,6 +58,40 @@ class Settings(BaseSettings):
     api_port: int = Field(default_factory=lambda: int(os.getenv("API_PORT", os.getenv("PORT", 5050))))
     host: str = Field(default=os.getenv("HOST", "0.0.0.0"))
     log_level: str = Field(default=os.getenv("LOG_LEVEL", "INFO"))
+    # Logs are queued and written by a background thread (false => inline stdout)
+    log_async: bool = Field(default=os.getenv("LOG_ASYNC", "true").lower() in {"1", "true", "yes"})
+    log_queue_size: int = Field(default=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    # Fraction of successful requests logged; per path prefix overrides, e.g. "/api/models=0.01"
+    log_sample_rate: float = Field(default=float(os.getenv("LOG_SAMPLE_RATE", "1.0")))
+    log_sample_rates: str = Field(default=os.getenv("LOG_SAMPLE_RATES", ""))
+    # Requests at least this slow are always logged
+    log_slow_ms: int = Field(default=int(os.getenv("LOG_SLOW_MS", "1000")))
+
+    # Event-loop lag monitor: lag is sampled every LOOP_LAG_INTERVAL_MS; a
+    # watchdog thread logs the loop's stack when it is blocked longer than
+    # LOOP_BLOCK_THRESHOLD_MS. LOOP_DEBUG_BLOCKING flags sync DB/gzip/Redis
+    # calls made on the loop thread (adds overhead; for debugging)
+    loop_monitor_enable: bool = Field(default=os.getenv("LOOP_MONITOR_ENABLE", "true").lower() in {"1", "true", "yes"})
+    loop_lag_interval_ms: float = Field(default=float(os.getenv("LOOP_LAG_INTERVAL_MS", "100")))
+    loop_block_threshold_ms: float = Field(default=float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "250")))
+    loop_debug_blocking: bool = Field(default=os.getenv("LOOP_DEBUG_BLOCKING", "false").lower() in {"1", "true", "yes"})
+    # Profiling: admin-triggered sampling profiles; per-request capture over PROFILE_SLOW_MS (0 => off).
+    # Off unless PROFILER_ENABLED, since profiles expose stack frames and the
+    # admin endpoints are open when AUTH_REQUIRED=false
+    profiler_enabled: bool = Field(default=os.getenv("PROFILER_ENABLED", "false").lower() in {"1", "true", "yes"})
+    profile_interval_ms: float = Field(default=float(os.getenv("PROFILE_INTERVAL_MS", "10")))
+    profile_slow_ms: float = Field(default=float(os.getenv("PROFILE_SLOW_MS", "0")))
+    profile_max_captures: int = Field(default=int(os.getenv("PROFILE_MAX_CAPTURES", "50")))
+    profile_max_seconds: float = Field(default=float(os.getenv("PROFILE_MAX_SECONDS", "60")))
+
+    # Tracing: spans are buffered per request and kept (tail sampling) when the
+    # request failed, was at least TRACE_SLOW_MS, or won the TRACE_SAMPLE_RATE draw
+    trace_enable: bool = Field(default=os.getenv("TRACE_ENABLE", "false").lower() in {"1", "true", "yes"})
+    trace_sample_rate: float = Field(default=float(os.getenv("TRACE_SAMPLE_RATE", "0.01")))
+    trace_slow_ms: float = Field(default=float(os.getenv("TRACE_SLOW_MS", "1000")))
+    trace_exporter: str = Field(default=os.getenv("TRACE_EXPORTER", "memory").lower())  # memory|file
+    trace_file: str = Field(default=os.getenv("TRACE_FILE", "./data/traces.jsonl"))
+    trace_memory_max: int = Field(default=int(os.getenv("TRACE_MEMORY_MAX", "200")))
     
     # Dynamic Port Allocation
     auto_find_port: bool = Field(default=os.getenv("AUTO_FIND_PORT", "false").lower() in {"1", "true", "yes"})
@@ -47,14 +105,42 @@ class Settings(BaseSettings):
     api_key: Optional[str] = Field(default=os.getenv("API_KEY"))
     auth_required: bool = Field(default=os.getenv("AUTH_REQUIRED", "true").lower() in {"1", "true", "yes"})
     metrics_public: bool = Field(default=os.getenv("METRICS_PUBLIC", "false").lower() in {"1", "true", "yes"})
+    # Issued keys (api_keys table): verified keys are cached in memory
+    api_key_cache_ttl_seconds: float = Field(default=float(os.getenv("API_KEY_CACHE_TTL_SECONDS", "30")))
+    api_key_negative_ttl_seconds: float = Field(default=float(os.getenv("API_KEY_NEGATIVE_TTL_SECONDS", "5")))
+    # How often each worker polls for revoked keys
+    api_key_poll_seconds: float = Field(default=float(os.getenv("API_KEY_POLL_SECONDS", "5")))
+    api_key_hash_iterations: int = Field(default=int(os.getenv("API_KEY_HASH_ITERATIONS", "100000")))
 
     # Prometheus
     prometheus_enable: bool = Field(default=os.getenv("PROMETHEUS_ENABLE", "true").lower() in {"1", "true", "yes"})
 
     # Rate limiting
     rate_limit_per_minute: int = Field(default=int(os.getenv("RATE_LIMIT_PER_MIN", "60")))
+    # Comma-separated key parts: ip, api_key, path (the endpoint class is always included)
+    rate_limit_key: str = Field(default=os.getenv("RATE_LIMIT_KEY", "ip"))
+    # Per endpoint class limits, e.g. "chat=20,embeddings=120,admin=10" (requests/min)
+    rate_limit_classes: str = Field(default=os.getenv("RATE_LIMIT_CLASSES", ""))
+    # Multipliers of the class limit per API key priority, e.g. "high=4,low=0.5"
+    rate_limit_priorities: str = Field(default=os.getenv("RATE_LIMIT_PRIORITIES", ""))
+    rate_limit_max_keys: int = Field(default=int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
     use_redis: bool = Field(default=os.getenv("USE_REDIS", "false").lower() in {"1", "true", "yes"})
     redis_url: Optional[str] = Field(default=os.getenv("REDIS_URL"))
+    rate_limit_redis_timeout_ms: float = Field(default=float(os.getenv("RATE_LIMIT_REDIS_TIMEOUT_MS", "100")))
+    # Max tokens one instance takes per Redis call for a busy client
+    rate_limit_lease_size: int = Field(default=int(os.getenv("RATE_LIMIT_LEASE_SIZE", "10")))
+    rate_limit_lease_ttl_ms: float = Field(default=float(os.getenv("RATE_LIMIT_LEASE_TTL_MS", "1000")))
+    # Allow requests when Redis is unreachable (false => reject with 429)
+    rate_limit_fail_open: bool = Field(default=os.getenv("RATE_LIMIT_FAIL_OPEN", "true").lower() in {"1", "true", "yes"})
+
+    # Token quotas per API key (or client IP) and model; 0 => unlimited
+    quota_enable: bool = Field(default=os.getenv("QUOTA_ENABLE", "false").lower() in {"1", "true", "yes"})
+    quota_tpm: int = Field(default=int(os.getenv("QUOTA_TPM", "0")))
+    quota_daily_tokens: int = Field(default=int(os.getenv("QUOTA_DAILY_TOKENS", "0")))
+    # Per-model overrides, e.g. "meta-llama/Llama-3-70B=20000,TinyLlama/TinyLlama-1.1B-Chat-v1.0=200000"
+    quota_model_tpm: str = Field(default=os.getenv("QUOTA_MODEL_TPM", ""))
+    quota_model_daily: str = Field(default=os.getenv("QUOTA_MODEL_DAILY", ""))
+    quota_flush_seconds: float = Field(default=float(os.getenv("QUOTA_FLUSH_SECONDS", "10")))
 
     # vLLM routing
     default_model_key: str = Field(default=os.getenv("DEFAULT_MODEL_KEY", ""))
@@ -72,14 +158,80 @@ class Settings(BaseSettings):
     write_timeout_seconds: float = Field(default=float(os.getenv("WRITE_TIMEOUT_SECONDS", "60")))
     total_timeout_seconds: float = Field(default=float(os.getenv("TOTAL_TIMEOUT_SECONDS", "180")))
 
+    # Upstream connection pools (one per route and worker), opened and warmed at startup
+    upstream_max_connections: int = Field(default=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200")))
+    upstream_max_keepalive: int = Field(default=int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "50")))
+    upstream_keepalive_expiry_seconds: float = Field(default=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY_SECONDS", "30")))
+    # Wait for a free pooled connection at most this long (0 => no limit)
+    upstream_pool_timeout_seconds: float = Field(default=float(os.getenv("UPSTREAM_POOL_TIMEOUT_SECONDS", "30")))
+    # HTTP/2 to every route (or per route with ?http2=1); needs the h2 package
+    upstream_http2: bool = Field(default=os.getenv("UPSTREAM_HTTP2", "false").lower() in {"1", "true", "yes"})
+    upstream_http2_max_connections: int = Field(default=int(os.getenv("UPSTREAM_HTTP2_MAX_CONNECTIONS", "4")))
+    upstream_warm_connections: int = Field(default=int(os.getenv("UPSTREAM_WARM_CONNECTIONS", "2")))
+
+    # Graceful shutdown: streams in progress get this long to finish after SIGTERM
+    shutdown_drain_seconds: float = Field(default=float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "30")))
+
+    # Runtime routes: JSON file watched by every worker (and written by /admin/routes)
+    routes_file: str = Field(default=os.getenv("ROUTES_FILE", ""))
+    routes_poll_seconds: float = Field(default=float(os.getenv("ROUTES_POLL_SECONDS", "2")))
+    # A removed route's pool is closed when idle, or after this long regardless
+    route_drain_seconds: float = Field(default=float(os.getenv("ROUTE_DRAIN_SECONDS", "300")))
+
+    # Streams fail over to another replica of the model until the first token arrives
+    stream_failover: bool = Field(default=os.getenv("STREAM_FAILOVER", "true").lower() in {"1", "true", "yes"})
+    stream_ttft_timeout_seconds: float = Field(default=float(os.getenv("STREAM_TTFT_TIMEOUT_SECONDS", "10")))
+    # Per-route TTFT deadlines, e.g. "big-gpu=30,small=5"
+    stream_ttft_timeout_routes: str = Field(default=os.getenv("STREAM_TTFT_TIMEOUT_ROUTES", ""))
+    stream_failover_max_attempts: int = Field(default=int(os.getenv("STREAM_FAILOVER_MAX_ATTEMPTS", "3")))
+    # Retries allowed per 10s: this fraction of streams started, and at least STREAM_RETRY_BUDGET_MIN
+    stream_retry_budget_ratio: float = Field(default=float(os.getenv("STREAM_RETRY_BUDGET_RATIO", "0.2")))
+    stream_retry_budget_min: int = Field(default=int(os.getenv("STREAM_RETRY_BUDGET_MIN", "5")))
+
+    # Fallback chains under overload, e.g. "org/llama-70b>org/llama-8b>tiny,mixtral>mistral-7b"
+    fallback_models: str = Field(default=os.getenv("MODEL_FALLBACKS", ""))
+    # Triggers besides "no healthy replica" (0 => off)
+    fallback_max_in_flight: int = Field(default=int(os.getenv("MODEL_FALLBACK_MAX_IN_FLIGHT", "0")))
+    fallback_ttft_slo_ms: float = Field(default=float(os.getenv("MODEL_FALLBACK_TTFT_SLO_MS", "0")))
+    # A route's TTFT average is ignored once it has had no new sample for this long
+    fallback_ttft_max_age_seconds: float = Field(default=float(os.getenv("MODEL_FALLBACK_TTFT_MAX_AGE_SECONDS", "30")))
+
+    # Background route health checks (probes read the cached result)
+    health_check_interval_seconds: float = Field(default=float(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "5")))
+    health_check_timeout_seconds: float = Field(default=float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", "2")))
+
     # Database
     database_url: str = Field(default=os.getenv("DATABASE_URL", "sqlite:///./data/ai_backend.db"))
     db_echo: bool = Field(default=os.getenv("DB_ECHO", "false").lower() in {"1", "true", "yes"})
+    # Per-statement timing (GET /api/admin/queries) and the slow-query log
+    db_query_stats: bool = Field(default=os.getenv("DB_QUERY_STATS", "true").lower() in {"1", "true", "yes"})
+    db_slow_query_ms: float = Field(default=float(os.getenv("DB_SLOW_QUERY_MS", "250")))
+    db_query_stats_max: int = Field(default=int(os.getenv("DB_QUERY_STATS_MAX", "500")))
+
+    # Backups & snapshots
+    backup_dir: str = Field(default=os.getenv("BACKUP_DIR", "./data/backups"))
+    snapshot_pages_per_step: int = Field(default=int(os.getenv("SNAPSHOT_PAGES_PER_STEP", "256")))
+    snapshot_step_sleep_ms: float = Field(default=float(os.getenv("SNAPSHOT_STEP_SLEEP_MS", "5")))
+
+    # Retention & compaction (0 days => keep forever)
+    retention_enable: bool = Field(default=os.getenv("RETENTION_ENABLE", "false").lower() in {"1", "true", "yes"})
+    retention_interval_seconds: float = Field(default=float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600")))
+    retention_raw_days: int = Field(default=int(os.getenv("RETENTION_RAW_DAYS", "0")))
+    retention_archive_days: int = Field(default=int(os.getenv("RETENTION_ARCHIVE_DAYS", "0")))
+    retention_batch_size: int = Field(default=int(os.getenv("RETENTION_BATCH_SIZE", "500")))
+    archive_dir: str = Field(default=os.getenv("ARCHIVE_DIR", "./data/archive"))
+    vacuum_pages_per_step: int = Field(default=int(os.getenv("VACUUM_PAGES_PER_STEP", "256")))
+    vacuum_step_sleep_ms: float = Field(default=float(os.getenv("VACUUM_STEP_SLEEP_MS", "20")))
 
     # Development
     debug: bool = Field(default=os.getenv("DEBUG", "false").lower() in {"1", "true", "yes"})
     reload: bool = Field(default=os.getenv("RELOAD", "true").lower() in {"1", "true", "yes"})
 
+    # Production: worker processes started by start_server.py --prod (uvicorn pre-fork supervisor)
+    workers: int = Field(default=int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", "1"))))
+    # Where workers share the model catalog and elect a retention leader (set by start_server.py)
+    shared_state_dir: Optional[str] = Field(default=os.getenv("SHARED_STATE_DIR"))
+
     def get_available_port(self) -> int:
         """Get an available port, either from config or by finding a free one"""
         if self.auto_find_port:
@@ -107,6 +259,44 @@ class Settings(BaseSettings):
         """Get allow_origins as a list"""
         return _parse_csv(self.allow_origins)
 
+    @property
+    def rate_limit_key_list(self) -> List[str]:
+        return [part.lower() for part in _parse_csv(self.rate_limit_key)]
+
+    @property
+    def rate_limit_classes_map(self) -> Dict[str, int]:
+        return {name.lower(): max(1, limit) for name, limit in _parse_int_map(self.rate_limit_classes).items()}
+
+    @property
+    def rate_limit_priorities_map(self) -> Dict[str, float]:
+        return {name.lower(): factor for name, factor in _parse_float_map(self.rate_limit_priorities).items() if factor > 0}
+
+    @property
+    def fallback_chains(self) -> Dict[str, List[str]]:
+        """Model -> fallback models in order, from ``a>b>c`` chains."""
+        chains: Dict[str, List[str]] = {}
+        for item in _parse_csv(self.fallback_models):
+            models = [m.strip() for m in item.split(">") if m.strip()]
+            if len(models) > 1:
+                chains[models[0]] = models[1:]
+        return chains
+
+    def stream_ttft_timeout_for(self, route_key: str) -> float:
+        routes = {k.lower(): v for k, v in _parse_float_map(self.stream_ttft_timeout_routes).items()}
+        return routes.get(route_key.lower(), self.stream_ttft_timeout_seconds)
+
+    @property
+    def log_sample_rates_map(self) -> Dict[str, float]:
+        return _parse_float_map(self.log_sample_rates)
+
+    @property
+    def quota_model_tpm_map(self) -> Dict[str, int]:
+        return _parse_int_map(self.quota_model_tpm)
+
+    @property
+    def quota_model_daily_map(self) -> Dict[str, int]:
+        return _parse_int_map(self.quota_model_daily)
+
     @property
     def allowed_models_list(self) -> List[str]:
         """Get allowed_models as a list"""
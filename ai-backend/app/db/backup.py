@@ -0,0 +1,493 @@
+from __future__ import annotations
+
+import base64
+import json
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional
+
+import structlog
+from sqlalchemy import DateTime, LargeBinary, delete, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .base import create_fts_triggers, drop_fts_triggers, rebuild_fts
+from .models import Conversation, Message, MessageStream, Tombstone
+
+try:
+    import zstandard  # type: ignore
+except Exception:  # pragma: no cover
+    zstandard = None  # type: ignore
+
+
+logger = structlog.get_logger()
+
+
+EXPORT_FORMAT_VERSION = 1
+
+# Columns holding gz-compressed raw payloads; only exported when explicitly requested
+BLOB_COLUMNS = {"raw_request_gzip", "raw_response_gzip", "raw_sse_gzip"}
+
+# Watermarks are moved back by this much so rows committed while an export
+# was starting are picked up by the next one; re-applying them is idempotent
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+# SQLite imports writing more rows than this drop the FTS triggers and
+# rebuild the index once at the end; smaller ones keep the triggers
+FTS_SUSPEND_ROWS = 5000
+
+# Flush compressed output in chunks of roughly this size
+_CHUNK_BYTES = 64 * 1024
+
+_RECORD_MODELS = (
+    ("conversation", Conversation),
+    ("message", Message),
+    ("stream", MessageStream),
+)
+
+# Keys used by the legacy single-document JSON export
+_LEGACY_KEYS = {"conversations": "conversation", "messages": "message", "streams": "stream"}
+
+# Values applied to NOT NULL columns missing from an imported record
+_IMPORT_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "conversation": {"pinned": False},
+    "message": {"role": "user", "status": "completed"},
+    "stream": {"raw_sse_gzip": b""},
+}
+
+# Records must reference an id; messages/streams also need their parent
+_REQUIRED_KEYS = {
+    "conversation": ("id",),
+    "message": ("id", "conversation_id"),
+    "stream": ("id", "message_id"),
+}
+
+
+# Foreign keys of each record type: (key, parent record type)
+_PARENT_KEYS = {
+    "message": (("conversation_id", "conversation"), ("parent_id", "message")),
+    "stream": (("message_id", "message"),),
+}
+
+
+def available_codecs() -> List[str]:
+    codecs = ["none", "gzip"]
+    if zstandard is not None:
+        codecs.append("zstd")
+    return codecs
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    raise TypeError(f"Unserializable value of type {type(value).__name__}")
+
+
+def _export_columns(model: Any, include_blobs: bool) -> List[Any]:
+    cols = model.__table__.columns
+    return [c for c in cols if include_blobs or c.name not in BLOB_COLUMNS]
+
+
+def _change_column(model: Any) -> Any:
+    # Streams are immutable so their creation time is their change time
+    if model is MessageStream:
+        return MessageStream.__table__.c.created_at
+    return model.__table__.c.updated_at
+
+
+def iter_export_records(
+    db: Session,
+    include_blobs: bool = False,
+    batch_size: int = 1000,
+    since: Optional[datetime] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yield export records one row at a time using server-side batches.
+
+    Rows are read with Core selects (no ORM identity map) and ``yield_per`` so
+    memory use is bounded by ``batch_size`` regardless of table size. With
+    ``since`` only rows changed at or after the watermark are exported, followed
+    by ``delete`` records for rows removed since then.
+    """
+    watermark = datetime.utcnow() - WATERMARK_OVERLAP
+    yield {
+        "type": "header",
+        "version": EXPORT_FORMAT_VERSION,
+        "exported_at": datetime.utcnow().isoformat(),
+        "include_blobs": include_blobs,
+        "since": since.isoformat() if since else None,
+        "watermark": watermark.isoformat(),
+    }
+    for record_type, model in _RECORD_MODELS:
+        cols = _export_columns(model, include_blobs)
+        stmt = select(*cols).execution_options(stream_results=True, yield_per=batch_size)
+        if since is not None:
+            stmt = stmt.where(_change_column(model) >= since)
+        for row in db.execute(stmt):
+            yield {"type": record_type, "data": dict(row._mapping)}
+    if since is None:
+        return
+    tomb = Tombstone.__table__
+    stmt = (
+        select(tomb.c.entity, tomb.c.entity_id, tomb.c.deleted_at)
+        .where(tomb.c.deleted_at >= since)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for entity, entity_id, deleted_at in db.execute(stmt):
+        yield {"type": "delete", "data": {"entity": entity, "id": entity_id, "deleted_at": deleted_at}}
+
+
+def iter_ndjson(records: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    for record in records:
+        yield json.dumps(record, default=_json_default, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _make_compressor(codec: str) -> Optional[Any]:
+    if codec == "none":
+        return None
+    if codec == "gzip":
+        # wbits=31 => gzip container
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def iter_compressed(chunks: Iterable[bytes], codec: str = "none") -> Iterator[bytes]:
+    """Coalesce small chunks and compress them on the fly."""
+    compressor = _make_compressor(codec)
+    buf: List[bytes] = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size < _CHUNK_BYTES:
+            continue
+        data = b"".join(buf)
+        buf, size = [], 0
+        out = compressor.compress(data) if compressor is not None else data
+        if out:
+            yield out
+    data = b"".join(buf)
+    if compressor is not None:
+        out = compressor.compress(data) + compressor.flush()
+    else:
+        out = data
+    if out:
+        yield out
+
+
+def _make_decompressor(codec: str) -> Optional[Any]:
+    if codec == "none":
+        return None
+    if codec == "gzip":
+        # wbits=47 => auto-detect gzip or zlib header
+        return zlib.decompressobj(47)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+class NdjsonDecoder:
+    """Incrementally decompress and split a byte stream into JSON records."""
+
+    def __init__(self, codec: str = "none") -> None:
+        self._decompressor = _make_decompressor(codec)
+        self._tail = b""
+        self.lines = 0
+
+    def _parse(self, data: bytes) -> List[Dict[str, Any]]:
+        data = self._tail + data
+        parts = data.split(b"\n")
+        self._tail = parts.pop()
+        return [r for r in (self._parse_line(p) for p in parts) if r is not None]
+
+    def _parse_line(self, line: bytes) -> Optional[Dict[str, Any]]:
+        self.lines += 1
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            raise ValueError(f"Invalid JSON on line {self.lines}: {exc}") from None
+        if not isinstance(record, dict):
+            raise ValueError(f"Expected an object on line {self.lines}")
+        return record
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        if self._decompressor is not None:
+            chunk = self._decompressor.decompress(chunk)
+        return self._parse(chunk)
+
+    def close(self) -> List[Dict[str, Any]]:
+        rest = b""
+        if self._decompressor is not None and hasattr(self._decompressor, "flush"):
+            rest = self._decompressor.flush()
+        records = self._parse(rest)
+        tail, self._tail = self._tail, b""
+        last = self._parse_line(tail) if tail.strip() else None
+        return records + ([last] if last is not None else [])
+
+
+def iter_legacy_records(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Adapt the old ``{"conversations": [...], ...}`` document to records."""
+    for key, record_type in _LEGACY_KEYS.items():
+        for data in payload.get(key) or []:
+            yield {"type": record_type, "data": data}
+
+
+def _coerce_row(record_type: str, model: Any, data: Dict[str, Any]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {}
+    defaults = _IMPORT_DEFAULTS[record_type]
+    for col in model.__table__.columns:
+        value = data.get(col.name)
+        if value is None:
+            value = defaults.get(col.name)
+        if value is None and isinstance(col.type, DateTime) and not col.nullable:
+            value = datetime.utcnow()
+        elif isinstance(value, str) and isinstance(col.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif isinstance(value, str) and isinstance(col.type, LargeBinary):
+            value = base64.b64decode(value)
+        row[col.name] = value
+    return row
+
+
+def _upsert(conn: Connection, table: Any, rows: List[Dict[str, Any]], columns: FrozenSet[str]) -> int:
+    """Insert rows; existing ids only get ``columns`` overwritten with the incoming values."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert  # type: ignore[assignment]
+    else:
+        ids = [r["id"] for r in rows]
+        existing = {r[0] for r in conn.execute(select(table.c.id).where(table.c.id.in_(ids)))}
+        new_rows = [r for r in rows if r["id"] not in existing]
+        if new_rows:
+            conn.execute(table.insert(), new_rows)
+        if columns:
+            for r in rows:
+                if r["id"] in existing:
+                    conn.execute(update(table).where(table.c.id == r["id"]).values({c: r[c] for c in columns}))
+        return len(rows)
+    stmt = insert(table)
+    if not columns:
+        conn.execute(stmt.on_conflict_do_nothing(index_elements=["id"]), rows)
+        return len(rows)
+    updates = {c: stmt.excluded[c] for c in columns}
+    conn.execute(stmt.on_conflict_do_update(index_elements=["id"], set_=updates), rows)
+    return len(rows)
+
+
+def _apply_deletes(conn: Connection, deletes: Dict[str, List[str]]) -> int:
+    """Delete rows named by tombstones, children before parents."""
+    conv_t, msg_t, stream_t = Conversation.__table__, Message.__table__, MessageStream.__table__
+    conv_ids, msg_ids, stream_ids = deletes["conversation"], deletes["message"], deletes["stream"]
+    total = 0
+    if stream_ids:
+        total += conn.execute(delete(stream_t).where(stream_t.c.id.in_(stream_ids))).rowcount or 0
+    if conv_ids:
+        # Mirror the ORM cascade for conversations
+        msg_ids = msg_ids + [
+            r[0] for r in conn.execute(select(msg_t.c.id).where(msg_t.c.conversation_id.in_(conv_ids)))
+        ]
+    if msg_ids:
+        conn.execute(delete(stream_t).where(stream_t.c.message_id.in_(msg_ids)))
+        total += conn.execute(delete(msg_t).where(msg_t.c.id.in_(msg_ids))).rowcount or 0
+    if conv_ids:
+        total += conn.execute(delete(conv_t).where(conv_t.c.id.in_(conv_ids))).rowcount or 0
+    return total
+
+
+def _insert_ignore(conn: Connection, table: Any, rows: List[Dict[str, Any]]) -> int:
+    """Insert rows with executemany, skipping ids that already exist."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert  # type: ignore[assignment]
+    else:
+        ids = [r["id"] for r in rows]
+        existing = {r[0] for r in conn.execute(select(table.c.id).where(table.c.id.in_(ids)))}
+        rows = [r for r in rows if r["id"] not in existing]
+        if rows:
+            conn.execute(table.insert(), rows)
+        return len(rows)
+    result = conn.execute(insert(table).on_conflict_do_nothing(index_elements=["id"]), rows)
+    return max(result.rowcount or 0, 0)
+
+
+def _find_orphan(conn: Connection, pending: Dict[str, List[Dict[str, Any]]]) -> Optional[str]:
+    """Describe the first pending row whose parent is neither in the batch nor stored."""
+    batch_ids = {t: {d["id"] for d in rows} for t, rows in pending.items()}
+    models = dict(_RECORD_MODELS)
+    for record_type, refs in _PARENT_KEYS.items():
+        for key, parent_type in refs:
+            table = models[parent_type].__table__
+            wanted = {d[key] for d in pending[record_type] if d.get(key)} - batch_ids[parent_type]
+            if not wanted:
+                continue
+            stored = {r[0] for r in conn.execute(select(table.c.id).where(table.c.id.in_(wanted)))}
+            for data in pending[record_type]:
+                if data.get(key) in wanted - stored:
+                    return f"{record_type} {data['id']} references missing {parent_type} {data[key]}"
+    return None
+
+
+class BulkImporter:
+    """Buffers import records and writes them in chunked executemany transactions.
+
+    Rows whose id already exists are skipped, or overwritten when ``apply`` is
+    set, in which case only the columns a record carries are overwritten (never
+    blobs the export header says were left out); ``apply`` also replays
+    ``delete`` records from incremental exports.
+    Each batch is committed on its own, so a row's parent must be in the same
+    or an earlier batch (or already stored); otherwise ``flush`` raises
+    ``ValueError`` naming the row and that batch is rolled back. Once an
+    import on SQLite passes ``fts_suspend_rows`` rows the FTS triggers are
+    suspended and the index rebuilt once at the end.
+    """
+
+    def __init__(
+        self, engine: Engine, batch_size: int = 1000, apply: bool = False, fts_suspend_rows: int = FTS_SUSPEND_ROWS
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.apply = apply
+        # From the export header; blobs left out of an export must not be overwritten
+        self.include_blobs = True
+        self.fts_suspend_rows = fts_suspend_rows
+        self.fts_suspended = False
+        self.written = 0
+        self.deletes: Dict[str, List[str]] = {t: [] for t, _ in _RECORD_MODELS}
+        self.deleted = 0
+        self.is_sqlite = engine.dialect.name == "sqlite"
+        self.pending: Dict[str, List[Dict[str, Any]]] = {t: [] for t, _ in _RECORD_MODELS}
+        self.imported: Dict[str, int] = {t: 0 for t, _ in _RECORD_MODELS}
+        self.skipped: Dict[str, int] = {t: 0 for t, _ in _RECORD_MODELS}
+        self.invalid = 0
+        self.batches = 0
+        self._started = time.perf_counter()
+
+    def add(self, record: Dict[str, Any]) -> bool:
+        """Queue a record; returns True when a flush is due."""
+        record_type = record.get("type")
+        data = record.get("data")
+        if record_type == "header":
+            self.include_blobs = bool(record.get("include_blobs", True))
+            return False
+        if record_type == "delete" and self.apply and isinstance(data, dict):
+            if data.get("entity") in self.deletes and data.get("id"):
+                self.deletes[data["entity"]].append(data["id"])
+                return self._queued() >= self.batch_size
+            self.invalid += 1
+            return False
+        if record_type not in self.pending or not isinstance(data, dict):
+            # Header/unknown records are ignored
+            return False
+        if any(not data.get(k) for k in _REQUIRED_KEYS[record_type]):
+            self.invalid += 1
+            return False
+        self.pending[record_type].append(data)
+        return self._queued() >= self.batch_size
+
+    def _group_by_update_columns(
+        self, model: Any, batch: List[Dict[str, Any]], rows: List[Dict[str, Any]]
+    ) -> Dict[FrozenSet[str], List[Dict[str, Any]]]:
+        """Group coerced rows by the columns their record carried (blobs only if exported)."""
+        names = set(model.__table__.columns.keys()) - {"id"}
+        if not self.include_blobs:
+            names -= BLOB_COLUMNS
+        groups: Dict[FrozenSet[str], List[Dict[str, Any]]] = {}
+        for data, row in zip(batch, rows):
+            groups.setdefault(frozenset(names.intersection(data)), []).append(row)
+        return groups
+
+    def _queued(self) -> int:
+        return sum(len(v) for v in self.pending.values()) + sum(len(v) for v in self.deletes.values())
+
+    def flush(self) -> None:
+        queued = self._queued()
+        if not queued:
+            return
+        if self.is_sqlite and not self.fts_suspended and self.written + queued > self.fts_suspend_rows:
+            self.suspend_fts()
+        imported = dict(self.imported)
+        skipped = dict(self.skipped)
+        deleted = self.deleted
+        try:
+            with self.engine.begin() as conn:
+                if self.is_sqlite:
+                    # A message's parent_id may point later in the same batch; FKs are checked at commit
+                    conn.exec_driver_sql("PRAGMA defer_foreign_keys=ON")
+                # Parents first so FK checks pass within the transaction
+                for record_type, model in _RECORD_MODELS:
+                    batch = self.pending[record_type]
+                    if not batch:
+                        continue
+                    rows = [_coerce_row(record_type, model, d) for d in batch]
+                    if self.apply:
+                        inserted = 0
+                        for columns, group in self._group_by_update_columns(model, batch, rows).items():
+                            inserted += _upsert(conn, model.__table__, group, columns)
+                    else:
+                        inserted = _insert_ignore(conn, model.__table__, rows)
+                    imported[record_type] += inserted
+                    skipped[record_type] += len(rows) - inserted
+                if any(self.deletes.values()):
+                    deleted += _apply_deletes(conn, self.deletes)
+        except IntegrityError as exc:
+            with self.engine.connect() as conn:
+                orphan = _find_orphan(conn, self.pending)
+            raise ValueError(f"Batch {self.batches + 1} rolled back: {orphan or exc.orig}") from exc
+        finally:
+            self.pending = {t: [] for t, _ in _RECORD_MODELS}
+            self.deletes = {t: [] for t, _ in _RECORD_MODELS}
+        self.imported, self.skipped, self.deleted = imported, skipped, deleted
+        self.written += queued
+        self.batches += 1
+        logger.info(
+            "backup_import_progress",
+            batches=self.batches,
+            imported=self.imported,
+            skipped=self.skipped,
+            elapsed_ms=self.elapsed_ms,
+        )
+
+    def suspend_fts(self) -> None:
+        if self.is_sqlite and not self.fts_suspended:
+            with self.engine.begin() as conn:
+                drop_fts_triggers(conn)
+            self.fts_suspended = True
+
+    def restore_fts(self) -> None:
+        """Recreate the FTS triggers and rebuild the index, if they were suspended."""
+        if self.fts_suspended:
+            # Recreate triggers and rebuild atomically so no concurrent write is missed
+            with self.engine.begin() as conn:
+                create_fts_triggers(conn)
+                rebuild_fts(conn)
+            self.fts_suspended = False
+
+    @property
+    def elapsed_ms(self) -> int:
+        return int((time.perf_counter() - self._started) * 1000)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "imported": self.imported,
+            "skipped": self.skipped,
+            "deleted": self.deleted,
+            "invalid": self.invalid,
+            "batches": self.batches,
+            "elapsed_ms": self.elapsed_ms,
+        }
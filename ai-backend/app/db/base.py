@@ -29,6 +29,12 @@ def init_engine() -> None:
 
     _engine = create_engine(url, echo=settings.db_echo, pool_pre_ping=True, connect_args=connect_args)
 
+    from .querystats import get_query_stats
+
+    query_stats = get_query_stats()
+    if query_stats is not None:
+        query_stats.install(_engine)
+
     if url.startswith("sqlite"):
         @event.listens_for(_engine, "connect")
         def set_sqlite_pragma(dbapi_conn, _):
@@ -37,6 +43,9 @@ def init_engine() -> None:
             try:
                 # Busy timeout for locked DB
                 cur.execute("PRAGMA busy_timeout=5000;")
+                # Only takes effect on a new database file; lets retention
+                # reclaim space with incremental_vacuum instead of a full VACUUM
+                cur.execute("PRAGMA auto_vacuum=INCREMENTAL;")
                 # Try to enable WAL; if it fails (e.g., network/UNC), ignore
                 try:
                     cur.execute("PRAGMA journal_mode=WAL;")
@@ -50,6 +59,12 @@ def init_engine() -> None:
     SessionLocal = sessionmaker(bind=_engine, autocommit=False, autoflush=False)
 
 
+def get_engine():
+    if _engine is None:
+        init_engine()
+    return _engine
+
+
 def get_session():
     if SessionLocal is None:
         init_engine()
@@ -77,32 +92,51 @@ def create_all() -> None:
                 );
                 """
             )
-            # Insert trigger
-            conn.exec_driver_sql(
-                """
-                CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
-                    INSERT INTO messages_fts(message_id, conversation_id, content_text, role)
-                    VALUES (new.id, new.conversation_id, coalesce(new.content_text, ''), new.role);
-                END;
-                """
-            )
-            # Update trigger (delete+insert)
-            conn.exec_driver_sql(
-                """
-                CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF content_text, role, conversation_id ON messages BEGIN
-                    DELETE FROM messages_fts WHERE message_id = old.id;
-                    INSERT INTO messages_fts(message_id, conversation_id, content_text, role)
-                    VALUES (new.id, new.conversation_id, coalesce(new.content_text, ''), new.role);
-                END;
-                """
-            )
-            # Delete trigger
-            conn.exec_driver_sql(
-                """
-                CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
-                    DELETE FROM messages_fts WHERE message_id = old.id;
-                END;
-                """
-            )
+            create_fts_triggers(conn)
+
+
+# FTS sync triggers keyed by name so bulk jobs can suspend and restore them
+FTS_TRIGGERS = {
+    # Insert trigger
+    "messages_ai": """
+        CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(message_id, conversation_id, content_text, role)
+            VALUES (new.id, new.conversation_id, coalesce(new.content_text, ''), new.role);
+        END;
+    """,
+    # Update trigger (delete+insert)
+    "messages_au": """
+        CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE OF content_text, role, conversation_id ON messages BEGIN
+            DELETE FROM messages_fts WHERE message_id = old.id;
+            INSERT INTO messages_fts(message_id, conversation_id, content_text, role)
+            VALUES (new.id, new.conversation_id, coalesce(new.content_text, ''), new.role);
+        END;
+    """,
+    # Delete trigger
+    "messages_ad": """
+        CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+            DELETE FROM messages_fts WHERE message_id = old.id;
+        END;
+    """,
+}
+
+
+def create_fts_triggers(conn) -> None:
+    for ddl in FTS_TRIGGERS.values():
+        conn.exec_driver_sql(ddl)
+
+
+def drop_fts_triggers(conn) -> None:
+    for name in FTS_TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
 
 
+def rebuild_fts(conn) -> None:
+    """Repopulate messages_fts from messages in one pass."""
+    conn.exec_driver_sql("DELETE FROM messages_fts")
+    conn.exec_driver_sql(
+        """
+        INSERT INTO messages_fts(message_id, conversation_id, content_text, role)
+        SELECT id, conversation_id, coalesce(content_text, ''), role FROM messages
+        """
+    )
@@ -2,8 +2,8 @@ from __future__ import annotations
 
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey, JSON, LargeBinary, Index, Boolean
-from sqlalchemy.orm import relationship, Mapped, mapped_column
+from sqlalchemy import Column, String, Text, Integer, DateTime, ForeignKey, JSON, LargeBinary, Index, Boolean, UniqueConstraint, event
+from sqlalchemy.orm import relationship, Mapped, mapped_column, Session
 
 from .base import Base
 
@@ -19,6 +19,8 @@ class Conversation(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     pinned = Column(Boolean, default=False, nullable=False)
     metadata_json = Column(JSON, nullable=True)
+    # Change watermark for incremental backups
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
 
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
@@ -51,9 +53,12 @@ class Message(Base):
 
     status = Column(String(32), default="completed", nullable=False)
     error_text = Column(Text, nullable=True)
+    # Streaming attempts abandoned before the first token: [{"route", "reason", "after_ms"}]
+    failovers = Column(JSON, nullable=True)
 
     started_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     completed_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
 
     conversation = relationship("Conversation", back_populates="messages")
 
@@ -66,8 +71,73 @@ class MessageStream(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
+class TokenUsage(Base):
+    """Tokens charged per quota subject, model and UTC day (flushed from in-memory counters)."""
+
+    __tablename__ = "token_usage"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    subject = Column(String(64), nullable=False)
+    model = Column(String(200), nullable=False)
+    day = Column(String(10), nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    requests = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("subject", "model", "day", name="uq_token_usage_subject_model_day"),
+        Index("ix_token_usage_day", "day"),
+    )
+
+
+class ApiKey(Base):
+    """Issued API key: only a salted PBKDF2 hash of the secret is stored."""
+
+    __tablename__ = "api_keys"
+    id: Mapped[str] = mapped_column(String(32), primary_key=True, default=_id)
+    name = Column(String(100), nullable=False)
+    # Public part of the key, used to find the row before verifying the hash
+    prefix = Column(String(16), nullable=False, unique=True)
+    key_hash = Column(String(200), nullable=False)
+    scopes = Column(JSON, nullable=False, default=list)
+    priority = Column(String(32), default="default", nullable=False)
+    rate_limit_per_min = Column(Integer, nullable=True)
+    quota_tpm = Column(Integer, nullable=True)
+    quota_daily_tokens = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    revoked_at = Column(DateTime, nullable=True)
+
+
+class Tombstone(Base):
+    """Deleted row marker so incremental backups can replay deletes."""
+
+    __tablename__ = "tombstones"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String(32), nullable=False)
+    entity_id = Column(String(32), nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# Tombstone entity names for each tracked model
+TRACKED_ENTITIES = {Conversation: "conversation", Message: "message", MessageStream: "stream"}
+
+
+@event.listens_for(Session, "before_flush")
+def _record_tombstones(session: Session, flush_context, instances) -> None:  # type: ignore[no-untyped-def]
+    for obj in list(session.deleted):
+        entity = TRACKED_ENTITIES.get(type(obj))
+        if entity:
+            session.add(Tombstone(entity=entity, entity_id=obj.id))
+
+
 # Helpful indexes
 Index("ix_messages_conversation", Message.conversation_id)
 Index("ix_messages_started_at", Message.started_at)
+Index("ix_messages_updated_at", Message.updated_at)
+Index("ix_conversations_updated_at", Conversation.updated_at)
+Index("ix_message_streams_created_at", MessageStream.created_at)
+Index("ix_tombstones_deleted_at", Tombstone.deleted_at)
+Index("ix_api_keys_revoked_at", ApiKey.revoked_at)
 
 
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+from sqlalchemy import event
+
+from ..config import get_settings
+from ..loopmon import current_request_id
+from ..metrics import DB_QUERY_SECONDS, DB_SLOW_QUERIES, query_label
+from ..tracing import start_span
+
+logger = structlog.get_logger()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+# Expanded IN lists ("IN (?, ?, ?)") vary in length with the data
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# EXPLAIN QUERY PLAN is re-run for a slow statement at most this often
+_PLAN_TTL_SECONDS = 300.0
+_EXPLAINABLE = {"SELECT", "WITH", "UPDATE", "DELETE", "INSERT"}
+
+
+def normalize_sql(statement: str) -> str:
+    """Statement with literals replaced by ``?`` and whitespace collapsed."""
+    sql = _STRING.sub("?", statement)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("(?...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def _format_plan(rows: List[Tuple[Any, ...]]) -> List[str]:
+    """``EXPLAIN QUERY PLAN`` rows (id, parent, _, detail) as indented lines."""
+    depth: Dict[Any, int] = {0: -1}
+    lines = []
+    for row in rows:
+        node, parent, detail = row[0], row[1], row[-1]
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + str(detail))
+    return lines
+
+
+class QueryStats:
+    """Execution time per normalized SQL statement, plus the slow-query log.
+
+    ``install`` hooks an engine's cursor-execute events: every statement is
+    timed, aggregated under its normalized text (literals and IN-list
+    lengths removed) and observed in ``gateway_db_query_seconds``. Statements
+    slower than ``slow_ms`` are logged as ``slow_query`` with the request id
+    and, on SQLite, the ``EXPLAIN QUERY PLAN`` output. At most
+    ``max_statements`` distinct statements are kept; later ones are counted
+    under ``other``.
+    """
+
+    def __init__(self, slow_ms: float = 250.0, max_statements: int = 500) -> None:
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._fingerprints: Dict[str, Tuple[str, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def install(self, engine: Any) -> None:
+        explain = engine.dialect.name == "sqlite"
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):  # type: ignore[no-untyped-def]
+            if context is not None:
+                context._query_span = start_span("db.query")
+                context._query_started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):  # type: ignore[no-untyped-def]
+            started = getattr(context, "_query_started", None)
+            if started is None:
+                return
+            elapsed = time.perf_counter() - started
+            query_id = self.record(statement, elapsed, cursor.rowcount)
+            span = context._query_span
+            if span is not None:
+                span.set(query=query_id, rows=cursor.rowcount)
+                span.finish()
+            if elapsed * 1000 >= self.slow_ms:
+                params = parameters[0] if executemany and parameters else parameters
+                self._slow(query_id, statement, params, elapsed, cursor.rowcount, cursor if explain else None)
+
+        @event.listens_for(engine, "handle_error")
+        def _error(exception_context):  # type: ignore[no-untyped-def]
+            span = getattr(exception_context.execution_context, "_query_span", None)
+            if span is not None:
+                span.finish(exception_context.original_exception)
+
+    def fingerprint(self, statement: str) -> Tuple[str, str, str]:
+        """``(query_id, normalized sql, operation)`` for a raw statement."""
+        cached = self._fingerprints.get(statement)
+        if cached is not None:
+            return cached
+        sql = normalize_sql(statement)
+        query_id = hashlib.sha1(sql.encode("utf-8")).hexdigest()[:12]
+        operation = sql.split(" ", 1)[0].upper() if sql else ""
+        result = (query_id, sql, operation)
+        # Statements with inlined literals are all different; stop caching past a bound
+        if len(self._fingerprints) < self.max_statements * 4:
+            self._fingerprints[statement] = result
+        return result
+
+    def record(self, statement: str, seconds: float, rows: int = -1) -> str:
+        query_id, sql, operation = self.fingerprint(statement)
+        with self._lock:
+            entry = self._stats.get(query_id)
+            if entry is None:
+                if len(self._stats) >= self.max_statements:
+                    query_id, sql = "other", "(other statements)"
+                    entry = self._stats.get(query_id)
+                if entry is None:
+                    entry = self._stats[query_id] = {
+                        "query_id": query_id,
+                        "sql": sql,
+                        "operation": operation,
+                        "count": 0,
+                        "total_ms": 0.0,
+                        "max_ms": 0.0,
+                        "rows": 0,
+                        "slow": 0,
+                        "plan": None,
+                        "plan_at": 0.0,
+                    }
+            ms = seconds * 1000
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            if rows > 0:
+                entry["rows"] += rows
+        DB_QUERY_SECONDS.labels(query_label(query_id), operation).observe(seconds)
+        return query_id
+
+    def _slow(self, query_id: str, statement: str, params: Any, seconds: float, rows: int, cursor: Any) -> None:
+        DB_SLOW_QUERIES.labels(self.fingerprint(statement)[2]).inc()
+        with self._lock:
+            entry = self._stats.get(query_id)
+            if entry is None:
+                return
+            entry["slow"] += 1
+            plan = entry["plan"]
+            stale = time.monotonic() - entry["plan_at"] > _PLAN_TTL_SECONDS
+            if stale:
+                entry["plan_at"] = time.monotonic()
+        if cursor is not None and stale and self.fingerprint(statement)[2] in _EXPLAINABLE:
+            plan = self._explain(cursor, statement, params) or plan
+            with self._lock:
+                entry["plan"] = plan
+        logger.warning(
+            "slow_query",
+            query_id=query_id,
+            sql=entry["sql"][:2000],
+            duration_ms=round(seconds * 1000, 1),
+            rows=rows,
+            plan=plan,
+            request_id=current_request_id.get(),
+        )
+
+    @staticmethod
+    def _explain(cursor: Any, statement: str, params: Any) -> Optional[List[str]]:
+        try:
+            explain_cursor = cursor.connection.cursor()
+            try:
+                explain_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", params or ())
+                return _format_plan(explain_cursor.fetchall())
+            finally:
+                explain_cursor.close()
+        except Exception as e:  # noqa: B902
+            logger.debug("explain_failed", error=str(e))
+            return None
+
+    def top(self, limit: int = 20, order: str = "total_ms") -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = [dict(e) for e in self._stats.values()]
+        for e in entries:
+            e["mean_ms"] = round(e["total_ms"] / e["count"], 3) if e["count"] else 0.0
+            e["total_ms"] = round(e["total_ms"], 3)
+            e["max_ms"] = round(e["max_ms"], 3)
+            e.pop("plan_at")
+        entries.sort(key=lambda e: e[order], reverse=True)
+        return entries[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+_stats: Optional[QueryStats] = None
+
+
+def get_query_stats() -> Optional[QueryStats]:
+    """Process-wide statement stats (None when ``DB_QUERY_STATS`` is off)."""
+    global _stats
+    if _stats is None:
+        s = get_settings()
+        if s.db_query_stats:
+            _stats = QueryStats(s.db_slow_query_ms, s.db_query_stats_max)
+    return _stats
@@ -0,0 +1,386 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import structlog
+from sqlalchemy import and_, delete, exists, func, insert, or_, select, update
+from sqlalchemy.engine import Connection, Engine
+
+from ..config import get_settings
+from ..shared import try_lead
+from .backup import iter_ndjson
+from .base import get_engine
+from .models import Conversation, Message, MessageStream, Tombstone
+
+logger = structlog.get_logger()
+
+_conv = Conversation.__table__
+_msg = Message.__table__
+_stream = MessageStream.__table__
+
+# Only one retention pass (scheduled or manual) runs at a time
+_run_lock = threading.Lock()
+
+
+def _blob_bytes(*cols: Any) -> Any:
+    """SUM of the byte lengths of ``cols`` (NULLs count as zero)."""
+    total = func.coalesce(func.length(cols[0]), 0)
+    for col in cols[1:]:
+        total = total + func.coalesce(func.length(col), 0)
+    return func.coalesce(func.sum(total), 0)
+
+
+def _cutoff(days: int) -> Optional[datetime]:
+    return datetime.utcnow() - timedelta(days=days) if days > 0 else None
+
+
+def _stale_conversations(cutoff: datetime) -> Any:
+    """Unpinned conversations with no activity since ``cutoff``."""
+    recent_msg = exists().where(
+        and_(
+            _msg.c.conversation_id == _conv.c.id,
+            func.coalesce(_msg.c.updated_at, _msg.c.started_at) >= cutoff,
+        )
+    )
+    return and_(
+        _conv.c.pinned.is_(False),
+        func.coalesce(_conv.c.updated_at, _conv.c.created_at) < cutoff,
+        ~recent_msg,
+    )
+
+
+def _orphan_streams() -> Any:
+    return ~exists().where(_msg.c.id == _stream.c.message_id)
+
+
+def _record_tombstones(conn: Connection, entity: str, ids: List[str]) -> None:
+    if ids:
+        now = datetime.utcnow()
+        conn.execute(insert(Tombstone.__table__), [{"entity": entity, "entity_id": i, "deleted_at": now} for i in ids])
+
+
+def _freelist_bytes(conn: Connection) -> int:
+    if conn.dialect.name != "sqlite":
+        return 0
+    pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+    page_size = conn.exec_driver_sql("PRAGMA page_size").scalar() or 0
+    return int(pages) * int(page_size)
+
+
+def plan_retention(
+    engine: Optional[Engine] = None,
+    raw_days: Optional[int] = None,
+    archive_days: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Dry-run report: what each policy would touch and the projected savings."""
+    settings = get_settings()
+    engine = engine or get_engine()
+    raw_cutoff = _cutoff(settings.retention_raw_days if raw_days is None else raw_days)
+    archive_cutoff = _cutoff(settings.retention_archive_days if archive_days is None else archive_days)
+
+    report: Dict[str, Any] = {"raw_cutoff": raw_cutoff, "archive_cutoff": archive_cutoff}
+    with engine.connect() as conn:
+        if raw_cutoff is not None:
+            msg_count, msg_bytes = conn.execute(
+                select(func.count(), _blob_bytes(_msg.c.raw_request_gzip, _msg.c.raw_response_gzip)).where(
+                    _msg.c.started_at < raw_cutoff,
+                    or_(_msg.c.raw_request_gzip.isnot(None), _msg.c.raw_response_gzip.isnot(None)),
+                )
+            ).one()
+            stream_count, stream_bytes = conn.execute(
+                select(func.count(), _blob_bytes(_stream.c.raw_sse_gzip)).where(_stream.c.created_at < raw_cutoff)
+            ).one()
+            report["raw_blobs"] = {
+                "messages": msg_count,
+                "streams": stream_count,
+                "bytes": int(msg_bytes) + int(stream_bytes),
+            }
+        if archive_cutoff is not None:
+            stale = select(_conv.c.id).where(_stale_conversations(archive_cutoff)).scalar_subquery()
+            conv_count = conn.execute(select(func.count()).where(_stale_conversations(archive_cutoff))).scalar()
+            msg_count, msg_bytes = conn.execute(
+                select(
+                    func.count(),
+                    _blob_bytes(
+                        _msg.c.content_text, _msg.c.system_prompt, _msg.c.raw_request_gzip, _msg.c.raw_response_gzip
+                    ),
+                ).where(_msg.c.conversation_id.in_(stale))
+            ).one()
+            report["archive"] = {"conversations": conv_count, "messages": msg_count, "bytes": int(msg_bytes)}
+        orphan_count, orphan_bytes = conn.execute(
+            select(func.count(), _blob_bytes(_stream.c.raw_sse_gzip)).where(_orphan_streams())
+        ).one()
+        report["orphan_streams"] = {"streams": orphan_count, "bytes": int(orphan_bytes)}
+        report["freelist_bytes"] = _freelist_bytes(conn)
+
+    report["projected_savings_bytes"] = (
+        report.get("raw_blobs", {}).get("bytes", 0)
+        + report.get("archive", {}).get("bytes", 0)
+        + report["orphan_streams"]["bytes"]
+        + report["freelist_bytes"]
+    )
+    return report
+
+
+def _drop_raw_blobs(engine: Engine, cutoff: datetime, batch_size: int) -> Dict[str, int]:
+    dropped = {"messages": 0, "streams": 0}
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(_msg.c.id)
+                .where(
+                    _msg.c.started_at < cutoff,
+                    or_(_msg.c.raw_request_gzip.isnot(None), _msg.c.raw_response_gzip.isnot(None)),
+                )
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(
+                update(_msg)
+                .where(_msg.c.id.in_(ids))
+                # Keep updated_at: dropping blobs is not activity and must not restart the archive clock
+                .values(raw_request_gzip=None, raw_response_gzip=None, updated_at=_msg.c.updated_at)
+            )
+        dropped["messages"] += len(ids)
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(_stream.c.id).where(_stream.c.created_at < cutoff).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(delete(_stream).where(_stream.c.id.in_(ids)))
+            _record_tombstones(conn, "stream", ids)
+        dropped["streams"] += len(ids)
+    return dropped
+
+
+def _archive_path(archive_dir: str, created_at: datetime) -> str:
+    return os.path.join(archive_dir, f"conversations-{created_at.strftime('%Y-%m')}.ndjson.gz")
+
+
+def _archive_conversations(engine: Engine, cutoff: datetime, batch_size: int, archive_dir: str) -> Dict[str, Any]:
+    """Move stale conversations (with messages and raw blobs) into per-month gzip NDJSON files.
+
+    Each batch is appended to its month's file as a new gzip member and fsynced
+    before the rows are deleted, so a crash can only duplicate archive entries.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = {"conversations": 0, "messages": 0, "files": set()}
+    while True:
+        with engine.begin() as conn:
+            convs = conn.execute(select(_conv).where(_stale_conversations(cutoff)).limit(batch_size)).mappings().all()
+            if not convs:
+                break
+            conv_ids = [c["id"] for c in convs]
+            msgs = conn.execute(select(_msg).where(_msg.c.conversation_id.in_(conv_ids))).mappings().all()
+            msg_ids = [m["id"] for m in msgs]
+            streams = (
+                conn.execute(select(_stream).where(_stream.c.message_id.in_(msg_ids))).mappings().all()
+                if msg_ids
+                else []
+            )
+
+            by_month: Dict[str, List[Dict[str, Any]]] = {}
+            conv_path = {}
+            for c in convs:
+                path = _archive_path(archive_dir, c["created_at"])
+                conv_path[c["id"]] = path
+                by_month.setdefault(path, []).append({"type": "conversation", "data": dict(c)})
+            msg_path = {}
+            for m in msgs:
+                msg_path[m["id"]] = conv_path[m["conversation_id"]]
+                by_month[msg_path[m["id"]]].append({"type": "message", "data": dict(m)})
+            for s in streams:
+                by_month[msg_path[s["message_id"]]].append({"type": "stream", "data": dict(s)})
+
+            for path, records in by_month.items():
+                with open(path, "ab") as raw:
+                    with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                        for line in iter_ndjson(records):
+                            gz.write(line)
+                    raw.flush()
+                    os.fsync(raw.fileno())
+                archived["files"].add(path)
+
+            stream_ids = [s["id"] for s in streams]
+            if stream_ids:
+                conn.execute(delete(_stream).where(_stream.c.id.in_(stream_ids)))
+            if msg_ids:
+                conn.execute(delete(_msg).where(_msg.c.id.in_(msg_ids)))
+            conn.execute(delete(_conv).where(_conv.c.id.in_(conv_ids)))
+            _record_tombstones(conn, "stream", stream_ids)
+            _record_tombstones(conn, "message", msg_ids)
+            _record_tombstones(conn, "conversation", conv_ids)
+        archived["conversations"] += len(conv_ids)
+        archived["messages"] += len(msg_ids)
+    archived["files"] = sorted(archived["files"])
+    return archived
+
+
+def _purge_orphan_streams(engine: Engine, batch_size: int) -> int:
+    purged = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(select(_stream.c.id).where(_orphan_streams()).limit(batch_size)).scalars().all()
+            if not ids:
+                break
+            conn.execute(delete(_stream).where(_stream.c.id.in_(ids)))
+            _record_tombstones(conn, "stream", ids)
+        purged += len(ids)
+    return purged
+
+
+def incremental_vacuum(
+    engine: Optional[Engine] = None,
+    pages_per_step: Optional[int] = None,
+    step_sleep_ms: Optional[float] = None,
+    max_steps: int = 100000,
+) -> Dict[str, Any]:
+    """Return free pages to the OS a few at a time so writers are never stalled."""
+    settings = get_settings()
+    engine = engine or get_engine()
+    if engine.dialect.name != "sqlite":
+        return {"mode": "unsupported", "reclaimed_bytes": 0, "steps": 0}
+    pages = pages_per_step or settings.vacuum_pages_per_step
+    pause = (settings.vacuum_step_sleep_ms if step_sleep_ms is None else step_sleep_ms) / 1000.0
+
+    proxy = engine.raw_connection()
+    raw = proxy.driver_connection
+    try:
+        mode = raw.execute("PRAGMA auto_vacuum").fetchone()[0]
+        page_size = raw.execute("PRAGMA page_size").fetchone()[0]
+        if mode != 2:
+            # auto_vacuum=INCREMENTAL only applies after a one-off full VACUUM
+            return {"mode": {0: "none", 1: "full"}.get(mode, str(mode)), "reclaimed_bytes": 0, "steps": 0}
+        start_free = raw.execute("PRAGMA freelist_count").fetchone()[0]
+        steps = 0
+        while steps < max_steps:
+            if raw.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                break
+            # executescript steps the pragma to completion (execute() frees a single page)
+            raw.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            steps += 1
+            if pause > 0:
+                time.sleep(pause)
+        end_free = raw.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        proxy.close()
+    return {"mode": "incremental", "reclaimed_bytes": (start_free - end_free) * page_size, "steps": steps}
+
+
+def enable_incremental_vacuum(engine: Optional[Engine] = None) -> None:
+    """One-off switch of an existing SQLite file to auto_vacuum=INCREMENTAL (runs a full VACUUM)."""
+    engine = engine or get_engine()
+    proxy = engine.raw_connection()
+    try:
+        proxy.driver_connection.executescript("PRAGMA auto_vacuum=INCREMENTAL; VACUUM;")
+    finally:
+        proxy.close()
+
+
+def run_retention(
+    dry_run: bool = False,
+    raw_days: Optional[int] = None,
+    archive_days: Optional[int] = None,
+    engine: Optional[Engine] = None,
+) -> Dict[str, Any]:
+    """Apply the retention policies, then reclaim space. Blocking; run off the event loop."""
+    settings = get_settings()
+    engine = engine or get_engine()
+    raw_days = settings.retention_raw_days if raw_days is None else raw_days
+    archive_days = settings.retention_archive_days if archive_days is None else archive_days
+    report = plan_retention(engine, raw_days, archive_days)
+    report["dry_run"] = dry_run
+    if dry_run:
+        return report
+    if not _run_lock.acquire(blocking=False):
+        raise RuntimeError("A retention run is already in progress")
+    start = time.perf_counter()
+    try:
+        batch = settings.retention_batch_size
+        raw_cutoff = _cutoff(raw_days)
+        archive_cutoff = _cutoff(archive_days)
+        if archive_cutoff is not None:
+            # Archive first so archived rows keep their raw blobs
+            report["archived"] = _archive_conversations(engine, archive_cutoff, batch, settings.archive_dir)
+        if raw_cutoff is not None:
+            report["dropped"] = _drop_raw_blobs(engine, raw_cutoff, batch)
+        report["purged_orphan_streams"] = _purge_orphan_streams(engine, batch)
+        report["vacuum"] = incremental_vacuum(engine)
+    finally:
+        _run_lock.release()
+    report["duration_ms"] = int((time.perf_counter() - start) * 1000)
+    logger.info(
+        "retention_complete",
+        archived=report.get("archived", {}).get("conversations", 0),
+        dropped=report.get("dropped"),
+        purged_orphan_streams=report["purged_orphan_streams"],
+        reclaimed_bytes=report["vacuum"]["reclaimed_bytes"],
+        duration_ms=report["duration_ms"],
+    )
+    return report
+
+
+class RetentionScheduler:
+    """Runs the retention engine periodically on a worker thread.
+
+    With several worker processes only the one holding the ``retention``
+    lock runs it (see ``shared.try_lead``).
+    """
+
+    def __init__(self, interval_seconds: float) -> None:
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            if not try_lead("retention"):
+                continue
+            try:
+                await asyncio.to_thread(run_retention)
+            except Exception as exc:
+                logger.warning("retention_failed", error=str(exc))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply retention policies and reclaim space")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--raw-days", type=int, default=None)
+    parser.add_argument("--archive-days", type=int, default=None)
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="Switch an existing database to auto_vacuum=INCREMENTAL (runs a full VACUUM once)",
+    )
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+    report = run_retention(args.dry_run, args.raw_days, args.archive_days)
+    print(json.dumps(report, default=str))
+
+
+if __name__ == "__main__":
+    main()
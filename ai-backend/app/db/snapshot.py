@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterator, Optional
+
+import structlog
+
+from ..config import get_settings
+from .backup import iter_compressed
+
+logger = structlog.get_logger()
+
+
+# After this many restarts (source modified by another connection mid-copy)
+# copy the remaining pages in one step under a single read transaction
+MAX_RESTARTS = 3
+
+_CODEC_SUFFIX = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class _Restarted(Exception):
+    pass
+
+
+def sqlite_path(url: Optional[str] = None) -> Optional[str]:
+    """Return the file path of a SQLite database URL, or None for other backends."""
+    url = url or get_settings().database_url
+    if not url.startswith("sqlite") or "///" not in url:
+        return None
+    path = url.split("///", 1)[1]
+    return path if path and path != ":memory:" else None
+
+
+def snapshot_sqlite(
+    target_path: str,
+    source_path: Optional[str] = None,
+    pages: Optional[int] = None,
+    step_sleep_ms: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Copy the live database to ``target_path`` with SQLite's online backup API.
+
+    Pages are copied ``pages`` at a time with a short sleep between steps so
+    writers can take the lock; this is blocking and meant to run off the event
+    loop (worker thread or CLI).
+    """
+    settings = get_settings()
+    source_path = source_path or sqlite_path()
+    if not source_path:
+        raise ValueError("Snapshots are only supported for file-backed SQLite databases")
+    pages = pages or settings.snapshot_pages_per_step
+    pause = (settings.snapshot_step_sleep_ms if step_sleep_ms is None else step_sleep_ms) / 1000.0
+
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    stats = {"steps": 0, "restarts": 0, "pages_total": 0, "last_remaining": None, "last_logged": 0.0}
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        stats["steps"] += 1
+        stats["pages_total"] = total
+        last = stats["last_remaining"]
+        if last is not None and remaining > last:
+            stats["restarts"] += 1
+            if stats["restarts"] >= MAX_RESTARTS:
+                raise _Restarted()
+        stats["last_remaining"] = remaining
+        now = time.monotonic()
+        if now - stats["last_logged"] >= 1.0:
+            stats["last_logged"] = now
+            logger.info("snapshot_progress", copied=total - remaining, total=total)
+        if pause > 0:
+            time.sleep(pause)
+
+    start = time.perf_counter()
+    src = sqlite3.connect(source_path, timeout=30.0)
+    dst = sqlite3.connect(target_path)
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _Restarted:
+            logger.info("snapshot_single_step", restarts=stats["restarts"])
+            src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+
+    duration_ms = int((time.perf_counter() - start) * 1000)
+    result = {
+        "path": target_path,
+        "bytes": os.path.getsize(target_path),
+        "pages": stats["pages_total"],
+        "steps": stats["steps"],
+        "restarts": stats["restarts"],
+        "duration_ms": duration_ms,
+    }
+    logger.info("snapshot_complete", **result)
+    return result
+
+
+def iter_file_chunks(path: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def compress_file(src_path: str, codec: str) -> str:
+    """Compress ``src_path`` alongside itself and remove the original."""
+    if codec == "none":
+        return src_path
+    dst_path = src_path + _CODEC_SUFFIX[codec]
+    with open(dst_path, "wb") as out:
+        for chunk in iter_compressed(iter_file_chunks(src_path), codec):
+            out.write(chunk)
+    os.remove(src_path)
+    return dst_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Take an online snapshot of the SQLite database")
+    parser.add_argument("target", help="Path of the snapshot file to write")
+    parser.add_argument("--compress", choices=sorted(_CODEC_SUFFIX), default="none")
+    parser.add_argument("--pages", type=int, default=None, help="Pages copied per step")
+    parser.add_argument("--sleep-ms", type=float, default=None, help="Pause between steps")
+    args = parser.parse_args()
+
+    result = snapshot_sqlite(args.target, pages=args.pages, step_sleep_ms=args.sleep_ms)
+    result["path"] = compress_file(args.target, args.compress)
+    result["bytes"] = os.path.getsize(result["path"])
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
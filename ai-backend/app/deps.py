@@ -1,19 +1,117 @@
 from __future__ import annotations
 
 import asyncio
+import itertools
 import time
-from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import weakref
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 import httpx
+import structlog
 
 from .config import get_settings
+from .shared import get_shared_store
+from .tracing import span, trace_headers
+
+try:
+    import h2  # type: ignore  # noqa: F401  (httpx's HTTP/2 support)
+except ImportError:  # pragma: no cover
+    h2 = None  # type: ignore
+
+logger = structlog.get_logger()
+
+
+def parse_route_url(url: str) -> Tuple[str, Optional[str], Optional[bool]]:
+    """Split a ``MODEL_ROUTE_*`` value into ``(base_url, uds_path, http2)``.
+
+    ``unix:///run/vllm.sock?path=/v1`` sends HTTP over that socket with
+    ``http://localhost/v1`` as the base URL. ``?http2=1`` (any scheme)
+    overrides ``UPSTREAM_HTTP2`` for the route; None means not given.
+    """
+    parsed = httpx.URL(url)
+    params = parsed.params
+    http2: Optional[bool] = None
+    if "http2" in params:
+        http2 = params["http2"].lower() in {"1", "true", "yes"}
+        params = params.remove("http2")
+    if parsed.scheme == "unix":
+        prefix = params.get("path", "")
+        return "http://localhost" + prefix.rstrip("/"), parsed.path, http2
+    return str(parsed.copy_with(params=params)).rstrip("/"), None, http2
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]) -> None:
+        self.stream = stream
+        self.release: Optional[Callable[[], None]] = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.release is not None:
+                self.release()
+                self.release = None
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """Counts requests whose response is still open (a relayed stream until the relay closes it)."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport) -> None:
+        self.inner = inner
+        self.in_flight = 0
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.in_flight += 1
+        try:
+            response = await self.inner.handle_async_request(request)
+        except BaseException:
+            self.in_flight -= 1
+            raise
+        response.stream = _ReleasingStream(response.stream, self._release)  # type: ignore[arg-type]
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+# Route states besides active: no new requests are routed to either; a
+# removing route is deleted (and its pool closed) once nothing is in flight
+DRAINING = "draining"
+REMOVING = "removing"
 
 
 class RouteRegistry:
+    """Upstream routes, their connection pools and the aggregated model index.
+
+    Routes start from ``MODEL_ROUTE_*`` and can be added, drained or removed
+    at runtime (``/api/admin/routes``, ``ROUTES_FILE``). Requests already
+    holding a route keep using its pool: a drained or removed route stops
+    receiving new requests, and its pool is closed by ``reap()`` only once
+    its in-flight requests and streams have finished (or after
+    ``ROUTE_DRAIN_SECONDS``). Changing a route's URL retires the old pool the
+    same way. When several active routes serve a model, requests go to the
+    one with the fewest requests in flight.
+    """
+
     def __init__(self) -> None:
         self.settings = get_settings()
         self.route_key_to_base_url: Dict[str, str] = self.settings.get_route_map()
         self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._counters: "weakref.WeakKeyDictionary[httpx.AsyncClient, _CountingTransport]" = weakref.WeakKeyDictionary()
+        # route_key -> DRAINING/REMOVING (absent => active) and when to stop waiting for it
+        self._states: Dict[str, str] = {}
+        self._drain_deadlines: Dict[str, float] = {}
+        # Pools of routes whose URL changed: (deadline, client), closed once idle
+        self._retired: List[Tuple[float, httpx.AsyncClient]] = []
+        self._tiebreak = itertools.count()
         # Cache: route_key -> (timestamp, models)
         self._models_cache: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
         self._models_cache_ttl_seconds: float = 10.0
@@ -26,17 +124,150 @@ class RouteRegistry:
         if base_url is None:
             raise KeyError(f"Unknown route key: {route_key}")
         if route_key_norm not in self._clients:
-            timeout = httpx.Timeout(
-                connect=self.settings.connect_timeout_seconds,
-                read=self.settings.read_timeout_seconds,
-                write=self.settings.write_timeout_seconds,
-                pool=None,
-            )
-            self._clients[route_key_norm] = httpx.AsyncClient(base_url=base_url, timeout=timeout)
+            self._clients[route_key_norm] = self._make_client(base_url)
         return self._clients[route_key_norm]
 
+    def _make_client(self, route_url: str) -> httpx.AsyncClient:
+        s = self.settings
+        base_url, uds, http2 = parse_route_url(route_url)
+        if http2 is None:
+            http2 = s.upstream_http2
+        if http2 and h2 is None:
+            logger.warning("http2_unavailable", route_url=route_url, detail="pip install h2; using HTTP/1.1")
+            http2 = False
+        timeout = httpx.Timeout(
+            connect=s.connect_timeout_seconds,
+            read=s.read_timeout_seconds,
+            write=s.write_timeout_seconds,
+            pool=s.upstream_pool_timeout_seconds or None,
+        )
+        if http2:
+            # Streams are multiplexed, so a few connections carry all the concurrency
+            max_connections = max_keepalive = s.upstream_http2_max_connections
+        elif uds:
+            # No handshake cost or ephemeral ports at stake: keep every connection open
+            max_connections = max_keepalive = s.upstream_max_connections
+        else:
+            max_connections, max_keepalive = s.upstream_max_connections, s.upstream_max_keepalive
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=s.upstream_keepalive_expiry_seconds,
+        )
+        # Cleartext HTTP/2 (h2c) needs prior knowledge; over https it is negotiated with ALPN
+        http1 = not http2 or base_url.startswith("https://")
+        transport = _CountingTransport(httpx.AsyncHTTPTransport(uds=uds, http1=http1, http2=http2, limits=limits))
+        client = httpx.AsyncClient(base_url=base_url, timeout=timeout, transport=transport)
+        self._counters[client] = transport
+        return client
+
+    def in_flight(self, route_key: str) -> int:
+        client = self._clients.get(route_key.lower())
+        counter = self._counters.get(client) if client is not None else None
+        return counter.in_flight if counter is not None else 0
+
+    def add_route(self, route_key: str, url: str) -> None:
+        """Add a route or change its URL; re-adding a drained route makes it active again.
+
+        The same URL keeps the existing pool; a new URL retires the old one.
+        """
+        key = route_key.lower()
+        url = url.rstrip("/")
+        previous = self.route_key_to_base_url.get(key)
+        if previous == url and key not in self._states:
+            return
+        if previous is not None and previous != url:
+            client = self._clients.pop(key, None)
+            if client is not None:
+                self._retired.append((time.monotonic() + self.settings.route_drain_seconds, client))
+            self._models_cache.pop(key, None)
+        self.route_key_to_base_url[key] = url
+        self._states.pop(key, None)
+        self._drain_deadlines.pop(key, None)
+        self._aggregate_models_cache = None
+        logger.info("route_added", route=key, url=url, previous_url=previous)
+
+    def drain_route(self, route_key: str, remove: bool = False) -> None:
+        """Stop routing new requests to ``route_key``; with ``remove``, delete it once idle."""
+        key = route_key.lower()
+        if key not in self.route_key_to_base_url:
+            raise KeyError(f"Unknown route key: {route_key}")
+        if remove or self._states.get(key) != REMOVING:
+            self._states[key] = REMOVING if remove else DRAINING
+        self._drain_deadlines.setdefault(key, time.monotonic() + self.settings.route_drain_seconds)
+        self._aggregate_models_cache = None
+        logger.info("route_draining", route=key, remove=remove, in_flight=self.in_flight(key))
+
+    def remove_route(self, route_key: str) -> None:
+        self.drain_route(route_key, remove=True)
+
+    def route_state(self, route_key: str) -> Optional[str]:
+        key = route_key.lower()
+        if key not in self.route_key_to_base_url:
+            return None
+        return self._states.get(key, "active")
+
+    def describe_routes(self) -> List[Dict[str, Any]]:
+        return [
+            {"route": key, "url": url, "state": self._states.get(key, "active"), "in_flight": self.in_flight(key)}
+            for key, url in self.route_key_to_base_url.items()
+        ]
+
+    async def reap(self) -> List[str]:
+        """Close the pools of removed routes and retired URLs that are idle or past their deadline."""
+        now = time.monotonic()
+        removed = [
+            key
+            for key, state in self._states.items()
+            if state == REMOVING and (self.in_flight(key) == 0 or now >= self._drain_deadlines[key])
+        ]
+        closing: List[httpx.AsyncClient] = []
+        for key in removed:
+            if self.in_flight(key):
+                logger.warning("route_drain_deadline_passed", route=key, in_flight=self.in_flight(key))
+            self.route_key_to_base_url.pop(key, None)
+            self._states.pop(key, None)
+            self._drain_deadlines.pop(key, None)
+            self._models_cache.pop(key, None)
+            client = self._clients.pop(key, None)
+            if client is not None:
+                closing.append(client)
+            logger.info("route_removed", route=key)
+        retired = []
+        for deadline, client in self._retired:
+            counter = self._counters.get(client)
+            if (counter is None or counter.in_flight == 0) or now >= deadline:
+                closing.append(client)
+            else:
+                retired.append((deadline, client))
+        self._retired = retired
+        if removed:
+            self._aggregate_models_cache = None
+        await asyncio.gather(*(c.aclose() for c in closing), return_exceptions=True)
+        return removed
+
+    async def warm(self, connections: int) -> None:
+        """Open the pool of every route with ``connections`` concurrent requests (errors ignored)."""
+        calls = [
+            self.get_client(key).get("/models", timeout=self.settings.connect_timeout_seconds)
+            for key in self.list_route_keys()
+            for _ in range(max(0, connections))
+        ]
+        await asyncio.gather(*calls, return_exceptions=True)
+
+    def invalidate(self) -> None:
+        self._models_cache.clear()
+        self._aggregate_models_cache = None
+
+    async def aclose(self) -> None:
+        clients = list(self._clients.values()) + [client for _, client in self._retired]
+        self._clients.clear()
+        self._retired = []
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
     def list_route_keys(self) -> List[str]:
-        return list(self.route_key_to_base_url.keys())
+        """Routes that take new requests (not draining or being removed)."""
+        return [key for key in self.route_key_to_base_url if key not in self._states]
 
     def get_base_url(self, route_key: str) -> str:
         base_url = self.route_key_to_base_url.get(route_key.lower())
@@ -51,10 +282,20 @@ class RouteRegistry:
         if cached and (now - cached[0]) <= self._models_cache_ttl_seconds:
             return cached[1]
 
+        # Other workers may have fetched it already; one /models call per TTL, not one per worker
         client = self.get_client(route_key_norm)
+        shared = get_shared_store()
+        if shared is not None:
+            entry = await shared.get(f"models:{route_key_norm}")
+            if entry is not None:
+                self._models_cache[route_key_norm] = (entry["at"], entry["models"])
+                self._aggregate_models_cache = None
+                return entry["models"]
+
         start = time.perf_counter()
         try:
-            resp = await client.get("/models")
+            with span("route.fetch_models", route=route_key_norm):
+                resp = await client.get("/models", headers=trace_headers())
             latency_ms = int((time.perf_counter() - start) * 1000)
             resp.raise_for_status()
             data = resp.json()
@@ -75,12 +316,16 @@ class RouteRegistry:
             self._models_cache[route_key_norm] = (now, enriched)
             # Invalidate aggregate cache
             self._aggregate_models_cache = None
-            return enriched
         except httpx.HTTPError:
             # Treat as empty for this route; cache briefly
             self._models_cache[route_key_norm] = (now, [])
             self._aggregate_models_cache = None
-            return []
+            enriched = []
+        if shared is not None:
+            await shared.set(
+                f"models:{route_key_norm}", {"at": now, "models": enriched}, self._models_cache_ttl_seconds
+            )
+        return enriched
 
     async def aggregate_models(self) -> List[Dict[str, Any]]:
         now = time.time()
@@ -106,20 +351,24 @@ class RouteRegistry:
         self._aggregate_models_cache = (now, aggregated)
         return aggregated
 
-    async def infer_route_by_model(self, model_id: str) -> Optional[str]:
-        if not model_id:
-            return None
+    async def replicas(self, model_id: str) -> List[str]:
+        """Active routes serving ``model_id``."""
         models = await self.aggregate_models()
         candidates = [m for m in models if m.get("id") == model_id]
-        if len(candidates) == 1:
-            # Return the first/only source key
-            sources = candidates[0].get("sources", [])
-            if len(sources) == 1:
-                return sources[0]["source"]
-            # Multiple instances serve it; ambiguous
+        if len(candidates) != 1:
+            return []
+        return [s["source"] for s in candidates[0].get("sources", []) if s["source"] not in self._states]
+
+    def pick_replica(self, keys: List[str]) -> str:
+        """The least busy of ``keys``, rotating among equally busy ones."""
+        turn = next(self._tiebreak)
+        return min(keys, key=lambda k: (self.in_flight(k), (keys.index(k) - turn) % len(keys)))
+
+    async def infer_route_by_model(self, model_id: str) -> Optional[str]:
+        if not model_id:
             return None
-        # 0 or >1 aggregated entries: ambiguous
-        return None
+        keys = await self.replicas(model_id)
+        return self.pick_replica(keys) if keys else None
 
 
 route_registry = RouteRegistry()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from typing import Any, Dict, Optional
+
+import structlog
+
+from .config import get_settings
+from .deps import route_registry
+from .metrics import UPSTREAM_UP, route_label
+from .shared import get_shared_store, try_lead
+
+logger = structlog.get_logger()
+
+
+class HealthChecker:
+    """Keeps the health of every route current so probes never touch upstreams.
+
+    A background task calls each route's ``GET /models`` every
+    ``interval_seconds`` and records the outcome; ``/health`` and
+    ``/readyz`` only read that state. With several worker processes only
+    the one holding the ``health`` lock checks and publishes the result in
+    the shared store; the others copy it from there.
+    """
+
+    def __init__(self, interval_seconds: float, timeout_seconds: float) -> None:
+        self.interval_seconds = interval_seconds
+        self.timeout_seconds = timeout_seconds
+        self.routes: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def status(self, route_key: str) -> str:
+        """``ok``, ``unavailable``, or ``unknown`` before the first check."""
+        state = self.routes.get(route_key.lower())
+        return state["status"] if state else "unknown"
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {key: dict(state) for key, state in self.routes.items()}
+
+    async def check_route(self, route_key: str) -> Dict[str, Any]:
+        state = self.routes.get(route_key) or {
+            "status": "unknown",
+            "last_check": None,
+            "last_success": None,
+            "latency_ms": None,
+            "consecutive_failures": 0,
+            "error": None,
+        }
+        start = time.perf_counter()
+        try:
+            resp = await route_registry.get_client(route_key).get("/models", timeout=self.timeout_seconds)
+            resp.raise_for_status()
+        except Exception as exc:  # noqa: B902
+            if state["status"] != "unavailable":
+                logger.warning("route_unavailable", route=route_key, error=str(exc) or type(exc).__name__)
+            state.update(status="unavailable", error=str(exc) or type(exc).__name__)
+            state["consecutive_failures"] += 1
+        else:
+            if state["status"] == "unavailable":
+                logger.info("route_recovered", route=route_key)
+            state.update(status="ok", error=None, consecutive_failures=0, last_success=time.time())
+            state["latency_ms"] = int((time.perf_counter() - start) * 1000)
+        state["last_check"] = time.time()
+        UPSTREAM_UP.labels(route=route_label(route_key)).set(1 if state["status"] == "ok" else 0)
+        return state
+
+    async def check_all(self) -> None:
+        keys = route_registry.list_route_keys()
+        results = await asyncio.gather(*(self.check_route(k) for k in keys))
+        self.routes = dict(zip(keys, results))
+
+    async def _sync(self) -> None:
+        shared = get_shared_store()
+        if shared is None or try_lead("health"):
+            await self.check_all()
+            if shared is not None:
+                await shared.set("health", {"routes": self.routes}, self.interval_seconds * 3)
+            return
+        entry = await shared.get("health")
+        if entry is not None:
+            self.routes = entry["routes"]
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self._sync()
+            except Exception as exc:  # noqa: B902
+                logger.warning("health_check_failed", error=str(exc))
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+_checker: Optional[HealthChecker] = None
+
+
+def configure_health_checker() -> HealthChecker:
+    global _checker
+    s = get_settings()
+    _checker = HealthChecker(s.health_check_interval_seconds, s.health_check_timeout_seconds)
+    return _checker
+
+
+def get_health_checker() -> HealthChecker:
+    global _checker
+    if _checker is None:
+        _checker = configure_health_checker()
+    return _checker
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import signal
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import structlog
+
+from .config import get_settings
+from .deps import route_registry
+
+logger = structlog.get_logger()
+
+# Load balancer / orchestrator probes: no auth, no rate limit
+PROBE_PREFIXES = ("/health", "/api/health", "/readyz", "/api/readyz", "/livez", "/api/livez")
+# Still answered while draining (probes and scrapes)
+DRAIN_EXEMPT_PREFIXES = PROBE_PREFIXES + ("/metrics",)
+
+# Retry interval while no route has answered /models yet
+_CATALOG_RETRY_SECONDS = 2.0
+
+
+class Lifecycle:
+    """Readiness and graceful shutdown of this worker process.
+
+    ``ready`` turns true once the model catalog has loaded (``GET /readyz``).
+    On SIGTERM/SIGINT the worker starts draining: readiness turns false,
+    new requests get 503, and streams in progress may continue for
+    ``drain_seconds``; after that the relay ends them with an error event
+    so their partial output is still persisted. uvicorn waits for those
+    connections before the lifespan shutdown flushes state and closes pools.
+    """
+
+    def __init__(self, drain_seconds: float = 30.0) -> None:
+        self.drain_seconds = drain_seconds
+        self.ready = False
+        self.draining = False
+        self.drain_deadline: Optional[float] = None
+        self.active_streams = 0
+        self._closers: List[Callable[[], Awaitable[None]]] = []
+        self._catalog_task: Optional[asyncio.Task] = None
+
+    def begin_drain(self) -> None:
+        if self.draining:
+            return
+        self.draining = True
+        self.ready = False
+        self.drain_deadline = time.monotonic() + self.drain_seconds
+        logger.info("draining", active_streams=self.active_streams, drain_seconds=self.drain_seconds)
+
+    @property
+    def drain_expired(self) -> bool:
+        return self.drain_deadline is not None and time.monotonic() >= self.drain_deadline
+
+    def stream_opened(self) -> None:
+        self.active_streams += 1
+
+    def stream_closed(self) -> None:
+        self.active_streams -= 1
+
+    async def wait_for_streams(self) -> int:
+        """Wait until no stream is active or the drain deadline passes; returns those left."""
+        while self.active_streams > 0 and not self.drain_expired:
+            await asyncio.sleep(0.05)
+        return self.active_streams
+
+    def add_closer(self, closer: Callable[[], Awaitable[None]]) -> None:
+        """Register a pool to close at the very end of shutdown."""
+        self._closers.append(closer)
+
+    async def close_pools(self) -> None:
+        for closer in [route_registry.aclose, *self._closers]:
+            try:
+                await closer()
+            except Exception as exc:  # noqa: B902
+                logger.warning("close_failed", closer=getattr(closer, "__qualname__", str(closer)), error=str(exc))
+
+    def install_signal_handlers(self) -> None:
+        """Start draining on SIGTERM/SIGINT, then hand the signal to the server's own handler."""
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            previous = signal.getsignal(sig)
+
+            def handler(signum, frame, previous=previous):  # type: ignore[no-untyped-def]
+                self.begin_drain()
+                if callable(previous):
+                    previous(signum, frame)
+
+            try:
+                signal.signal(sig, handler)
+            except ValueError:
+                # Not the main thread (e.g. TestClient): shutdown still drains in the lifespan
+                return
+
+    def start_catalog_load(self, warm_connections: int) -> None:
+        self._catalog_task = asyncio.create_task(self._load_catalog(warm_connections))
+
+    async def _load_catalog(self, warm_connections: int) -> None:
+        await route_registry.warm(warm_connections)
+        while True:
+            models = await route_registry.aggregate_models()
+            if models or not route_registry.list_route_keys():
+                self.ready = not self.draining
+                logger.info("catalog_loaded", models=len(models), routes=len(route_registry.list_route_keys()))
+                return
+            await asyncio.sleep(_CATALOG_RETRY_SECONDS)
+            route_registry.invalidate()
+
+    async def stop_catalog_load(self) -> None:
+        if self._catalog_task is not None:
+            self._catalog_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._catalog_task
+            self._catalog_task = None
+
+
+_lifecycle = Lifecycle()
+
+
+def configure_lifecycle() -> Lifecycle:
+    global _lifecycle
+    _lifecycle = Lifecycle(get_settings().shutdown_drain_seconds)
+    return _lifecycle
+
+
+def get_lifecycle() -> Lifecycle:
+    return _lifecycle
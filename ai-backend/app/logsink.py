@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import contextvars
+import json
+import random
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Optional, TextIO
+
+import structlog
+
+from .config import get_settings
+from .metrics import LOG_RECORDS_DROPPED
+
+# Fields attached to the current request's access log line (see ``annotate``)
+_request_fields: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "request_log_fields", default=None
+)
+
+
+class LogSink:
+    """Bounded buffer drained by a daemon thread that renders JSON and writes in batches.
+
+    ``put`` is a single ``deque.append`` (atomic, no lock, never blocks): when
+    the buffer is full the record is dropped and counted in
+    ``gateway_log_records_dropped_total`` rather than stalling the event loop
+    on a slow stdout. The writer wakes every ``interval`` seconds.
+    """
+
+    def __init__(
+        self, stream: Optional[TextIO] = None, max_queue: int = 10_000, interval: float = 0.02
+    ) -> None:
+        self.stream = stream or sys.stdout
+        self.max_queue = max_queue
+        self.interval = interval
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._pending = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record: Dict[str, Any]) -> None:
+        if len(self._buffer) >= self.max_queue:
+            LOG_RECORDS_DROPPED.inc()
+            return
+        self._buffer.append(record)
+
+    def _drain(self) -> None:
+        buffer = self._buffer
+        while buffer:
+            lines = []
+            while buffer and len(lines) < 512:
+                record = buffer.popleft()
+                ts = record.get("timestamp")
+                if isinstance(ts, float):
+                    record["timestamp"] = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+                lines.append(json.dumps(record, default=str))
+            self._pending = len(lines)
+            try:
+                self.stream.write("\n".join(lines) + "\n")
+                self.stream.flush()
+            except Exception:  # noqa: B902
+                pass
+            self._pending = 0
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._drain()
+        self._drain()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait (up to ``timeout``) until everything buffered so far is written."""
+        deadline = time.monotonic() + timeout
+        while (self._buffer or self._pending) and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+class QueueLogger:
+    """structlog logger that hands the event dict to the active ``LogSink``.
+
+    Rendering happens on the sink's thread. The sink is looked up per call so
+    loggers cached by structlog keep working after ``configure_logging`` swaps it.
+    """
+
+    def msg(self, **event: Any) -> None:
+        sink = _sink
+        if sink is not None:
+            sink.put(event)
+
+    log = debug = info = warn = warning = error = critical = exception = fatal = msg
+
+
+def _raw_timestamp(logger: Any, method: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    event["timestamp"] = time.time()
+    return event
+
+
+_queue_logger = QueueLogger()
+_sink: Optional[LogSink] = None
+
+
+def configure_logging(stream: Optional[TextIO] = None) -> Optional[LogSink]:
+    """Configure structlog; returns the sink when async logging is on.
+
+    Passing a ``stream`` replaces the current sink (used by tests and tools).
+    """
+    global _sink
+    settings = get_settings()
+    if settings.log_async:
+        if _sink is None or (stream is not None and _sink.stream is not stream):
+            old, _sink = _sink, LogSink(stream, max_queue=settings.log_queue_size)
+            if old is not None:
+                old.close()
+        # The event dict is passed to the logger as-is; the timestamp is
+        # formatted and the record rendered on the writer thread
+        structlog.configure(
+            processors=[structlog.processors.add_log_level, _raw_timestamp],
+            logger_factory=lambda *args: _queue_logger,
+            cache_logger_on_first_use=True,
+        )
+        return _sink
+    structlog.configure(
+        processors=[
+            structlog.processors.add_log_level,
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.JSONRenderer(),
+        ],
+        logger_factory=structlog.PrintLoggerFactory(stream or sys.stdout),
+        cache_logger_on_first_use=False,
+    )
+    return None
+
+
+def get_sink() -> Optional[LogSink]:
+    return _sink
+
+
+def flush_logs() -> None:
+    if _sink is not None:
+        _sink.flush()
+
+
+def begin_request() -> contextvars.Token:
+    return _request_fields.set({})
+
+
+def end_request(token: contextvars.Token) -> Dict[str, Any]:
+    fields = _request_fields.get() or {}
+    _request_fields.reset(token)
+    return fields
+
+
+def annotate(**fields: Any) -> None:
+    """Attach fields to the current request's access log line (no-op outside a request)."""
+    current = _request_fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+class RequestSampler:
+    """Decides whether a finished request is logged.
+
+    Errors (status >= 400) and requests slower than ``slow_ms`` are always
+    logged; other requests are kept with the rate of the longest matching
+    path prefix in ``rates`` (default ``default_rate``).
+    """
+
+    def __init__(self, default_rate: float = 1.0, rates: Optional[Dict[str, float]] = None, slow_ms: int = 1000) -> None:
+        self.default_rate = default_rate
+        self.rates = sorted((rates or {}).items(), key=lambda kv: len(kv[0]), reverse=True)
+        self.slow_ms = slow_ms
+        self._random = random.random
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def keep(self, path: str, status: int, duration_ms: int) -> Optional[float]:
+        """Return the sample rate the line was kept at, or None to drop it."""
+        if status >= 400 or duration_ms >= self.slow_ms:
+            return 1.0
+        rate = self.rate_for(path)
+        if rate >= 1.0 or (rate > 0.0 and self._random() < rate):
+            return rate
+        return None
+
+    @classmethod
+    def from_settings(cls) -> "RequestSampler":
+        s = get_settings()
+        return cls(s.log_sample_rate, s.log_sample_rates_map, s.log_slow_ms)
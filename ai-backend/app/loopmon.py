@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import structlog
+
+from .config import get_settings
+from .metrics import BLOCKING_CALLS, EVENT_LOOP_BLOCKS, EVENT_LOOP_LAG
+
+logger = structlog.get_logger()
+
+# Request id of the code running in this context (set by GatewayMiddleware)
+current_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_request_id", default=None)
+
+# Stack frames from these files are noise in a blocking report
+_SKIP_FILES = ("asyncio", "anyio", "starlette", "uvicorn")
+
+
+class TaskRequests:
+    """Which request each task on the event loop belongs to, readable from other threads.
+
+    ``bind`` tags the running task; a task factory tags every task created
+    while ``current_request_id`` is set (streaming bodies run in such child
+    tasks). Installed while the loop monitor or the request profiler runs.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._previous_factory: Optional[Callable[..., Any]] = None
+        self._users = 0
+
+    @property
+    def installed(self) -> bool:
+        return self._users > 0
+
+    def install(self) -> None:
+        """Call on the loop; balanced by ``uninstall``."""
+        self._users += 1
+        if self._users == 1:
+            self._loop = asyncio.get_running_loop()
+            self._previous_factory = self._loop.get_task_factory()
+            self._loop.set_task_factory(self._task_factory)
+
+    def uninstall(self) -> None:
+        self._users = max(0, self._users - 1)
+        if self._users == 0 and self._loop is not None:
+            if self._loop.get_task_factory() == self._task_factory:
+                self._loop.set_task_factory(self._previous_factory)
+            self._loop = None
+
+    def bind(self, request_id: str) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._tasks[task] = request_id
+
+    def running(self) -> "tuple[Optional[asyncio.Task], Optional[str]]":
+        """The task running on the loop right now and its request id (any thread)."""
+        if self._loop is None:
+            return None, None
+        task = asyncio.current_task(self._loop)
+        return task, self._tasks.get(task) if task is not None else None
+
+    def _task_factory(self, loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any) -> asyncio.Future:
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        request_id = current_request_id.get()
+        if request_id is not None:
+            self._tasks[task] = request_id
+        return task
+
+
+task_requests = TaskRequests()
+
+
+class LoopMonitor:
+    """Measures event-loop lag and reports what blocked the loop.
+
+    A task on the loop sleeps ``interval`` seconds and records how late it
+    woke up in ``gateway_event_loop_lag_seconds``; each wake-up is also a
+    heartbeat. A watchdog thread checks the heartbeat and, when the loop has
+    not come back for ``threshold`` seconds, grabs the loop thread's current
+    stack (the code doing the blocking) and logs it with the request id of
+    the task that is running (see ``TaskRequests``). Each blocking episode
+    is reported once.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, max_reports: int = 50) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.reports: Deque[Dict[str, Any]] = deque(maxlen=max_reports)
+        self._loop_thread: Optional[int] = None
+        self._beat = time.monotonic()
+        self._reported_beat = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        task_requests.install()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+            task_requests.uninstall()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time()
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG.observe(max(0.0, loop.time() - scheduled - self.interval))
+            self._beat = time.monotonic()
+
+    def _watch(self) -> None:
+        period = min(self.interval, self.threshold) / 2
+        while not self._stop.wait(period):
+            beat = self._beat
+            # Lag beyond the sleep itself; the timer is expected to be ``interval`` late
+            blocked = time.monotonic() - beat - self.interval
+            if blocked >= self.threshold and beat != self._reported_beat:
+                self._reported_beat = beat
+                self._report(blocked)
+
+    def _report(self, blocked: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread or -1)
+        if frame is None:
+            return
+        stack = [
+            f"{entry.filename}:{entry.lineno} in {entry.name}"
+            for entry in traceback.extract_stack(frame, limit=40)
+            if entry.filename != __file__ and not any(f"{part}{os.sep}" in entry.filename for part in _SKIP_FILES)
+        ]
+        task, request_id = task_requests.running()
+        report = {
+            "blocked_ms": int(blocked * 1000),
+            "request_id": request_id,
+            "task": task.get_name() if task is not None else None,
+            "stack": stack[-15:],
+            "at": time.time(),
+        }
+        self.reports.append(report)
+        EVENT_LOOP_BLOCKS.inc()
+        logger.warning("event_loop_blocked", **report)
+
+
+# Blocking-call detector (LOOP_DEBUG_BLOCKING)
+
+_flag_lock = threading.Lock()
+_flagged_sites: Dict[str, float] = {}
+_FLAG_EVERY_SECONDS = 60.0
+
+
+def _on_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _call_site() -> str:
+    """First frame outside the library doing the blocking call."""
+    for entry in reversed(traceback.extract_stack(limit=25)[:-2]):
+        if f"{os.sep}app{os.sep}" in entry.filename and entry.filename != __file__:
+            return f"{entry.filename}:{entry.lineno} in {entry.name}"
+    return "unknown"
+
+
+def flag_blocking_call(kind: str, detail: str = "") -> None:
+    """Count (and log once a minute per call site) a sync ``kind`` call on the loop thread."""
+    if not _on_loop_thread():
+        return
+    BLOCKING_CALLS.labels(kind).inc()
+    site = _call_site()
+    now = time.monotonic()
+    with _flag_lock:
+        if now - _flagged_sites.get(f"{kind}|{site}", -_FLAG_EVERY_SECONDS) < _FLAG_EVERY_SECONDS:
+            return
+        _flagged_sites[f"{kind}|{site}"] = now
+    logger.warning("blocking_call_on_loop", kind=kind, site=site, detail=detail[:200], request_id=current_request_id.get())
+
+
+def _wrap(kind: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+    if getattr(fn, "_loopmon_wrapped", False):
+        return fn
+
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        flag_blocking_call(kind)
+        return fn(*args, **kwargs)
+
+    wrapper._loopmon_wrapped = True  # type: ignore[attr-defined]
+    wrapper.__wrapped__ = fn  # type: ignore[attr-defined]
+    wrapper.__name__ = getattr(fn, "__name__", kind)
+    return wrapper
+
+
+_installed = False
+
+
+def install_blocking_detector() -> None:
+    """Flag sync SQLAlchemy, gzip and sync Redis calls made on the event loop thread."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    import gzip
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):  # type: ignore[no-untyped-def]
+        flag_blocking_call("db", statement)
+
+    gzip.compress = _wrap("gzip", gzip.compress)  # type: ignore[assignment]
+    gzip.decompress = _wrap("gzip", gzip.decompress)  # type: ignore[assignment]
+    try:
+        import redis  # type: ignore
+
+        redis.Redis.execute_command = _wrap("redis", redis.Redis.execute_command)  # type: ignore[assignment]
+    except Exception:  # noqa: B902
+        pass
+
+
+_monitor: Optional[LoopMonitor] = None
+
+
+def configure_loop_monitor() -> Optional[LoopMonitor]:
+    global _monitor
+    s = get_settings()
+    if s.loop_debug_blocking:
+        install_blocking_detector()
+    _monitor = (
+        LoopMonitor(s.loop_lag_interval_ms / 1000, s.loop_block_threshold_ms / 1000)
+        if s.loop_monitor_enable
+        else None
+    )
+    return _monitor
+
+
+def get_loop_monitor() -> Optional[LoopMonitor]:
+    return _monitor
+
+
+def bind_request(request_id: str) -> contextvars.Token:
+    """Set ``current_request_id`` and tag the running task with it."""
+    if task_requests.installed:
+        task_requests.bind(request_id)
+    return current_request_id.set(request_id)
+
+
+def recent_blocks() -> List[Dict[str, Any]]:
+    return list(_monitor.reports) if _monitor is not None else []
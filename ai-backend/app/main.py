@@ -1,22 +1,24 @@
 from __future__ import annotations
 
-from typing import List
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
 
 import structlog
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from starlette.responses import Response
 
 from .config import get_settings
-from .middleware.auth import ApiKeyMiddleware
-from .middleware.logging import RequestLoggingMiddleware
-from .middleware.ratelimit import RateLimitMiddleware
+from .logsink import configure_logging, flush_logs
+from .metrics import mark_worker_dead, render_metrics
+from .middleware.pipeline import GatewayMiddleware
 from .routers import chat, embeddings, health, models
 
 
-# Configure structlog basic setup
-structlog.configure(processors=[structlog.processors.JSONRenderer()])
+# Structured logs are queued and written off the event loop (LOG_ASYNC)
+configure_logging()
+logger = structlog.get_logger()
 
 
 def create_app() -> FastAPI:
@@ -27,20 +29,89 @@ def create_app() -> FastAPI:
         pass
     settings = get_settings()
 
-    # Initialize database and tables
-    try:
-        from .db.base import create_all  # lazy import so env is loaded
-        create_all()
-    except Exception:
-        # Avoid failing app startup if DB init fails; routes may still be useful
-        pass
-
-    app = FastAPI(title="AI Backend Gateway", version="0.1.0", openapi_url="/openapi.json")
-
-    # Middleware
-    app.add_middleware(RequestLoggingMiddleware)
-    app.add_middleware(RateLimitMiddleware)
-    app.add_middleware(ApiKeyMiddleware)
+    from .apikeys import configure_key_store
+    from .healthcheck import configure_health_checker
+    from .lifecycle import configure_lifecycle
+    from .loopmon import configure_loop_monitor
+    from .profiler import configure_profiler
+    from .quota import QuotaFlusher, configure_quotas
+    from .routing.discovery import configure_route_discovery
+    from .shared import configure_shared_store
+    from .tracing import configure_tracing
+
+    lifecycle = configure_lifecycle()
+    # Model catalog cache shared by the workers (USE_REDIS or SHARED_STATE_DIR)
+    shared_store = configure_shared_store()
+    if shared_store is not None:
+        lifecycle.add_closer(shared_store.aclose)
+    configure_key_store()
+    health_checker = configure_health_checker()
+    # Runtime route changes (ROUTES_FILE, /api/admin/routes) and closing drained pools
+    route_discovery = configure_route_discovery()
+    quota_manager = configure_quotas()
+    flusher = QuotaFlusher(quota_manager, settings.quota_flush_seconds) if quota_manager is not None else None
+    loop_monitor = configure_loop_monitor()
+    profiler = configure_profiler()
+    tracer = configure_tracing()
+    scheduler = None
+    if settings.retention_enable:
+        from .db.retention import RetentionScheduler
+
+        scheduler = RetentionScheduler(settings.retention_interval_seconds)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        # Initialize database and tables (FTS DDL included) off the event loop
+        try:
+            from .db.base import create_all  # lazy import so env is loaded
+
+            await asyncio.to_thread(create_all)
+        except Exception as exc:
+            # Avoid failing app startup if DB init fails; routes may still be useful
+            logger.warning("db_init_failed", error=str(exc))
+        lifecycle.install_signal_handlers()
+        if loop_monitor is not None:
+            loop_monitor.start()
+        if profiler is not None:
+            profiler.start()
+        if flusher is not None:
+            await flusher.start()
+        if scheduler is not None:
+            scheduler.start()
+        route_discovery.start()
+        health_checker.start()
+        # Ready (GET /readyz) once every route's pool is warm and the catalog has loaded
+        lifecycle.start_catalog_load(settings.upstream_warm_connections)
+        try:
+            yield
+        finally:
+            # New work is refused from here; streams get until the drain deadline
+            lifecycle.begin_drain()
+            left = await lifecycle.wait_for_streams()
+            if left:
+                logger.warning("drain_deadline_passed", active_streams=left)
+            await lifecycle.stop_catalog_load()
+            await health_checker.stop()
+            await route_discovery.stop()
+            if scheduler is not None:
+                await scheduler.stop()
+            # Persist what is buffered before the pools it may need are closed
+            if flusher is not None:
+                await flusher.stop()
+            if tracer is not None:
+                tracer.exporter.flush()
+            if profiler is not None:
+                await profiler.stop()
+            if loop_monitor is not None:
+                await loop_monitor.stop()
+            await lifecycle.close_pools()
+            flush_logs()
+            mark_worker_dead()
+
+    app = FastAPI(title="AI Backend Gateway", version="0.1.0", openapi_url="/openapi.json", lifespan=lifespan)
+
+    # Middleware: logging, auth and rate limiting in a single pure-ASGI layer
+    app.add_middleware(GatewayMiddleware)
 
     # CORS
     allow_origins: List[str] = settings.allow_origins_list
@@ -59,12 +130,14 @@ def create_app() -> FastAPI:
     api.include_router(chat.router)
     api.include_router(embeddings.router)
     # Storage/search APIs
-    from .routers import conversations, messages, search, backup, message_management
+    from .routers import admin, conversations, messages, search, backup, message_management, retention
     api.include_router(conversations.router)
     api.include_router(messages.router)
     api.include_router(message_management.router)
     api.include_router(search.router)
     api.include_router(backup.router)
+    api.include_router(retention.router)
+    api.include_router(admin.router)
 
     app.mount("/api", api)
 
@@ -74,8 +147,9 @@ def create_app() -> FastAPI:
     if settings.prometheus_enable:
         @app.get("/metrics")
         async def metrics():  # type: ignore[no-redef]
-            # Using default registry
-            return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+            # Default registry, or aggregated across workers in multiprocess mode
+            body, content_type = render_metrics()
+            return Response(body, media_type=content_type)
 
     return app
 
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+# Label values beyond these limits are reported as "other" so a client sending
+# arbitrary model names cannot blow up the number of series
+MAX_ROUTE_LABELS = 32
+MAX_MODEL_LABELS = 64
+MAX_KEY_LABELS = 64
+MAX_QUERY_LABELS = 128
+
+_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+_TTFT_BUCKETS = (0.025, 0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0)
+_ITL_BUCKETS = (0.002, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0)
+_TPS_BUCKETS = (1, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500)
+_LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class BoundedLabel:
+    """Passes through the first ``limit`` distinct values, then maps new ones to ``other``."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._seen: set[str] = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, value: Optional[str]) -> str:
+        value = value or ""
+        if value in self._seen:
+            return value
+        with self._lock:
+            if value in self._seen:
+                return value
+            if len(self._seen) < self.limit:
+                self._seen.add(value)
+                return value
+        return "other"
+
+
+route_label = BoundedLabel(MAX_ROUTE_LABELS)
+model_label = BoundedLabel(MAX_MODEL_LABELS)
+key_label = BoundedLabel(MAX_KEY_LABELS)
+query_label = BoundedLabel(MAX_QUERY_LABELS)
+
+
+UPSTREAM_REQUESTS = Counter(
+    "gateway_upstream_requests_total",
+    "Upstream vLLM calls by outcome",
+    ["route", "model", "endpoint", "outcome"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "gateway_upstream_request_seconds",
+    "Upstream call latency (headers received for streams)",
+    ["route", "model", "endpoint"],
+    buckets=_LATENCY_BUCKETS,
+)
+UPSTREAM_UP = Gauge(
+    "gateway_upstream_up",
+    "Whether the route's last background health check succeeded",
+    ["route"],
+    multiprocess_mode="livemax",
+)
+ROUTE_RESOLUTION = Histogram(
+    "gateway_route_resolution_seconds",
+    "Time spent resolving route and model",
+    ["task", "outcome"],
+    buckets=_LATENCY_BUCKETS,
+)
+TTFT = Histogram(
+    "gateway_time_to_first_token_seconds",
+    "Time from upstream stream start to the first content chunk",
+    ["route", "model"],
+    buckets=_TTFT_BUCKETS,
+)
+INTER_TOKEN_LATENCY = Histogram(
+    "gateway_inter_token_latency_seconds",
+    "Gap between consecutive content chunks",
+    ["route", "model"],
+    buckets=_ITL_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "gateway_stream_tokens_per_second",
+    "Decode throughput per stream after the first token",
+    ["route", "model"],
+    buckets=_TPS_BUCKETS,
+)
+STREAM_TOKENS = Counter(
+    "gateway_stream_tokens_total",
+    "Content chunks relayed to clients (approximately one token each)",
+    ["route", "model"],
+)
+STREAMS = Counter(
+    "gateway_streams_total",
+    "Finished streams by outcome",
+    ["route", "model", "outcome"],
+)
+MODEL_FALLBACKS = Counter(
+    "gateway_model_fallbacks_total",
+    "Chat requests served by a fallback model (MODEL_FALLBACKS) because the requested one was overloaded",
+    ["requested_model", "model", "reason"],
+)
+STREAM_FAILOVERS = Counter(
+    "gateway_stream_failovers_total",
+    "Streams moved to another replica before the first token, by the route given up on",
+    ["route", "reason"],
+)
+STREAM_RETRY_BUDGET_EXHAUSTED = Counter(
+    "gateway_stream_retry_budget_exhausted_total",
+    "Stream failovers skipped because the retry budget was spent",
+)
+INFLIGHT_STREAMS = Gauge(
+    "gateway_inflight_streams",
+    "Streams currently being relayed",
+    ["route", "model"],
+    multiprocess_mode="livesum",
+)
+REQUESTS_BY_KEY = Counter(
+    "gateway_requests_total",
+    "Gateway requests by API key name and status class",
+    ["key", "status"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "gateway_log_records_dropped_total",
+    "Log records dropped because the log queue was full",
+)
+RATELIMIT_REJECTIONS = Counter(
+    "gateway_ratelimit_rejections_total",
+    "Requests rejected with 429 by the gateway rate limiter",
+    ["endpoint_class"],
+)
+
+EVENT_LOOP_LAG = Histogram(
+    "gateway_event_loop_lag_seconds",
+    "How late the event loop ran a timer scheduled by the lag monitor",
+    buckets=_LOOP_LAG_BUCKETS,
+)
+EVENT_LOOP_BLOCKS = Counter(
+    "gateway_event_loop_blocks_total",
+    "Times the event loop was blocked for longer than LOOP_BLOCK_THRESHOLD_MS",
+)
+BLOCKING_CALLS = Counter(
+    "gateway_blocking_calls_total",
+    "Sync DB, compression or Redis calls made on the event loop thread (LOOP_DEBUG_BLOCKING)",
+    ["kind"],
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "gateway_db_query_seconds",
+    "SQL statement execution time by normalized statement (query id, see /api/admin/queries)",
+    ["query", "operation"],
+    buckets=_QUERY_BUCKETS,
+)
+DB_SLOW_QUERIES = Counter(
+    "gateway_db_slow_queries_total",
+    "SQL statements slower than DB_SLOW_QUERY_MS",
+    ["operation"],
+)
+
+
+def error_outcome(exc: BaseException) -> str:
+    """Map an upstream failure to a small fixed set of outcome labels."""
+    if isinstance(exc, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(exc, httpx.ConnectError):
+        return "connect_error"
+    if isinstance(exc, httpx.HTTPStatusError):
+        return f"http_{exc.response.status_code // 100}xx"
+    if isinstance(exc, HTTPException):
+        return f"http_{exc.status_code // 100}xx"
+    return "error"
+
+
+def observe_upstream(
+    route: str, model: Optional[str], endpoint: str, started: float, exc: Optional[BaseException] = None
+) -> None:
+    r, m = route_label(route), model_label(model)
+    UPSTREAM_LATENCY.labels(r, m, endpoint).observe(time.perf_counter() - started)
+    UPSTREAM_REQUESTS.labels(r, m, endpoint, "ok" if exc is None else error_outcome(exc)).inc()
+
+
+class StreamMetrics:
+    """Per-stream token timing; label children are resolved once so each chunk costs one observe."""
+
+    __slots__ = (
+        "_route", "_model", "_ttft", "_itl", "_tps", "_tokens", "_inflight",
+        "started", "first_at", "last_at", "tokens", "_closed",
+    )
+
+    def __init__(self, route: str, model: Optional[str], started: Optional[float] = None) -> None:
+        self._route, self._model = route_label(route), model_label(model)
+        self._ttft = TTFT.labels(self._route, self._model)
+        self._itl = INTER_TOKEN_LATENCY.labels(self._route, self._model)
+        self._tps = TOKENS_PER_SECOND.labels(self._route, self._model)
+        self._tokens = STREAM_TOKENS.labels(self._route, self._model)
+        self._inflight = INFLIGHT_STREAMS.labels(self._route, self._model)
+        self.started = started if started is not None else time.perf_counter()
+        self.first_at: Optional[float] = None
+        self.last_at: Optional[float] = None
+        self.tokens = 0
+        self._closed = False
+        self._inflight.inc()
+
+    def on_token(self) -> None:
+        now = time.perf_counter()
+        if self.first_at is None:
+            self.first_at = now
+            self._ttft.observe(now - self.started)
+        else:
+            self._itl.observe(now - self.last_at)  # type: ignore[operator]
+        self.last_at = now
+        self.tokens += 1
+
+    @property
+    def ttft_seconds(self) -> Optional[float]:
+        return None if self.first_at is None else self.first_at - self.started
+
+    def close(self, outcome: str = "ok") -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._inflight.dec()
+        if self.tokens:
+            self._tokens.inc(self.tokens)
+        if self.tokens > 1 and self.last_at is not None and self.first_at is not None and self.last_at > self.first_at:
+            self._tps.observe((self.tokens - 1) / (self.last_at - self.first_at))
+        STREAMS.labels(self._route, self._model, outcome).inc()
+
+
+def is_content_chunk(line: bytes) -> bool:
+    """Cheap check for an SSE data line carrying non-empty delta content (no JSON parse)."""
+    if not line.startswith(b"data:"):
+        return False
+    idx = line.find(b'"content":')
+    if idx < 0:
+        return False
+    rest = line[idx + 10 : idx + 16].lstrip()
+    return not (rest.startswith(b'""') or rest.startswith(b"null"))
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Render the registry, aggregating across workers when PROMETHEUS_MULTIPROC_DIR is set."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_worker_dead() -> None:
+    """Drop this worker's live gauges from the multiprocess aggregate (call on shutdown)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,29 +1,54 @@
 from __future__ import annotations
 
-from typing import Callable
+import hmac
+from typing import Optional
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import Scope
 
+from ..apikeys import STATIC_IDENTITY, get_key_store
 from ..config import get_settings
+from ..lifecycle import PROBE_PREFIXES
+from .ratelimit import endpoint_class
 
+# Scope a key needs per endpoint class; other classes only need a valid key
+REQUIRED_SCOPES = {"chat": "chat", "embeddings": "embeddings", "admin": "admin"}
 
-class ApiKeyMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:  # type: ignore[override]
+
+class ApiKeyAuth:
+    """Resolves ``X-API-Key`` to a caller identity; returns a 401/403 response on failure.
+
+    Accepts the shared ``settings.api_key`` (all scopes) and keys issued in
+    the ``api_keys`` table. The identity is stored in ``scope["state"]["api_key"]``
+    for rate limiting, quotas, logs and metrics. Auth is enforced when
+    ``AUTH_REQUIRED`` is set and at least one key is configured.
+    """
+
+    async def check(self, scope: Scope) -> Optional[Response]:
         settings = get_settings()
-        path = request.url.path
-        if path.startswith("/health") or path.startswith("/api/health"):
-            return await call_next(request)
+        path = scope["path"]
+        if path.startswith(PROBE_PREFIXES):
+            return None
         if path.startswith("/metrics") and settings.metrics_public:
-            return await call_next(request)
+            return None
         if not settings.auth_required:
-            return await call_next(request)
-        if not settings.api_key:
+            return None
+        store = get_key_store()
+        if not settings.api_key and not await store.enabled():
             # No API key configured => open access
-            return await call_next(request)
-        provided = request.headers.get("X-API-Key")
-        if not provided or provided != settings.api_key:
-            from fastapi import HTTPException, status
-
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid API key")
-        return await call_next(request)
+            return None
+        provided = Headers(scope=scope).get("x-api-key")
+        if not provided:
+            return JSONResponse({"detail": "Missing or invalid API key"}, status_code=401)
+        if settings.api_key and hmac.compare_digest(provided.encode(), settings.api_key.encode()):
+            identity = STATIC_IDENTITY
+        else:
+            identity = await store.authenticate(provided)
+            if identity is None:
+                return JSONResponse({"detail": "Missing or invalid API key"}, status_code=401)
+        required = REQUIRED_SCOPES.get(endpoint_class(path))
+        if required is not None and not identity.allows(required):
+            return JSONResponse({"detail": f"API key lacks scope '{required}'"}, status_code=403)
+        scope.setdefault("state", {})["api_key"] = identity
+        return None
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import time
+import uuid
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..lifecycle import DRAIN_EXEMPT_PREFIXES, get_lifecycle
+from ..logsink import RequestSampler, begin_request, end_request
+from ..loopmon import bind_request, current_request_id
+from ..metrics import REQUESTS_BY_KEY, key_label
+from ..profiler import get_profiler
+from ..tracing import get_tracer
+from .auth import ApiKeyAuth
+from .logging import log_request
+from .ratelimit import RateLimiter
+
+
+class GatewayMiddleware:
+    """Request logging, tracing, profiling, API key auth and rate limiting as one pure-ASGI layer.
+
+    Unlike ``BaseHTTPMiddleware`` this adds no task or memory stream per
+    request: response messages (including every SSE chunk) go straight to the
+    server's ``send`` and rejections are sent as plain JSON responses.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.auth = ApiKeyAuth()
+        self.limiter = RateLimiter()
+        self.sampler = RequestSampler.from_settings()
+        self.tracer = get_tracer()
+        self.profiler = get_profiler()
+        self.lifecycle = get_lifecycle()
+        # Redis connections of the limiter are closed with the other pools on shutdown
+        self.lifecycle.add_closer(self.limiter.aclose)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        request_id = request_headers.get("x-request-id") or str(uuid.uuid4())
+        scope.setdefault("state", {})["request_id"] = request_id
+        start = time.perf_counter()
+        status_code = 500
+        log_token = begin_request()
+        request_token = bind_request(request_id)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(request_id, scope["path"])
+        tracer = self.tracer
+        if tracer is not None:
+            root, trace_token = tracer.start(
+                "http.request",
+                request_headers.get("traceparent"),
+                method=scope["method"],
+                path=scope["path"],
+                request_id=request_id,
+            )
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Ensure X-Request-Id is set
+                headers = MutableHeaders(scope=message)
+                if "x-request-id" not in headers:
+                    headers.append("X-Request-Id", request_id)
+                if tracer is not None:
+                    headers.append("X-Trace-Id", root.trace.trace_id)
+            await send(message)
+
+        try:
+            rejection = (
+                self._draining(scope) or await self.auth.check(scope) or await self.limiter.check(scope)
+            )
+            if rejection is not None:
+                await rejection(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            fields = end_request(log_token)
+            current_request_id.reset(request_token)
+            identity = scope["state"].get("api_key")
+            key_name = identity.name if identity is not None else None
+            if tracer is not None:
+                root.set(key=key_name)
+                # Tail sampling: decided here, once the whole trace is known
+                if tracer.finish(root, trace_token, status_code):
+                    fields["trace_id"] = root.trace.trace_id
+            REQUESTS_BY_KEY.labels(key_label(key_name or "anonymous"), f"{status_code // 100}xx").inc()
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            if profiler is not None:
+                reason = profiler.end(request_id, scope["path"], fields.get("model"), status_code, duration_ms)
+                if reason is not None:
+                    fields["profiled"] = reason
+            # Errors and slow requests are always logged; the rest may be sampled
+            rate = self.sampler.keep(scope["path"], status_code, duration_ms)
+            if rate is not None:
+                if rate < 1.0:
+                    fields["sample_rate"] = rate
+                log_request(
+                    path=scope["path"],
+                    method=scope["method"],
+                    status=status_code,
+                    duration_ms=duration_ms,
+                    request_id=request_id,
+                    key=key_name,
+                    **fields,
+                )
+
+    def _draining(self, scope: Scope) -> Optional[JSONResponse]:
+        if not self.lifecycle.draining or scope["path"].startswith(DRAIN_EXEMPT_PREFIXES):
+            return None
+        return JSONResponse(
+            {"detail": "Server is shutting down"},
+            status_code=503,
+            headers={"Retry-After": "1", "Connection": "close"},
+        )
@@ -1,89 +1,370 @@
 from __future__ import annotations
 
+import hashlib
+import math
 import time
-from typing import Callable, Optional
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 import structlog
-from fastapi import HTTPException, Request, Response, status
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import Scope
 
 from ..config import get_settings
+from ..lifecycle import PROBE_PREFIXES
+from ..metrics import RATELIMIT_REJECTIONS
 
 try:
-    import redis  # type: ignore
+    import redis.asyncio as aioredis  # type: ignore
+    from redis.exceptions import NoScriptError  # type: ignore
 except Exception:  # pragma: no cover
-    redis = None  # type: ignore
+    aioredis = None  # type: ignore
+
+    class NoScriptError(Exception):  # type: ignore[no-redef]
+        pass
 
 
 logger = structlog.get_logger()
 
 
 class InMemoryBucket:
-    def __init__(self, capacity: int, refill_per_second: float) -> None:
+    """Sharded GCRA limiter with bounded memory.
+
+    Each key stores a single float, its *theoretical arrival time* (TAT): the
+    moment its bucket would be full again. That is all the state a token
+    bucket needs, and once ``TAT <= now`` the entry is indistinguishable from
+    a fresh key, so idle keys are dropped without changing any decision.
+    Keys are stored by ``hash()`` in per-shard ``OrderedDict``s kept in LRU
+    order; when a shard reaches its share of ``max_keys`` the least recently
+    seen key is evicted (that client starts again with a full bucket).
+
+    Sharding keeps each dict small so a resize never stalls the event loop for
+    long. Not thread-safe: it is only called from the event loop.
+    """
+
+    is_async = False
+
+    def __init__(
+        self,
+        capacity: int,
+        refill_per_second: float,
+        max_keys: int = 100_000,
+        shards: int = 16,
+    ) -> None:
         self.capacity = capacity
         self.refill_per_second = refill_per_second
-        self.allowance = {}
-        self.last_check = {}
-
-    def allow(self, key: str) -> bool:
-        now = time.time()
-        last = self.last_check.get(key, now)
-        self.last_check[key] = now
-        allowance = self.allowance.get(key, self.capacity)
-        allowance += (now - last) * self.refill_per_second
-        if allowance > self.capacity:
-            allowance = self.capacity
-        if allowance < 1.0:
-            self.allowance[key] = allowance
-            return False
-        else:
-            self.allowance[key] = allowance - 1.0
-            return True
+        self.shard_count = 1 << max(0, (shards - 1).bit_length())
+        self.shard_max = max(1, max_keys // self.shard_count)
+        self._shards: List["OrderedDict[int, float]"] = [OrderedDict() for _ in range(self.shard_count)]
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def clear(self) -> None:
+        for shard in self._shards:
+            shard.clear()
+
+    def acquire(
+        self, key: str, capacity: Optional[int] = None, refill_per_second: Optional[float] = None
+    ) -> float:
+        """Take one token for ``key``; returns 0.0 if allowed, else seconds until it would be."""
+        capacity = max(1, capacity or self.capacity)
+        refill = refill_per_second if refill_per_second is not None else self.refill_per_second
+        interval = 1.0 / refill if refill > 0 else 1e12
+        h = hash(key)
+        shard = self._shards[h & (self.shard_count - 1)]
+        now = time.monotonic()
+
+        tat = shard.get(h)
+        if tat is None or tat < now:
+            tat = now
+        # Allowed while the backlog ahead of this request fits in the burst
+        excess = (tat - now) - (capacity - 1) * interval
+        if excess > 0:
+            # Denied: state is unchanged, but the key was just seen
+            shard.move_to_end(h)
+            return excess
+
+        shard[h] = tat + interval
+        shard.move_to_end(h)
+        if len(shard) > self.shard_max:
+            self._evict(shard, now)
+        return 0.0
+
+    def allow(self, key: str, capacity: Optional[int] = None, refill_per_second: Optional[float] = None) -> bool:
+        return self.acquire(key, capacity, refill_per_second) == 0.0
+
+    def _evict(self, shard: "OrderedDict[int, float]", now: float) -> None:
+        # Prefer a few idle (already refilled) keys at the LRU end; otherwise drop the oldest
+        for _ in range(8):
+            h, tat = next(iter(shard.items()))
+            if tat > now:
+                break
+            del shard[h]
+            self.evicted_idle += 1
+            if len(shard) <= self.shard_max:
+                return
+        while len(shard) > self.shard_max:
+            shard.popitem(last=False)
+            self.evicted_lru += 1
+
+
+# GCRA over Redis, the same algorithm as InMemoryBucket, granting up to ARGV[3]
+# tokens at once. Times are in ms from the server clock so instances never
+# disagree about "now". Floats are returned as strings (Lua numbers are
+# truncated to integers in replies).
+TOKEN_BUCKET_LUA = """
+local interval = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then tat = now end
+local available = math.floor((capacity * interval - (tat - now)) / interval + 1e-9)
+if available < 1 then
+  return {0, tostring(tat - now - (capacity - 1) * interval)}
+end
+local granted = math.min(requested, available)
+tat = tat + granted * interval
+redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil(tat - now))
+return {granted, '0'}
+"""
+
+
+class _Lease:
+    __slots__ = ("tokens", "expires", "size", "denied")
+
+    def __init__(self, tokens: int, expires: float, size: int, denied: bool = False) -> None:
+        self.tokens = tokens
+        self.expires = expires
+        self.size = size
+        self.denied = denied
 
 
 class RedisBucket:
-    def __init__(self, client, capacity: int, refill_per_second: float) -> None:
+    """Distributed token bucket on ``redis.asyncio`` with local token leasing.
+
+    Each Redis call may take a batch of tokens for a key; later requests from
+    the same client on this instance spend them locally until the lease runs
+    out or expires. Lease size starts at 1 and doubles while a client keeps
+    exhausting leases, so occasional clients never pay for unused tokens and
+    busy ones need about one round-trip per ``lease_size`` requests. Unused
+    leased tokens are lost when the lease expires, which only ever makes the
+    limit stricter. Denials are cached until the retry time Redis reported.
+
+    When Redis fails the decision follows ``fail_open`` and Redis is skipped
+    for ``backoff_seconds`` so requests do not queue up behind timeouts.
+    """
+
+    is_async = True
+
+    def __init__(
+        self,
+        client,
+        capacity: int,
+        refill_per_second: float,
+        lease_size: int = 10,
+        lease_ttl: float = 1.0,
+        fail_open: bool = True,
+        max_keys: int = 100_000,
+        backoff_seconds: float = 1.0,
+        prefix: str = "rate:",
+    ) -> None:
         self.client = client
         self.capacity = capacity
         self.refill_per_second = refill_per_second
+        self.lease_size = max(1, lease_size)
+        self.lease_ttl = lease_ttl
+        self.fail_open = fail_open
+        self.max_keys = max_keys
+        self.backoff_seconds = backoff_seconds
+        self.prefix = prefix
+        self._leases: "OrderedDict[str, _Lease]" = OrderedDict()
+        self._sha: Optional[str] = None
+        self._down_until = 0.0
+        self.redis_calls = 0
+        self.failures = 0
 
-    def allow(self, key: str) -> bool:
-        # Simple approximation using TTL counters
-        # Key design: rate:{key}
-        pipe = self.client.pipeline(transaction=True)
-        key_name = f"rate:{key}"
+    async def acquire(
+        self, key: str, capacity: Optional[int] = None, refill_per_second: Optional[float] = None
+    ) -> float:
+        capacity = max(1, capacity or self.capacity)
+        refill = refill_per_second if refill_per_second is not None else self.refill_per_second
+        now = time.monotonic()
+        lease = self._leases.get(key)
+        if lease is not None and lease.expires > now:
+            if lease.denied:
+                # Redis said no until then; other instances can only make it later
+                return lease.expires - now
+            if lease.tokens > 0:
+                lease.tokens -= 1
+                return 0.0
+            # Used up a lease within its TTL: this client is busy, lease more next time
+            size = min(lease.size * 2, self.lease_size, max(1, capacity // 4))
+        else:
+            size = 1
+
+        if now < self._down_until:
+            return self._on_failure()
+        interval_ms = 1000.0 / refill if refill > 0 else 1e15
+        try:
+            granted, retry_ms = await self._run(self.prefix + key, interval_ms, capacity, size)
+        except Exception as exc:
+            self.failures += 1
+            self._down_until = now + self.backoff_seconds
+            logger.warning("ratelimit_redis_error", error=str(exc), fail_open=self.fail_open)
+            return self._on_failure()
+
+        if granted < 1:
+            retry = max(retry_ms / 1000.0, 0.001)
+            self._store(key, _Lease(0, now + retry, size, denied=True))
+            return retry
+        self._store(key, _Lease(granted - 1, now + self.lease_ttl, size))
+        return 0.0
+
+    def _store(self, key: str, lease: _Lease) -> None:
+        self._leases[key] = lease
+        self._leases.move_to_end(key)
+        if len(self._leases) > self.max_keys:
+            self._leases.popitem(last=False)
+
+    async def _run(self, key: str, interval_ms: float, capacity: int, requested: int) -> Tuple[int, float]:
+        self.redis_calls += 1
+        args = (interval_ms, capacity, requested)
+        if self._sha is None:
+            self._sha = await self.client.script_load(TOKEN_BUCKET_LUA)
         try:
-            pipe.incr(key_name, 1)
-            pipe.expire(key_name, 60)
-            count, _ = pipe.execute()
-            return int(count) <= self.capacity
-        except Exception:
-            # Fail-open
-            return True
-
-
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app) -> None:  # type: ignore[no-untyped-def]
-        super().__init__(app)
+            granted, retry_ms = await self.client.evalsha(self._sha, 1, key, *args)
+        except NoScriptError:
+            # Script cache flushed (restart/failover): load it again
+            self._sha = await self.client.script_load(TOKEN_BUCKET_LUA)
+            granted, retry_ms = await self.client.evalsha(self._sha, 1, key, *args)
+        return int(granted), float(retry_ms)
+
+    def _on_failure(self) -> float:
+        return 0.0 if self.fail_open else self.backoff_seconds
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+# Endpoint classes by path prefix; each class has its own limit and buckets
+ENDPOINT_CLASSES: Tuple[Tuple[str, str], ...] = (
+    ("/api/chat", "chat"),
+    ("/api/embeddings", "embeddings"),
+    ("/api/backup", "admin"),
+    ("/api/retention", "admin"),
+    ("/api/admin", "admin"),
+)
+EXEMPT_PREFIXES: Tuple[str, ...] = PROBE_PREFIXES + ("/metrics",)
+KEY_PARTS = {"ip", "api_key", "path"}
+
+
+def endpoint_class(path: str) -> str:
+    for prefix, name in ENDPOINT_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return "default"
+
+
+class RateLimiter:
+    """Per-client limiter; returns a 429 response when the client's bucket is empty.
+
+    The client key is built from ``RATE_LIMIT_KEY`` parts (``ip``, ``api_key``,
+    ``path``) and always includes the endpoint class, whose per-minute limit
+    comes from ``RATE_LIMIT_CLASSES`` (falling back to ``RATE_LIMIT_PER_MIN``)
+    unless the caller's API key carries its own ``rate_limit_per_min``. Keys
+    whose ``priority`` is listed in ``RATE_LIMIT_PRIORITIES`` get the class
+    limit scaled by that factor, counted per key.
+
+    With the in-memory bucket and ``WORKERS`` > 1 processes each worker
+    enforces ``1/WORKERS`` of every limit: the kernel spreads connections
+    over the workers, so the sum approximates the configured limit. Use
+    ``USE_REDIS`` for exact limits across workers and hosts.
+    """
+
+    def __init__(self) -> None:
         settings = get_settings()
         capacity = max(1, settings.rate_limit_per_minute)
         refill = capacity / 60.0
-        if settings.use_redis and settings.redis_url and redis is not None:
-            try:
-                client = redis.from_url(settings.redis_url)
-                # test ping
-                client.ping()
-                self.bucket = RedisBucket(client, capacity, refill)
-                logger.info("ratelimit", backend="redis")
-            except Exception:
-                self.bucket = InMemoryBucket(capacity, refill)
-                logger.info("ratelimit", backend="memory_fallback")
+        self.limits: Dict[str, int] = {"default": capacity, **settings.rate_limit_classes_map}
+        self.priorities: Dict[str, float] = settings.rate_limit_priorities_map
+        self.key_parts = [p for p in settings.rate_limit_key_list if p in KEY_PARTS] or ["ip"]
+        self.workers = 1
+        if settings.use_redis and settings.redis_url and aioredis is not None:
+            # Connections are opened lazily on first use, so startup never blocks on Redis
+            timeout = settings.rate_limit_redis_timeout_ms / 1000.0
+            client = aioredis.from_url(
+                settings.redis_url, socket_timeout=timeout, socket_connect_timeout=timeout
+            )
+            self.bucket = RedisBucket(
+                client,
+                capacity,
+                refill,
+                lease_size=settings.rate_limit_lease_size,
+                lease_ttl=settings.rate_limit_lease_ttl_ms / 1000.0,
+                fail_open=settings.rate_limit_fail_open,
+                max_keys=settings.rate_limit_max_keys,
+            )
+            logger.info("ratelimit", backend="redis", fail_open=settings.rate_limit_fail_open)
         else:
-            self.bucket = InMemoryBucket(capacity, refill)
-            logger.info("ratelimit", backend="memory")
-
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:  # type: ignore[override]
-        client_ip = request.client.host if request.client else "unknown"
-        if not self.bucket.allow(client_ip):
-            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded")
-        return await call_next(request)
+            self.bucket = InMemoryBucket(capacity, refill, max_keys=settings.rate_limit_max_keys)
+            self.workers = max(1, settings.workers)
+            logger.info("ratelimit", backend="memory", max_keys=settings.rate_limit_max_keys, workers=self.workers)
+
+    def client_key(self, scope: Scope, klass: str) -> str:
+        parts = [klass]
+        for part in self.key_parts:
+            if part == "ip":
+                client = scope.get("client")
+                parts.append(client[0] if client else "unknown")
+            elif part == "api_key":
+                identity = scope.get("state", {}).get("api_key")
+                if identity is not None:
+                    parts.append(identity.id)
+                else:
+                    # Never keep raw keys around; a short digest is enough to tell clients apart
+                    provided = Headers(scope=scope).get("x-api-key")
+                    parts.append(hashlib.blake2b(provided.encode(), digest_size=8).hexdigest() if provided else "-")
+            elif part == "path":
+                parts.append(scope["path"])
+        return "|".join(parts)
+
+    async def check(self, scope: Scope) -> Optional[Response]:
+        path = scope["path"]
+        if path.startswith(EXEMPT_PREFIXES):
+            return None
+        klass = endpoint_class(path)
+        limit = self.limits.get(klass, self.limits["default"])
+        identity = scope.get("state", {}).get("api_key")
+        if identity is not None and identity.rate_limit_per_min:
+            # Per-key limit replaces the class default and is counted per key
+            limit = identity.rate_limit_per_min
+            key = f"{klass}|key:{identity.id}"
+        elif identity is not None and identity.priority in self.priorities:
+            # Priority lanes: the class limit scaled for this key's priority, counted per key
+            limit = max(1, int(limit * self.priorities[identity.priority]))
+            key = f"{klass}|key:{identity.id}"
+        else:
+            key = self.client_key(scope, klass)
+        if self.bucket.is_async:
+            retry_after = await self.bucket.acquire(key, limit, limit / 60.0)
+        else:
+            share = limit / self.workers
+            retry_after = self.bucket.acquire(key, max(1, math.ceil(share)), share / 60.0)
+        if retry_after > 0:
+            RATELIMIT_REJECTIONS.labels(klass).inc()
+            return JSONResponse(
+                {"detail": "Rate limit exceeded"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+        return None
+
+    async def aclose(self) -> None:
+        if self.bucket.is_async:
+            await self.bucket.aclose()
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from types import CodeType, FrameType
+from typing import Any, Dict, List, Optional
+
+from .config import get_settings
+from .loopmon import task_requests
+
+# Frames deeper than this are cut off (the root end of the stack is kept)
+_MAX_DEPTH = 128
+
+_labels: Dict[CodeType, str] = {}
+
+
+def _label(code: CodeType) -> str:
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        parts = filename.split(os.sep)
+        short = os.sep.join(parts[-2:]) if len(parts) > 1 else filename
+        # ';' separates frames in folded output (the count follows the last space)
+        label = f"{code.co_name} ({short}:{code.co_firstlineno})".replace(";", ":")
+        _labels[code] = label
+    return label
+
+
+def fold_stack(frame: Optional[FrameType]) -> str:
+    """Root-first ``;``-joined function labels for ``frame``'s stack."""
+    labels: List[str] = []
+    while frame is not None and len(labels) < _MAX_DEPTH:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+def render_folded(counts: Dict[str, int]) -> str:
+    """Folded stack lines (``frame;frame;frame count``), as read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+
+_process_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def profile_process(seconds: float, interval: float = 0.01) -> Dict[str, int]:
+    """Sample every thread's stack each ``interval`` for ``seconds``; blocking, run it off the loop.
+
+    Stacks are prefixed with ``thread:<name>`` so the loop thread, the
+    threadpool and background workers stay apart in the flamegraph. Only one
+    process profile runs at a time (``ProfilerBusy`` otherwise).
+    """
+    if not _process_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        me = threading.get_ident()
+        counts: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    counts[f"thread:{names.get(ident, ident)};{fold_stack(frame)}"] += 1
+            time.sleep(interval)
+        return dict(counts)
+    finally:
+        _process_lock.release()
+
+
+class RequestProfiler:
+    """Per-request profiles of the event-loop thread, for slow or selected requests.
+
+    While it is needed (``slow_ms`` > 0 or ``arm`` was called) a sampler
+    thread reads the loop thread's stack every ``interval`` seconds and adds
+    it to the request whose task is running (see ``loopmon.TaskRequests``).
+    When the request ends its samples are kept if it was selected by ``arm``
+    or took at least ``slow_ms``; the last ``max_captures`` are kept.
+
+    Only time spent on the loop thread is attributed: work a request hands
+    to the threadpool shows up in ``profile_process`` instead.
+    """
+
+    def __init__(self, interval: float = 0.01, slow_ms: float = 0, max_captures: int = 50) -> None:
+        self.interval = interval
+        self.slow_ms = slow_ms
+        self.max_captures = max_captures
+        self.captures: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._armed: Optional[Dict[str, Any]] = None
+        self._active: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def sampling(self) -> bool:
+        return self._loop_thread is not None and (self.slow_ms > 0 or self._armed is not None)
+
+    def start(self) -> None:
+        if self._loop_thread is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        task_requests.install()
+        self._stop.clear()
+        self._ensure_sampler()
+
+    async def stop(self) -> None:
+        if self._loop_thread is None:
+            return
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            await asyncio.to_thread(thread.join, 1.0)
+        task_requests.uninstall()
+        self._loop_thread = None
+
+    def arm(self, count: int, path_prefix: Optional[str] = None, model: Optional[str] = None) -> Dict[str, Any]:
+        """Keep the profiles of the next ``count`` requests matching ``path_prefix``/``model``."""
+        with self._lock:
+            self._armed = {"remaining": count, "path_prefix": path_prefix, "model": model}
+            armed = dict(self._armed)
+        self._ensure_sampler()
+        return armed
+
+    def armed(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return dict(self._armed) if self._armed is not None else None
+
+    def begin(self, request_id: str, path: str) -> None:
+        if not self.sampling:
+            return
+        armed = self._armed
+        if self.slow_ms <= 0 and armed is not None and not path.startswith(armed["path_prefix"] or ""):
+            return
+        with self._lock:
+            self._active[request_id] = Counter()
+
+    def end(
+        self, request_id: str, path: str, model: Optional[str], status: int, duration_ms: int
+    ) -> Optional[str]:
+        """Finish ``request_id``'s profile; returns why it was kept (``requested``/``slow``) or None."""
+        if not self._active:
+            return None
+        with self._lock:
+            counts = self._active.pop(request_id, None)
+            if counts is None:
+                return None
+            reason = None
+            armed = self._armed
+            if (
+                armed is not None
+                and path.startswith(armed["path_prefix"] or "")
+                and (armed["model"] is None or armed["model"] == model)
+            ):
+                reason = "requested"
+                armed["remaining"] -= 1
+                if armed["remaining"] <= 0:
+                    self._armed = None
+            elif self.slow_ms > 0 and duration_ms >= self.slow_ms:
+                reason = "slow"
+            if reason is None:
+                return None
+            self.captures[request_id] = {
+                "request_id": request_id,
+                "path": path,
+                "model": model,
+                "status": status,
+                "duration_ms": duration_ms,
+                "reason": reason,
+                "samples": sum(counts.values()),
+                "interval_ms": self.interval * 1000,
+                "at": time.time(),
+                "stacks": dict(counts),
+            }
+            while len(self.captures) > self.max_captures:
+                self.captures.popitem(last=False)
+        return reason
+
+    def recent(self) -> List[Dict[str, Any]]:
+        """Captured profiles without their stacks, newest first."""
+        with self._lock:
+            captures = list(self.captures.values())
+        return [{k: v for k, v in c.items() if k != "stacks"} for c in reversed(captures)]
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self.captures.get(request_id)
+
+    def _ensure_sampler(self) -> None:
+        with self._lock:
+            if not self.sampling or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._sample, name="request-profiler", daemon=True)
+            self._thread.start()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if not self.sampling:
+                    # Nothing armed and no slow threshold: stop until ``arm`` is called again
+                    self._thread = None
+                    return
+                if not self._active:
+                    continue
+            _, request_id = task_requests.running()
+            if request_id is None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread or -1)
+            stack = fold_stack(frame)
+            with self._lock:
+                counts = self._active.get(request_id)
+                if counts is not None:
+                    counts[stack] += 1
+
+
+_profiler: Optional[RequestProfiler] = None
+
+
+def configure_profiler() -> Optional[RequestProfiler]:
+    """(Re)create the process-wide request profiler; None unless PROFILER_ENABLED."""
+    global _profiler
+    s = get_settings()
+    _profiler = (
+        RequestProfiler(s.profile_interval_ms / 1000, s.profile_slow_ms, s.profile_max_captures)
+        if s.profiler_enabled
+        else None
+    )
+    return _profiler
+
+
+def get_profiler() -> Optional[RequestProfiler]:
+    return _profiler
@@ -0,0 +1,460 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+import structlog
+from fastapi import HTTPException, Request
+from sqlalchemy import select
+
+from .config import get_settings
+
+if TYPE_CHECKING:
+    from .apikeys import KeyIdentity
+
+logger = structlog.get_logger()
+
+# Rough chars-per-token for English text with BPE tokenizers; no tokenizer is loaded
+CHARS_PER_TOKEN = 4
+# Chat template overhead per message (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Counters untouched this long, with nothing reserved or unflushed, are dropped on flush
+IDLE_USAGE_SECONDS = 600
+
+
+def estimate_text_tokens(text: Optional[str]) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_chat_tokens(messages: Iterable[Dict[str, Any]], max_tokens: Optional[int] = None) -> int:
+    """Upper-ish bound for a chat call: estimated prompt plus ``max_tokens`` when given."""
+    prompt = sum(estimate_text_tokens(m.get("content")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+    return prompt + (max_tokens or 0)
+
+
+def estimate_input_tokens(value: Any) -> int:
+    """Embeddings input: a string or a list of strings (token id lists count one per id)."""
+    if isinstance(value, str):
+        return estimate_text_tokens(value)
+    if isinstance(value, list):
+        return sum(estimate_input_tokens(v) if isinstance(v, (str, list)) else 1 for v in value)
+    return 0
+
+
+def request_identity(request: Request) -> Optional["KeyIdentity"]:
+    """Caller identity set by the auth middleware, if the request was authenticated."""
+    return request.scope.get("state", {}).get("api_key")
+
+
+def quota_subject(request: Request) -> str:
+    """Who is charged: the issued key's id, a digest of an unverified key, else the client IP."""
+    identity = request_identity(request)
+    if identity is not None:
+        return "key:" + identity.id
+    provided = request.headers.get("x-api-key")
+    if provided:
+        return "key:" + hashlib.blake2b(provided.encode(), digest_size=8).hexdigest()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+def _today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def _seconds_to_midnight() -> float:
+    now = datetime.utcnow()
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+class _Usage:
+    """Counters for one (subject, model): a sliding one-minute window, today's total and unflushed deltas."""
+
+    __slots__ = (
+        "minute", "minute_tokens", "prev_minute_tokens", "day", "day_tokens", "reserved",
+        "pending_prompt", "pending_completion", "pending_requests", "last_used",
+    )
+
+    def __init__(self, day: str, day_tokens: int = 0) -> None:
+        self.minute = 0
+        self.minute_tokens = 0
+        self.prev_minute_tokens = 0
+        self.day = day
+        self.day_tokens = day_tokens
+        self.reserved = 0
+        self.pending_prompt = 0
+        self.pending_completion = 0
+        self.pending_requests = 0
+        self.last_used = time.time()
+
+    def roll(self, now: float, day: str) -> None:
+        minute = int(now // 60)
+        if minute != self.minute:
+            self.prev_minute_tokens = self.minute_tokens if minute == self.minute + 1 else 0
+            self.minute_tokens = 0
+            self.minute = minute
+        if day != self.day:
+            self.day = day
+            self.day_tokens = 0
+
+    def window_tokens(self, now: float) -> float:
+        # Sliding-window approximation: the previous minute weighted by its overlap
+        elapsed = (now % 60) / 60.0
+        return self.prev_minute_tokens * (1.0 - elapsed) + self.minute_tokens
+
+
+class Reservation:
+    __slots__ = ("subject", "model", "estimate", "settled")
+
+    def __init__(self, subject: str, model: str, estimate: int) -> None:
+        self.subject = subject
+        self.model = model
+        self.estimate = estimate
+        self.settled = False
+
+
+class QuotaManager:
+    """Token-per-minute and daily token quotas per (subject, model).
+
+    A request reserves its estimated size before dispatch and is rejected with
+    429 if that would exceed either quota; once the upstream reports ``usage``
+    the reservation is replaced by the real count. Counters live in memory and
+    are flushed to ``token_usage`` periodically; today's totals are loaded
+    back on startup so a restart does not reset daily quotas.
+
+    With ``WORKERS`` > 1 processes each worker enforces ``1/WORKERS`` of the
+    per-minute quota, as the in-memory rate limiter does. Daily quotas are
+    shared through ``token_usage``: every flush re-reads today's totals, so
+    the daily quota holds across workers within ``QUOTA_FLUSH_SECONDS``.
+    """
+
+    def __init__(
+        self,
+        tpm: int = 0,
+        daily: int = 0,
+        model_tpm: Optional[Dict[str, int]] = None,
+        model_daily: Optional[Dict[str, int]] = None,
+        workers: int = 1,
+    ) -> None:
+        self.tpm = tpm
+        self.daily = daily
+        self.model_tpm = model_tpm or {}
+        self.model_daily = model_daily or {}
+        self.workers = max(1, workers)
+        self._usage: Dict[Tuple[str, str], _Usage] = {}
+        # Set once today's totals were loaded, i.e. counters are persisted
+        self._persisted = False
+
+    @classmethod
+    def from_settings(cls) -> "QuotaManager":
+        s = get_settings()
+        return cls(s.quota_tpm, s.quota_daily_tokens, s.quota_model_tpm_map, s.quota_model_daily_map, s.workers)
+
+    def limits(self, subject: str, model: str, identity: Optional["KeyIdentity"] = None) -> Tuple[int, int]:
+        """(tokens per minute, tokens per day) for this subject and model; 0 means unlimited.
+
+        Quotas set on the caller's API key take precedence over model and global ones.
+        """
+        tpm, daily = self.model_tpm.get(model, self.tpm), self.model_daily.get(model, self.daily)
+        if identity is not None:
+            if identity.quota_tpm is not None:
+                tpm = identity.quota_tpm
+            if identity.quota_daily_tokens is not None:
+                daily = identity.quota_daily_tokens
+        return tpm, daily
+
+    def _get(self, subject: str, model: str, day: str) -> _Usage:
+        usage = self._usage.get((subject, model))
+        if usage is None:
+            usage = self._usage[(subject, model)] = _Usage(day)
+        return usage
+
+    async def ensure_loaded(self, subject: str, model: str) -> None:
+        """Read back today's stored total for a pair whose idle counters were dropped.
+
+        Call before ``reserve``. The lookup runs in a worker thread; its result,
+        zero included, stays in the counters so it is not repeated while the
+        pair is in use.
+        """
+        if not self._persisted or (subject, model) in self._usage:
+            return
+        day = _today()
+        try:
+            day_tokens = await asyncio.to_thread(_stored_day_tokens, subject, model, day)
+        except Exception as exc:
+            logger.warning("quota_load_failed", subject=subject, model=model, error=str(exc))
+            day_tokens = 0
+        # Another request may have created the pair while the lookup ran
+        self._usage.setdefault((subject, model), _Usage(day, day_tokens))
+
+    def reserve(
+        self, subject: str, model: str, estimate: int, identity: Optional["KeyIdentity"] = None
+    ) -> Reservation:
+        now, day = time.time(), _today()
+        usage = self._get(subject, model, day)
+        usage.roll(now, day)
+        usage.last_used = now
+        tpm, daily = self.limits(subject, model, identity)
+        # This worker's share of the per-minute quota (never 0, which means unlimited)
+        tpm = math.ceil(tpm / self.workers)
+        if tpm and usage.window_tokens(now) + usage.reserved + estimate > tpm:
+            raise HTTPException(
+                status_code=429,
+                detail="Token quota exceeded (tokens per minute)",
+                headers={"Retry-After": str(max(1, math.ceil(60 - now % 60)))},
+            )
+        if daily and usage.day_tokens + usage.reserved + estimate > daily:
+            raise HTTPException(
+                status_code=429,
+                detail="Token quota exceeded (daily)",
+                headers={"Retry-After": str(max(1, math.ceil(_seconds_to_midnight())))},
+            )
+        usage.reserved += estimate
+        return Reservation(subject, model, estimate)
+
+    def settle(self, reservation: Optional[Reservation], prompt_tokens: int, completion_tokens: int) -> None:
+        """Replace the reservation with actual usage (call once; later calls are ignored)."""
+        if reservation is None or reservation.settled:
+            return
+        reservation.settled = True
+        now, day = time.time(), _today()
+        usage = self._get(reservation.subject, reservation.model, day)
+        usage.roll(now, day)
+        usage.last_used = now
+        usage.reserved = max(0, usage.reserved - reservation.estimate)
+        total = max(0, prompt_tokens) + max(0, completion_tokens)
+        usage.minute_tokens += total
+        usage.day_tokens += total
+        usage.pending_prompt += max(0, prompt_tokens)
+        usage.pending_completion += max(0, completion_tokens)
+        usage.pending_requests += 1
+
+    def release(self, reservation: Optional[Reservation]) -> None:
+        """Drop a reservation without charging (the upstream call never happened)."""
+        if reservation is None or reservation.settled:
+            return
+        reservation.settled = True
+        usage = self._usage.get((reservation.subject, reservation.model))
+        if usage is not None:
+            usage.reserved = max(0, usage.reserved - reservation.estimate)
+
+    def snapshot(self, subject: str) -> List[Dict[str, Any]]:
+        now, day = time.time(), _today()
+        out = []
+        for (subj, model), usage in self._usage.items():
+            if subj != subject:
+                continue
+            usage.roll(now, day)
+            tpm, daily = self.limits(subj, model)
+            out.append(
+                {
+                    "model": model,
+                    "tokens_last_minute": int(usage.window_tokens(now)),
+                    "tokens_today": usage.day_tokens,
+                    "tpm_limit": tpm,
+                    "daily_limit": daily,
+                }
+            )
+        return out
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """Take the unflushed deltas; call ``restore`` with them if writing fails."""
+        deltas = []
+        # Pairs drained now are kept until the next flush in case writing fails
+        drained = set()
+        for (subject, model), usage in self._usage.items():
+            if usage.pending_requests:
+                deltas.append(
+                    {
+                        "subject": subject,
+                        "model": model,
+                        "day": usage.day,
+                        "prompt_tokens": usage.pending_prompt,
+                        "completion_tokens": usage.pending_completion,
+                        "requests": usage.pending_requests,
+                    }
+                )
+                usage.pending_prompt = usage.pending_completion = usage.pending_requests = 0
+                drained.add((subject, model))
+        # Forget idle pairs so the map does not grow with every subject seen today;
+        # their daily totals are in the database now and ``ensure_loaded`` reads them back
+        today, idle_before = _today(), time.time() - IDLE_USAGE_SECONDS
+        for key in [
+            k
+            for k, u in self._usage.items()
+            if not u.reserved
+            and k not in drained
+            and (u.day != today or (u.last_used < idle_before and (self._persisted or not u.day_tokens)))
+        ]:
+            del self._usage[key]
+        return deltas
+
+    def restore(self, deltas: List[Dict[str, Any]]) -> None:
+        for d in deltas:
+            usage = self._get(d["subject"], d["model"], d["day"])
+            usage.pending_prompt += d["prompt_tokens"]
+            usage.pending_completion += d["completion_tokens"]
+            usage.pending_requests += d["requests"]
+
+    def load_today(self) -> None:
+        """Seed today's daily totals from the database."""
+        day = _today()
+        for (subject, model), tokens in _stored_totals(day).items():
+            self._get(subject, model, day).day_tokens += tokens
+        self._persisted = True
+
+    def refresh_today(self, day: str, totals: Dict[Tuple[str, str], int]) -> None:
+        """Replace daily totals with the stored ones (all workers) plus what is not flushed yet."""
+        for key, usage in self._usage.items():
+            if usage.day == day and key in totals:
+                usage.day_tokens = totals[key] + usage.pending_prompt + usage.pending_completion
+
+
+def _stored_totals(day: str) -> Dict[Tuple[str, str], int]:
+    """Tokens written to ``token_usage`` for ``day``, per (subject, model)."""
+    from .db.base import get_session
+    from .db.models import TokenUsage
+
+    db = get_session()
+    try:
+        rows = db.execute(
+            select(TokenUsage.subject, TokenUsage.model, TokenUsage.prompt_tokens, TokenUsage.completion_tokens)
+            .where(TokenUsage.day == day)
+        ).all()
+    finally:
+        db.close()
+    return {(subject, model): (prompt or 0) + (completion or 0) for subject, model, prompt, completion in rows}
+
+
+def _stored_day_tokens(subject: str, model: str, day: str) -> int:
+    """Tokens already written to ``token_usage`` for one subject, model and day."""
+    from .db.base import get_session
+    from .db.models import TokenUsage
+
+    db = get_session()
+    try:
+        row = db.execute(
+            select(TokenUsage.prompt_tokens, TokenUsage.completion_tokens).where(
+                (TokenUsage.subject == subject) & (TokenUsage.model == model) & (TokenUsage.day == day)
+            )
+        ).first()
+    finally:
+        db.close()
+    return (row[0] or 0) + (row[1] or 0) if row else 0
+
+
+def write_usage(deltas: List[Dict[str, Any]]) -> None:
+    """Add deltas to ``token_usage`` rows (one per subject, model and day)."""
+    if not deltas:
+        return
+    from .db.base import get_engine
+    from .db.models import TokenUsage
+
+    table = TokenUsage.__table__
+    now = datetime.utcnow()
+    rows = [{**d, "updated_at": now} for d in deltas]
+    with get_engine().begin() as conn:
+        dialect = conn.dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert  # type: ignore[assignment]
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["subject", "model", "day"],
+                set_={
+                    "prompt_tokens": table.c.prompt_tokens + stmt.excluded.prompt_tokens,
+                    "completion_tokens": table.c.completion_tokens + stmt.excluded.completion_tokens,
+                    "requests": table.c.requests + stmt.excluded.requests,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+            )
+            conn.execute(stmt, rows)
+            return
+        for row in rows:
+            match = (
+                (table.c.subject == row["subject"]) & (table.c.model == row["model"]) & (table.c.day == row["day"])
+            )
+            updated = conn.execute(
+                table.update()
+                .where(match)
+                .values(
+                    prompt_tokens=table.c.prompt_tokens + row["prompt_tokens"],
+                    completion_tokens=table.c.completion_tokens + row["completion_tokens"],
+                    requests=table.c.requests + row["requests"],
+                    updated_at=now,
+                )
+            )
+            if not updated.rowcount:
+                conn.execute(table.insert().values(**row))
+
+
+class QuotaFlusher:
+    """Periodically writes quota counters to the database; flushes once more on stop."""
+
+    def __init__(self, manager: QuotaManager, interval_seconds: float) -> None:
+        self.manager = manager
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def flush(self) -> None:
+        deltas = self.manager.drain()
+        if deltas:
+            try:
+                await asyncio.to_thread(write_usage, deltas)
+            except Exception as exc:  # noqa: B902
+                self.manager.restore(deltas)
+                logger.warning("quota_flush_failed", error=str(exc))
+                return
+        if self.manager.workers > 1:
+            # Pick up what the other workers have flushed since the last read
+            day = _today()
+            try:
+                totals = await asyncio.to_thread(_stored_totals, day)
+            except Exception as exc:
+                logger.warning("quota_refresh_failed", error=str(exc))
+                return
+            self.manager.refresh_today(day, totals)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.flush()
+
+    async def start(self) -> None:
+        try:
+            await asyncio.to_thread(self.manager.load_today)
+        except Exception as exc:  # noqa: B902
+            logger.warning("quota_load_failed", error=str(exc))
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+
+_manager: Optional[QuotaManager] = None
+
+
+def configure_quotas() -> Optional[QuotaManager]:
+    """(Re)create the process-wide manager from settings; None when quotas are disabled."""
+    global _manager
+    _manager = QuotaManager.from_settings() if get_settings().quota_enable else None
+    return _manager
+
+
+def get_quota_manager() -> Optional[QuotaManager]:
+    return _manager
@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from ..apikeys import get_key_store
+from ..config import get_settings
+from ..db.querystats import QueryStats, get_query_stats
+from ..deps import parse_route_url, route_registry
+from ..loopmon import recent_blocks
+from ..profiler import ProfilerBusy, RequestProfiler, get_profiler, profile_process, render_folded
+from ..routing.discovery import get_route_discovery
+from ..tracing import MemoryExporter, get_tracer
+
+router = APIRouter(prefix="/admin")
+
+
+class KeyCreate(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    scopes: List[str] = Field(default_factory=lambda: ["chat", "embeddings"], description='e.g. chat, embeddings, admin or "*"')
+    priority: str = "default"
+    rate_limit_per_min: Optional[int] = Field(default=None, ge=1)
+    quota_tpm: Optional[int] = Field(default=None, ge=0)
+    quota_daily_tokens: Optional[int] = Field(default=None, ge=0)
+    expires_in_days: Optional[int] = Field(default=None, ge=1)
+
+
+@router.post("/keys", status_code=201)
+async def create_key(payload: KeyCreate) -> Dict[str, Any]:
+    """Issue a key; the plaintext ``key`` is only returned here."""
+    expires_at = datetime.utcnow() + timedelta(days=payload.expires_in_days) if payload.expires_in_days else None
+    plaintext, info = await run_in_threadpool(
+        get_key_store().create_key,
+        payload.name,
+        payload.scopes,
+        payload.priority,
+        payload.rate_limit_per_min,
+        payload.quota_tpm,
+        payload.quota_daily_tokens,
+        expires_at,
+    )
+    return {"key": plaintext, **info}
+
+
+@router.get("/keys")
+async def list_keys() -> List[Dict[str, Any]]:
+    return await run_in_threadpool(get_key_store().list_keys)
+
+
+@router.delete("/keys/{key_id}")
+async def revoke_key(key_id: str) -> Dict[str, Any]:
+    store = get_key_store()
+    info = await run_in_threadpool(store.revoke_key, key_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    store.invalidate(key_id)
+    return info
+
+
+def _trace_store() -> MemoryExporter:
+    tracer = get_tracer()
+    if tracer is None or not isinstance(tracer.exporter, MemoryExporter):
+        raise HTTPException(status_code=404, detail="Tracing with TRACE_EXPORTER=memory is not enabled")
+    return tracer.exporter
+
+
+@router.get("/traces")
+async def list_traces(
+    limit: int = Query(50, ge=1, le=500),
+    min_ms: float = Query(0.0, ge=0.0, description="Only traces at least this slow"),
+) -> List[Dict[str, Any]]:
+    """Most recent sampled traces, newest first."""
+    return _trace_store().recent(limit, min_ms)
+
+
+@router.get("/traces/{trace_id}")
+async def get_trace(trace_id: str) -> List[Dict[str, Any]]:
+    spans = _trace_store().get(trace_id)
+    if spans is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return spans
+
+
+@router.get("/loop/blocks")
+async def list_loop_blocks() -> List[Dict[str, Any]]:
+    """Recent times the event loop was blocked, with the blocking stack and request id."""
+    return recent_blocks()
+
+
+def _request_profiler() -> RequestProfiler:
+    profiler = get_profiler()
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (PROFILER_ENABLED=false)")
+    return profiler
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10.0, gt=0.0),
+    interval_ms: Optional[float] = Query(None, ge=1.0, le=1000.0),
+) -> PlainTextResponse:
+    """Sample all threads for ``seconds``; returns folded stacks (flamegraph.pl / speedscope)."""
+    _request_profiler()  # 404 unless PROFILER_ENABLED
+    s = get_settings()
+    if seconds > s.profile_max_seconds:
+        raise HTTPException(status_code=400, detail=f"seconds must be <= {s.profile_max_seconds:g}")
+    interval = (interval_ms or s.profile_interval_ms) / 1000
+    try:
+        counts = await run_in_threadpool(profile_process, seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return PlainTextResponse(render_folded(counts))
+
+
+class ProfileRequests(BaseModel):
+    count: int = Field(ge=1, le=1000)
+    path_prefix: Optional[str] = Field(default=None, description='e.g. "/api/chat"')
+    model: Optional[str] = Field(default=None, description="Only requests for this model")
+
+
+@router.post("/profile/requests")
+async def profile_next_requests(payload: ProfileRequests) -> Dict[str, Any]:
+    """Capture profiles for the next ``count`` matching requests (replaces an earlier selection)."""
+    return _request_profiler().arm(payload.count, payload.path_prefix, payload.model)
+
+
+@router.get("/profile/requests")
+async def list_request_profiles() -> Dict[str, Any]:
+    """Captured per-request profiles (newest first) and what is still armed."""
+    profiler = _request_profiler()
+    return {"armed": profiler.armed(), "slow_ms": profiler.slow_ms, "captures": profiler.recent()}
+
+
+@router.get("/profile/requests/{request_id}", response_class=PlainTextResponse)
+async def get_request_profile(request_id: str) -> PlainTextResponse:
+    capture = _request_profiler().get(request_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(render_folded(capture["stacks"]))
+
+
+def _query_stats() -> QueryStats:
+    stats = get_query_stats()
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Query stats are disabled (DB_QUERY_STATS=false)")
+    return stats
+
+
+@router.get("/queries")
+async def list_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order: str = Query("total_ms", pattern="^(total_ms|mean_ms|max_ms|count|slow)$"),
+) -> List[Dict[str, Any]]:
+    """Normalized SQL statements by total execution time (or ``order``), with the last slow plan."""
+    return _query_stats().top(limit, order)
+
+
+@router.delete("/queries")
+async def reset_queries() -> Dict[str, Any]:
+    _query_stats().reset()
+    return {"reset": True}
+
+
+class RouteUpdate(BaseModel):
+    url: str = Field(min_length=1, description="http(s)://host:port/v1 or unix:///path/to.sock?path=/v1")
+
+
+def _route(route_key: str) -> Dict[str, Any]:
+    for route in route_registry.describe_routes():
+        if route["route"] == route_key:
+            return route
+    raise HTTPException(status_code=404, detail="Route not found")
+
+
+@router.get("/routes")
+async def list_routes() -> List[Dict[str, Any]]:
+    """Every route with its state (active, draining, removing) and requests in flight."""
+    return route_registry.describe_routes()
+
+
+@router.put("/routes/{route_key}")
+async def put_route(route_key: str, payload: RouteUpdate) -> Dict[str, Any]:
+    """Add a route or change its URL; a drained route becomes active again."""
+    key = route_key.lower()
+    try:
+        scheme = parse_route_url(payload.url)[0].split("://")[0]
+    except Exception:  # noqa: B902
+        scheme = ""
+    if scheme not in {"http", "https"}:
+        raise HTTPException(status_code=400, detail="url must be http(s):// or unix://")
+    discovery = get_route_discovery()
+    if discovery.path:
+        discovery.update_file(key, {"url": payload.url, "drain": False})
+    else:
+        route_registry.add_route(key, payload.url)
+    return _route(key)
+
+
+@router.post("/routes/{route_key}/drain")
+async def drain_route(route_key: str) -> Dict[str, Any]:
+    """Stop sending new requests to the route; requests in flight finish."""
+    key = route_key.lower()
+    route = _route(key)
+    discovery = get_route_discovery()
+    if discovery.path:
+        discovery.update_file(key, {"url": route["url"], "drain": True})
+    else:
+        route_registry.drain_route(key)
+    return _route(key)
+
+
+@router.delete("/routes/{route_key}")
+async def remove_route(route_key: str) -> Dict[str, Any]:
+    """Drain the route, then close its pool once nothing is in flight."""
+    key = route_key.lower()
+    _route(key)
+    discovery = get_route_discovery()
+    if discovery.path:
+        discovery.update_file(key, None)
+    else:
+        route_registry.remove_route(key)
+    return _route(key)
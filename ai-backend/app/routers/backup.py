@@ -1,153 +1,185 @@
 from __future__ import annotations
 
 import json
-from typing import Any, Dict, List
-
-from fastapi import APIRouter, HTTPException
+import os
+import tempfile
+import threading
+import zlib
+from typing import Annotated, Any, Dict, Iterable, Iterator, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from datetime import datetime
 
-from ..db.base import get_session
-from ..db.models import Conversation, Message, MessageStream
+from ..db.backup import (
+    BulkImporter,
+    NdjsonDecoder,
+    available_codecs,
+    iter_compressed,
+    iter_export_records,
+    iter_legacy_records,
+    iter_ndjson,
+)
+from ..config import get_settings
+from ..db.base import get_engine, get_session
+from ..db.snapshot import compress_file, iter_file_chunks, snapshot_sqlite, sqlite_path
 
 
 router = APIRouter(prefix="/backup")
 
 
 @router.get("/export")
-def export_all() -> Dict[str, Any]:
+def export_all(
+    compress: str = Query("none", pattern="^(none|gzip|zstd)$"),
+    include_blobs: bool = Query(False, description="Include raw gz payloads as base64"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+    since: Annotated[Optional[datetime], Query(description="Only export changes at or after this watermark")] = None,
+) -> StreamingResponse:
+    """Stream the store as NDJSON, one record per line.
+
+    The first line is a header record carrying the ``watermark`` to pass as
+    ``since`` on the next incremental run; every other line is
+    ``{"type": "conversation"|"message"|"stream"|"delete", "data": {...}}``.
+    """
+    if compress not in available_codecs():
+        raise HTTPException(status_code=400, detail=f"Compression '{compress}' is not available")
+
     db = get_session()
-    try:
-        convs = db.query(Conversation).all()
-        msgs = db.query(Message).all()
-        streams = db.query(MessageStream).all()
-
-        def to_dict_conv(c: Conversation) -> Dict[str, Any]:
-            return {
-                "id": c.id,
-                "title": c.title,
-                "created_at": c.created_at.isoformat(),
-                "metadata_json": c.metadata_json,
-            }
-
-        def to_dict_msg(m: Message) -> Dict[str, Any]:
-            return {
-                "id": m.id,
-                "conversation_id": m.conversation_id,
-                "parent_id": m.parent_id,
-                "role": m.role,
-                "content_text": m.content_text,
-                "content_json": m.content_json,
-                "model": m.model,
-                "model_key": m.model_key,
-                "system_prompt": m.system_prompt,
-                "temperature": m.temperature,
-                "max_tokens": m.max_tokens,
-                "upstream_id": m.upstream_id,
-                # Raw blobs omitted in JSON export to keep size down
-                "prompt_tokens": m.prompt_tokens,
-                "completion_tokens": m.completion_tokens,
-                "total_tokens": m.total_tokens,
-                "status": m.status,
-                "error_text": m.error_text,
-                "started_at": m.started_at.isoformat(),
-                "completed_at": m.completed_at.isoformat() if m.completed_at else None,
-            }
-
-        def to_dict_stream(s: MessageStream) -> Dict[str, Any]:
-            return {
-                "id": s.id,
-                "message_id": s.message_id,
-                "created_at": s.created_at.isoformat(),
-                # raw_sse_gzip omitted
-            }
-
-        return {
-            "conversations": [to_dict_conv(c) for c in convs],
-            "messages": [to_dict_msg(m) for m in msgs],
-            "streams": [to_dict_stream(s) for s in streams],
-        }
-    finally:
-        db.close()
+
+    def generate() -> Iterator[bytes]:
+        try:
+            records = iter_export_records(db, include_blobs=include_blobs, batch_size=batch_size, since=since)
+            yield from iter_compressed(iter_ndjson(records), compress)
+        finally:
+            db.close()
+
+    suffix = {"none": "", "gzip": ".gz", "zstd": ".zst"}[compress]
+    media_type = {"none": "application/x-ndjson", "gzip": "application/gzip", "zstd": "application/zstd"}[compress]
+    kind = "incremental" if since else "backup"
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.ndjson{suffix}"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+_CONTENT_ENCODINGS = {"gzip": "gzip", "x-gzip": "gzip", "zstd": "zstd"}
+
+# Large imports suspend the shared FTS triggers, so only one may run at a time
+_import_lock = threading.Lock()
 
 
 @router.post("/import")
-def import_all(payload: Dict[str, Any]) -> Dict[str, Any]:
-    db = get_session()
-    imported = {"conversations": 0, "messages": 0, "streams": 0}
+async def import_all(
+    request: Request,
+    compress: Optional[str] = Query(None, pattern="^(none|gzip|zstd)$"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+    mode: str = Query("insert", pattern="^(insert|apply)$"),
+) -> Dict[str, Any]:
+    """Import an NDJSON export streamed in the request body.
+
+    The body is decoded incrementally and written in chunked transactions.
+    ``mode=insert`` skips ids that already exist; ``mode=apply`` overwrites
+    them and replays deletes, for restoring incremental exports on top of a
+    full one. A legacy single-document JSON export
+    (``Content-Type: application/json``) is still accepted. Batches already
+    committed stay when a later one fails; the 400 reports that progress.
+    """
+    encoding = request.headers.get("content-encoding", "").lower()
+    codec = compress or _CONTENT_ENCODINGS.get(encoding, "none")
+    if codec not in available_codecs():
+        raise HTTPException(status_code=400, detail=f"Compression '{codec}' is not available")
+    legacy = request.headers.get("content-type", "").startswith("application/json") and codec == "none"
+
+    if not _import_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Another import is already running")
+    importer = BulkImporter(get_engine(), batch_size=batch_size, apply=mode == "apply")
     try:
-        # Conversations
-        for c in payload.get("conversations", []):
-            if not c.get("id"):
-                continue
-            exist = db.get(Conversation, c["id"])  # type: ignore[arg-type]
-            if exist:
-                continue
-            conv = Conversation(
-                id=c["id"],
-                title=c.get("title"),
-                created_at=datetime.fromisoformat(c["created_at"]) if c.get("created_at") else datetime.utcnow(),
-                metadata_json=c.get("metadata_json"),
-            )
-            db.add(conv)
-            imported["conversations"] += 1
-
-        db.flush()
-
-        # Messages
-        for m in payload.get("messages", []):
-            if not m.get("id") or not m.get("conversation_id"):
-                continue
-            exist = db.get(Message, m["id"])  # type: ignore[arg-type]
-            if exist:
-                continue
-            msg = Message(
-                id=m["id"],
-                conversation_id=m["conversation_id"],
-                parent_id=m.get("parent_id"),
-                role=m.get("role", "user"),
-                content_text=m.get("content_text"),
-                content_json=m.get("content_json"),
-                model=m.get("model"),
-                model_key=m.get("model_key"),
-                system_prompt=m.get("system_prompt"),
-                temperature=m.get("temperature"),
-                max_tokens=m.get("max_tokens"),
-                upstream_id=m.get("upstream_id"),
-                prompt_tokens=m.get("prompt_tokens"),
-                completion_tokens=m.get("completion_tokens"),
-                total_tokens=m.get("total_tokens"),
-                status=m.get("status", "completed"),
-                error_text=m.get("error_text"),
-                started_at=datetime.fromisoformat(m["started_at"]) if m.get("started_at") else datetime.utcnow(),
-                completed_at=(datetime.fromisoformat(m["completed_at"]) if m.get("completed_at") else None),
-            )
-            db.add(msg)
-            imported["messages"] += 1
-
-        db.flush()
-
-        # Streams (raw gz not included in export)
-        for s in payload.get("streams", []):
-            if not s.get("id") or not s.get("message_id"):
-                continue
-            exist = db.query(MessageStream).filter(MessageStream.id == s["id"]).first()
-            if exist:
-                continue
-            stream = MessageStream(
-                id=s["id"],
-                message_id=s["message_id"],
-                created_at=datetime.fromisoformat(s["created_at"]) if s.get("created_at") else datetime.utcnow(),
-                raw_sse_gzip=b"",  # placeholder since export omits raw
-            )
-            db.add(stream)
-            imported["streams"] += 1
-
-        db.commit()
-        return {"imported": imported}
+        try:
+            if legacy:
+                try:
+                    payload = json.loads(await request.body())
+                except ValueError as exc:
+                    raise HTTPException(status_code=400, detail="Invalid JSON body") from exc
+                records: Iterable[Dict[str, Any]] = iter_legacy_records(payload)
+                for record in records:
+                    if importer.add(record):
+                        await run_in_threadpool(importer.flush)
+            else:
+                decoder = NdjsonDecoder(codec)
+                async for chunk in request.stream():
+                    for record in decoder.feed(chunk):
+                        if importer.add(record):
+                            await run_in_threadpool(importer.flush)
+                for record in decoder.close():
+                    importer.add(record)
+            await run_in_threadpool(importer.flush)
+        except (ValueError, zlib.error) as exc:
+            # Bad input, or a batch whose rows reference missing parents
+            raise HTTPException(
+                status_code=400,
+                detail={"message": str(exc), "progress": importer.summary()},
+            ) from exc
+        finally:
+            await run_in_threadpool(importer.restore_fts)
+    finally:
+        _import_lock.release()
+    return importer.summary()
+
+
+@router.post("/snapshot")
+async def snapshot(
+    target: Optional[str] = Query(None, description="File name to write under BACKUP_DIR; streams the snapshot when omitted"),
+    compress: str = Query("none", pattern="^(none|gzip|zstd)$"),
+    pages: Optional[int] = Query(None, ge=1, description="Pages copied per backup step"),
+):
+    """Take a consistent copy of the live SQLite database, raw blobs included.
+
+    Uses SQLite's online backup API in page-sized steps on a worker thread so
+    chat writes keep flowing while the copy is taken.
+    """
+    if compress not in available_codecs():
+        raise HTTPException(status_code=400, detail=f"Compression '{compress}' is not available")
+    if not sqlite_path():
+        raise HTTPException(status_code=400, detail="Snapshots are only supported for SQLite databases")
+    backup_dir = get_settings().backup_dir
+    os.makedirs(backup_dir, exist_ok=True)
+
+    if target:
+        # Only a bare file name is accepted; snapshots always land in BACKUP_DIR
+        name = os.path.basename(target)
+        if not name or name in {".", ".."}:
+            raise HTTPException(status_code=400, detail="Invalid target name")
+        result = await run_in_threadpool(snapshot_sqlite, os.path.join(backup_dir, name), None, pages)
+        result["path"] = await run_in_threadpool(compress_file, result["path"], compress)
+        result["bytes"] = os.path.getsize(result["path"])
+        return result
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", suffix=".db", dir=backup_dir)
+    os.close(fd)
+    try:
+        result = await run_in_threadpool(snapshot_sqlite, tmp_path, None, pages)
     except Exception:
-        db.rollback()
+        os.remove(tmp_path)
         raise
-    finally:
-        db.close()
-
 
+    def generate() -> Iterator[bytes]:
+        try:
+            yield from iter_compressed(iter_file_chunks(tmp_path), compress)
+        finally:
+            os.remove(tmp_path)
+
+    suffix = {"none": "", "gzip": ".gz", "zstd": ".zst"}[compress]
+    filename = f"snapshot-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.db{suffix}"
+    return StreamingResponse(
+        generate(),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Snapshot-Duration-Ms": str(result["duration_ms"]),
+            "X-Snapshot-Pages": str(result["pages"]),
+            "X-Snapshot-Bytes": str(result["bytes"]),
+        },
+    )
@@ -4,19 +4,28 @@ import asyncio
 import contextlib
 import json
 import time
-from typing import Any, AsyncIterator, Dict, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
 from datetime import datetime
 
+import anyio
 import httpx
 from fastapi import APIRouter, HTTPException, Request, Response, status
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from starlette.types import Receive, Scope, Send
 
 from ..clients import vllm_client
 import gzip
 from ..config import get_settings
+from ..lifecycle import get_lifecycle
+from ..logsink import annotate
+from ..tracing import span, start_span
+from ..metrics import StreamMetrics, is_content_chunk
+from ..quota import estimate_chat_tokens, get_quota_manager, quota_subject, request_identity
+from ..routing.failover import open_stream
+from ..routing.fallback import fallback_decision, observe_ttft
 from ..routing.router import resolve_chat_route_and_model
-from ..utils.sse import format_sse_data, heartbeat_sender
+from ..utils.sse import HEARTBEAT_COMMENT, StreamAssembler, format_sse_data
 
 
 class ChatRequest(BaseModel):
@@ -33,8 +42,37 @@ class ChatRequest(BaseModel):
 router = APIRouter(prefix="/chat")
 
 
+class _ClosingStreamingResponse(StreamingResponse):
+    """Calls ``on_close`` once the response is sent or abandoned, even if its body was never read."""
+
+    def __init__(self, content: AsyncIterator[bytes], on_close: Callable[[], Awaitable[None]], **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Still runs when the client is gone and the request's tasks are being cancelled
+            with anyio.CancelScope(shield=True):
+                await self.on_close()
+
+
 async def _resolve_route_and_model(payload: ChatRequest) -> tuple[str, str]:
-    return await resolve_chat_route_and_model(payload.model, payload.modelKey)
+    route_key, model = await resolve_chat_route_and_model(payload.model, payload.modelKey)
+    annotate(route_key=route_key, model=model)
+    decision = fallback_decision()
+    if decision:
+        annotate(requested_model=decision[0], fallback_reason=decision[1])
+    return route_key, model
+
+
+def _fallback_headers(model: str) -> Dict[str, str]:
+    """Tell the client its request was served by a MODEL_FALLBACKS model."""
+    decision = fallback_decision()
+    if not decision:
+        return {}
+    return {"X-Model-Fallback": model, "X-Requested-Model": decision[0], "X-Model-Fallback-Reason": decision[1]}
 
 
 def _build_openai_chat_body(payload: ChatRequest, model: str, stream: bool = False) -> Dict[str, Any]:
@@ -51,77 +89,99 @@ def _build_openai_chat_body(payload: ChatRequest, model: str, stream: bool = Fal
         body["temperature"] = payload.temperature
     if payload.max_tokens is not None:
         body["max_tokens"] = payload.max_tokens
+    if stream:
+        # Ask for a final usage chunk so streamed tokens can be charged exactly
+        body["stream_options"] = {"include_usage": True}
     return body
 
 
 @router.post("")
-async def chat(payload: ChatRequest):
+async def chat(request: Request, payload: ChatRequest, response: Response):
     route_key, model = await _resolve_route_and_model(payload)
+    response.headers.update(_fallback_headers(model))
     body = _build_openai_chat_body(payload, model, stream=False)
-    # Persist user/assistant messages
+    quota = get_quota_manager()
+    subject = quota_subject(request)
+    if quota:
+        await quota.ensure_loaded(subject, model)
+    # Rejects with 429 before anything is stored or sent upstream
+    reservation = (
+        quota.reserve(
+            subject,
+            model,
+            estimate_chat_tokens(body["messages"], payload.max_tokens),
+            request_identity(request),
+        )
+        if quota
+        else None
+    )
+    try:
+        resp = await vllm_client.create_chat_completion(route_key, body)
+    except Exception:
+        if quota:
+            quota.release(reservation)
+        raise
+
+    usage = resp.get("usage") or {}
+    annotate(prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+    if quota:
+        quota.settle(reservation, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
+    content = None
+    choices = resp.get("choices") or []
+    if choices:
+        msg = choices[0].get("message") or {}
+        content = msg.get("content")
+
+    # Persist user/assistant messages in one short transaction after the
+    # upstream call, so no SQLite write lock is held while waiting on vLLM
     from ..db.base import get_session
     from ..db.models import Conversation, Message
     db = get_session()
     try:
-        conv_id = payload.conversation_id
-        if not conv_id:
-            conv = Conversation(metadata_json=payload.metadata or None)
-            db.add(conv)
-            db.flush()
-            conv_id = conv.id
-
-        user_msg = Message(
-            conversation_id=conv_id,
-            role="user",
-            content_text=payload.message,
-            system_prompt=payload.system,
-            temperature=payload.temperature,
-            max_tokens=payload.max_tokens,
-            model=model,
-            model_key=route_key,
-            status="completed",
-        )
-        # Store raw request gzip
-        try:
-            user_msg.raw_request_gzip = gzip.compress(json.dumps(body).encode("utf-8"))
-        except Exception:
-            pass
-        db.add(user_msg)
-        db.flush()
-
-        # Store raw request gzip
-        try:
-            user_msg.raw_request_gzip = gzip.compress(json.dumps(body).encode("utf-8"))
-        except Exception:
-            pass
-
-        resp = await vllm_client.create_chat_completion(route_key, body)
-
-        usage = resp.get("usage") or {}
-        content = None
-        choices = resp.get("choices") or []
-        if choices:
-            msg = choices[0].get("message") or {}
-            content = msg.get("content")
-
-        asst = Message(
-            conversation_id=conv_id,
-            role="assistant",
-            content_text=content,
-            model=model,
-            model_key=route_key,
-            status="completed",
-            upstream_id=resp.get("id"),
-            prompt_tokens=usage.get("prompt_tokens"),
-            completion_tokens=usage.get("completion_tokens"),
-            total_tokens=usage.get("total_tokens"),
-        )
-        db.add(asst)
-        try:
-            asst.raw_response_gzip = gzip.compress(json.dumps(resp).encode("utf-8"))
-        except Exception:
-            pass
-        db.commit()
+        with span("db.persist"):
+            conv_id = payload.conversation_id
+            if not conv_id:
+                conv = Conversation(metadata_json=payload.metadata or None)
+                db.add(conv)
+                db.flush()
+                conv_id = conv.id
+
+            user_msg = Message(
+                conversation_id=conv_id,
+                role="user",
+                content_text=payload.message,
+                system_prompt=payload.system,
+                temperature=payload.temperature,
+                max_tokens=payload.max_tokens,
+                model=model,
+                model_key=route_key,
+                status="completed",
+            )
+            # Store raw request gzip
+            try:
+                user_msg.raw_request_gzip = gzip.compress(json.dumps(body).encode("utf-8"))
+            except Exception:
+                pass
+            db.add(user_msg)
+
+            asst = Message(
+                conversation_id=conv_id,
+                role="assistant",
+                content_text=content,
+                model=model,
+                model_key=route_key,
+                status="completed",
+                upstream_id=resp.get("id"),
+                prompt_tokens=usage.get("prompt_tokens"),
+                completion_tokens=usage.get("completion_tokens"),
+                total_tokens=usage.get("total_tokens"),
+            )
+            db.add(asst)
+            try:
+                asst.raw_response_gzip = gzip.compress(json.dumps(resp).encode("utf-8"))
+            except Exception:
+                pass
+            db.commit()
     except Exception:
         db.rollback()
         raise
@@ -136,8 +196,11 @@ async def _stream_upstream_and_heartbeat(
     upstream_resp: httpx.Response,
     heartbeat_interval: float,
     total_timeout: float,
+    metrics: Optional[StreamMetrics] = None,
+    lines: Optional[AsyncIterator[bytes]] = None,
 ) -> AsyncIterator[bytes]:
     start_time = time.monotonic()
+    outcome = "ok"
 
     async def client_disconnected() -> bool:
         try:
@@ -150,36 +213,56 @@ async def _stream_upstream_and_heartbeat(
             if line:
                 yield (line + "\n").encode("utf-8")
 
-    heartbeat_it = heartbeat_sender(heartbeat_interval)
-    upstream_it = upstream_lines()
+    upstream_it = lines if lines is not None else upstream_lines()
+    # One read stays pending across polls: cancelling it would close the line iterator
+    pending: Optional[asyncio.Future] = None
+    next_heartbeat = start_time + heartbeat_interval
+    lifecycle = get_lifecycle()
 
     try:
         while True:
             if (time.monotonic() - start_time) > total_timeout:
+                outcome = "timeout"
                 yield format_sse_data(json.dumps({"error": {"message": "Upstream timeout"}}), event="error")
                 break
+            if lifecycle.drain_expired:
+                # Shutting down: end the stream so what was relayed is still persisted
+                outcome = "shutdown"
+                yield format_sse_data(json.dumps({"error": {"message": "Server shutting down"}}), event="error")
+                break
             if await client_disconnected():
                 # Close upstream response and exit
+                outcome = "client_disconnect"
                 await upstream_resp.aclose()
                 break
-            try:
-                upstream_chunk = await asyncio.wait_for(upstream_it.__anext__(), timeout=0.1)
+            if pending is None:
+                pending = asyncio.ensure_future(upstream_it.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=0.1)
+            if done:
+                read, pending = pending, None
+                try:
+                    upstream_chunk = read.result()
+                except StopAsyncIteration:
+                    break
+                if metrics is not None and is_content_chunk(upstream_chunk):
+                    metrics.on_token()
                 yield upstream_chunk
+                next_heartbeat = time.monotonic() + heartbeat_interval
                 continue
-            except StopAsyncIteration:
-                break
-            except asyncio.TimeoutError:
-                pass
-            # Heartbeat
-            try:
-                hb = await asyncio.wait_for(heartbeat_it.__anext__(), timeout=0)
-                if hb:
-                    yield hb
-            except StopAsyncIteration:
-                pass
-            except asyncio.TimeoutError:
-                pass
+            # Heartbeat while the upstream is quiet
+            if time.monotonic() >= next_heartbeat:
+                next_heartbeat = time.monotonic() + heartbeat_interval
+                yield HEARTBEAT_COMMENT.encode("utf-8")
+    except BaseException:
+        outcome = "error"
+        raise
     finally:
+        if pending is not None:
+            pending.cancel()
+            with contextlib.suppress(BaseException):
+                await pending
+        if metrics is not None:
+            metrics.close(outcome)
         with contextlib.suppress(Exception):
             await upstream_resp.aclose()
 
@@ -189,13 +272,31 @@ async def chat_stream(request: Request, payload: ChatRequest):
     settings = get_settings()
     route_key, model = await _resolve_route_and_model(payload)
     body = _build_openai_chat_body(payload, model, stream=True)
-
+    quota = get_quota_manager()
+    prompt_estimate = estimate_chat_tokens(body["messages"])
+    subject = quota_subject(request)
+    if quota:
+        await quota.ensure_loaded(subject, model)
+    reservation = (
+        quota.reserve(subject, model, prompt_estimate + (payload.max_tokens or 0), request_identity(request))
+        if quota
+        else None
+    )
+
+    upstream_started = time.perf_counter()
     try:
-        upstream_resp = await vllm_client.stream_chat_completion(route_key, body)
+        # Another replica is tried if this one fails or stalls before the first token
+        upstream = await open_stream(route_key, model, body, pinned=payload.modelKey is not None)
     except HTTPException as e:
+        if quota:
+            quota.release(reservation)
         # Convert error to SSE error response
         data = json.dumps({"error": {"message": e.detail}})
         return StreamingResponse(iter([format_sse_data(data, event="error")]), media_type="text/event-stream")
+    # The replica that answered
+    route_key = upstream.route_key
+    if upstream.failovers:
+        annotate(failovers=len(upstream.failovers), route_key=route_key)
 
     # Set up persistence for streaming
     from ..db.base import get_session
@@ -203,94 +304,144 @@ async def chat_stream(request: Request, payload: ChatRequest):
     db = get_session()
     conv_id = payload.conversation_id
     try:
-        if not conv_id:
-            conv = Conversation(metadata_json=payload.metadata or None)
-            db.add(conv)
+        with span("db.persist_request"):
+            if not conv_id:
+                conv = Conversation(metadata_json=payload.metadata or None)
+                db.add(conv)
+                db.flush()
+                conv_id = conv.id
+
+            user_msg = Message(
+                conversation_id=conv_id,
+                role="user",
+                content_text=payload.message,
+                system_prompt=payload.system,
+                temperature=payload.temperature,
+                max_tokens=payload.max_tokens,
+                model=model,
+                model_key=route_key,
+                status="completed",
+            )
+            # Store raw request gzip
+            try:
+                user_msg.raw_request_gzip = gzip.compress(json.dumps(body).encode("utf-8"))
+            except Exception:
+                pass
+            db.add(user_msg)
             db.flush()
-            conv_id = conv.id
-
-        user_msg = Message(
-            conversation_id=conv_id,
-            role="user",
-            content_text=payload.message,
-            system_prompt=payload.system,
-            temperature=payload.temperature,
-            max_tokens=payload.max_tokens,
-            model=model,
-            model_key=route_key,
-            status="completed",
-        )
-        # Store raw request gzip
-        try:
-            user_msg.raw_request_gzip = gzip.compress(json.dumps(body).encode("utf-8"))
-        except Exception:
-            pass
-        db.add(user_msg)
-        db.flush()
-
-        asst_msg = Message(
-            conversation_id=conv_id,
-            role="assistant",
-            content_text="",
-            model=model,
-            model_key=route_key,
-            status="in_progress",
-        )
-        db.add(asst_msg)
-        db.flush()
-        db.commit()
+
+            asst_msg = Message(
+                conversation_id=conv_id,
+                role="assistant",
+                content_text="",
+                model=model,
+                model_key=route_key,
+                status="in_progress",
+                failovers=upstream.failovers or None,
+            )
+            db.add(asst_msg)
+            db.flush()
+            # Keep the id: the session is closed before the stream starts
+            asst_id = asst_msg.id
+            db.commit()
+            db.close()
     except Exception:
         db.rollback()
         db.close()
+        if quota:
+            quota.release(reservation)
+        await upstream.response.aclose()
         raise
 
     async def generator() -> AsyncIterator[bytes]:
-        raw_sse_lines: list[str] = []
-        assembled: list[str] = []
-
-        async for chunk in _stream_upstream_and_heartbeat(
-            request,
-            upstream_resp,
-            heartbeat_interval=15.0,
-            total_timeout=settings.total_timeout_seconds,
-        ):
-            try:
-                s = chunk.decode("utf-8", errors="ignore")
-            except Exception:
-                s = ""
-            if s.startswith("data:"):
-                raw_sse_lines.append(s)
-                try:
-                    payload_json = json.loads(s[len("data:"):].strip())
-                    ch = (payload_json.get("choices") or [{}])[0]
-                    delta = ch.get("delta") or {}
-                    if "content" in delta and delta["content"]:
-                        assembled.append(delta["content"])
-                except Exception:
-                    pass
-            yield chunk
-
-        # Persist raw SSE and finalize assistant message
-        final_text = "".join(assembled)
-        raw_joined = "".join(raw_sse_lines)
-        db2 = get_session()
+        lifecycle = get_lifecycle()
+        # Counted until the message is finalized; shutdown waits for it (SHUTDOWN_DRAIN_SECONDS)
+        lifecycle.stream_opened()
         try:
-            # Compress raw SSE for storage efficiency
+            assembler = StreamAssembler()
+            stream_metrics = StreamMetrics(route_key, model, started=upstream_started)
+            relay_span = start_span("stream.relay", route=route_key, model=model)
+
             try:
-                raw_gz = gzip.compress(raw_joined.encode("utf-8"))
-            except Exception:
-                raw_gz = None
-            if raw_gz is not None:
-                db2.add(MessageStream(message_id=asst_msg.id, raw_sse_gzip=raw_gz))
-            m = db2.query(Message).get(asst_msg.id)  # type: ignore
-            if m:
-                m.content_text = final_text
-                m.status = "completed"
-                m.completed_at = datetime.utcnow()
-            db2.commit()
-        except Exception:
-            db2.rollback()
+                async for chunk in _stream_upstream_and_heartbeat(
+                    request,
+                    upstream.response,
+                    heartbeat_interval=15.0,
+                    total_timeout=settings.total_timeout_seconds,
+                    metrics=stream_metrics,
+                    lines=upstream.lines,
+                ):
+                    assembler.feed(chunk)
+                    yield chunk
+            finally:
+                usage = assembler.usage
+                ttft = stream_metrics.ttft_seconds
+                if ttft is not None:
+                    observe_ttft(route_key, ttft)
+                annotate(
+                    ttft_ms=int(ttft * 1000) if ttft is not None else None,
+                    stream_chunks=stream_metrics.tokens,
+                    prompt_tokens=usage.get("prompt_tokens"),
+                    completion_tokens=usage.get("completion_tokens"),
+                )
+                if quota:
+                    if usage:
+                        quota.settle(reservation, usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0)
+                    else:
+                        # Cancelled or no usage chunk: charge the prompt estimate plus relayed chunks
+                        quota.settle(reservation, prompt_estimate, stream_metrics.tokens)
+                if relay_span is not None:
+                    relay_span.set(
+                        ttft_ms=int(ttft * 1000) if ttft is not None else None,
+                        chunks=stream_metrics.tokens,
+                        completion_tokens=usage.get("completion_tokens"),
+                    )
+                    relay_span.finish()
+
+            # Persist raw SSE and finalize assistant message
+            with span("stream.finalize", message_id=asst_id) as finalize_span:
+                final_text = assembler.text
+                raw_joined = assembler.raw
+                db2 = get_session()
+                try:
+                    # Compress raw SSE for storage efficiency
+                    try:
+                        raw_gz = gzip.compress(raw_joined.encode("utf-8"))
+                    except Exception:
+                        raw_gz = None
+                    if raw_gz is not None:
+                        db2.add(MessageStream(message_id=asst_id, raw_sse_gzip=raw_gz))
+                    m = db2.query(Message).get(asst_id)  # type: ignore
+                    if m:
+                        m.content_text = final_text
+                        m.status = "completed"
+                        m.completed_at = datetime.utcnow()
+                        if usage:
+                            m.prompt_tokens = usage.get("prompt_tokens")
+                            m.completion_tokens = usage.get("completion_tokens")
+                            m.total_tokens = usage.get("total_tokens")
+                    db2.commit()
+                except Exception as exc:
+                    db2.rollback()
+                    finalize_span.set(db_error=str(exc)[:200])
+                finally:
+                    db2.close()
         finally:
-            db2.close()
-
-    return StreamingResponse(generator(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+            lifecycle.stream_closed()
+
+    body_iterator = generator()
+
+    async def close() -> None:
+        # Runs the generator's cleanup if it started; otherwise nothing was relayed,
+        # so the reservation is released and the upstream closed here
+        await body_iterator.aclose()
+        if quota:
+            quota.release(reservation)
+        await upstream.response.aclose()
+
+    return _ClosingStreamingResponse(
+        body_iterator,
+        on_close=close,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", **_fallback_headers(model)},
+    )
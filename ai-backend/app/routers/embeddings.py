@@ -2,11 +2,13 @@ from __future__ import annotations
 
 from typing import Any, Dict, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, status
 from pydantic import BaseModel, Field
 
 from ..clients import vllm_client
 from ..config import get_settings
+from ..logsink import annotate
+from ..quota import estimate_input_tokens, get_quota_manager, quota_subject, request_identity
 from ..routing.router import resolve_embeddings_route_and_model
 
 
@@ -20,11 +22,27 @@ router = APIRouter(prefix="/embeddings")
 
 
 async def _resolve_route_and_model(payload: EmbeddingsRequest) -> Tuple[str, str]:
-    return await resolve_embeddings_route_and_model(payload.model, payload.modelKey)
+    route_key, model = await resolve_embeddings_route_and_model(payload.model, payload.modelKey)
+    annotate(route_key=route_key, model=model)
+    return route_key, model
 
 
 @router.post("")
-async def create_embeddings(payload: EmbeddingsRequest):
+async def create_embeddings(request: Request, payload: EmbeddingsRequest):
     route_key, model = await _resolve_route_and_model(payload)
     body: Dict[str, Any] = {"input": payload.input, "model": model}
-    return await vllm_client.create_embedding(route_key, body)
+    quota = get_quota_manager()
+    if quota is None:
+        return await vllm_client.create_embedding(route_key, body)
+
+    subject = quota_subject(request)
+    await quota.ensure_loaded(subject, model)
+    reservation = quota.reserve(subject, model, estimate_input_tokens(payload.input), request_identity(request))
+    try:
+        resp = await vllm_client.create_embedding(route_key, body)
+    except Exception:
+        quota.release(reservation)
+        raise
+    usage = resp.get("usage") or {}
+    quota.settle(reservation, usage.get("prompt_tokens") or reservation.estimate, 0)
+    return resp
@@ -1,26 +1,41 @@
 from __future__ import annotations
 
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 
 from ..config import get_settings
 from ..deps import route_registry
+from ..healthcheck import get_health_checker
+from ..lifecycle import get_lifecycle
 
 router = APIRouter()
 
 
 @router.get("/health")
 async def health() -> dict:
+    """Cached state of every route; ``vllm`` is the default (or first) route's."""
     settings = get_settings()
-    vllm_status = "unknown"
-    # Try default route if configured
-    try:
-        default_key = settings.default_model_key or (route_registry.list_route_keys()[0] if route_registry.list_route_keys() else "")
-        if default_key:
-            client = route_registry.get_client(default_key)
-            resp = await client.get("/models")
-            vllm_status = "ok" if resp.is_success else "unavailable"
-        else:
-            vllm_status = "unconfigured"
-    except Exception:
-        vllm_status = "unavailable"
-    return {"ok": True, "vllm": vllm_status}
+    checker = get_health_checker()
+    keys = route_registry.list_route_keys()
+    default_key = settings.default_model_key or (keys[0] if keys else "")
+    vllm_status = checker.status(default_key) if default_key else "unconfigured"
+    return {"ok": True, "vllm": vllm_status, "routes": checker.snapshot()}
+
+
+@router.get("/livez")
+async def livez() -> dict:
+    """The process is serving requests; no I/O."""
+    return {"ok": True}
+
+
+@router.get("/readyz")
+async def readyz() -> JSONResponse:
+    """200 once the model catalog has loaded, 503 before that and while draining."""
+    lifecycle = get_lifecycle()
+    body = {
+        "ready": lifecycle.ready,
+        "draining": lifecycle.draining,
+        "active_streams": lifecycle.active_streams,
+        "routes": get_health_checker().snapshot(),
+    }
+    return JSONResponse(body, status_code=200 if lifecycle.ready else 503)
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+
+from ..db.retention import plan_retention, run_retention
+
+router = APIRouter(prefix="/retention")
+
+
+@router.get("/report")
+async def retention_report(
+    raw_days: Optional[int] = Query(None, ge=0, description="Override RETENTION_RAW_DAYS"),
+    archive_days: Optional[int] = Query(None, ge=0, description="Override RETENTION_ARCHIVE_DAYS"),
+) -> Dict[str, Any]:
+    """Dry run: rows each policy would touch and projected space savings."""
+    return await run_in_threadpool(plan_retention, None, raw_days, archive_days)
+
+
+@router.post("/run")
+async def retention_run(
+    dry_run: bool = Query(False),
+    raw_days: Optional[int] = Query(None, ge=0, description="Override RETENTION_RAW_DAYS"),
+    archive_days: Optional[int] = Query(None, ge=0, description="Override RETENTION_ARCHIVE_DAYS"),
+) -> Dict[str, Any]:
+    try:
+        return await run_in_threadpool(run_retention, dry_run, raw_days, archive_days)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Optional, Set, Tuple
+
+import structlog
+
+from ..config import get_settings
+from ..deps import DRAINING, route_registry
+
+logger = structlog.get_logger()
+
+
+def parse_routes(data: Any) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Normalize routes file content.
+
+    ``{"key": "url"}``, ``{"key": {"url": ..., "drain": true}}``, or
+    ``{"key": null}`` to remove a route (e.g. one from ``MODEL_ROUTE_*``).
+    """
+    if not isinstance(data, dict):
+        raise ValueError("routes file must be a JSON object of route key -> URL")
+    routes: Dict[str, Optional[Dict[str, Any]]] = {}
+    for key, entry in data.items():
+        if entry is None:
+            routes[key.lower()] = None
+            continue
+        if isinstance(entry, str):
+            entry = {"url": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("url"), str) or not entry["url"]:
+            raise ValueError(f"route {key!r} needs a URL")
+        routes[key.lower()] = {"url": entry["url"], "drain": bool(entry.get("drain", False))}
+    return routes
+
+
+class RouteDiscovery:
+    """Applies runtime route changes to the registry and closes drained pools.
+
+    With ``ROUTES_FILE`` set, the file is polled every ``poll_seconds`` and
+    is the source of truth for the routes it lists: new keys are added,
+    changed URLs swap pools, ``"drain": true`` drains, and keys set to null
+    or deleted from the file are removed. Admin API changes are written to
+    the file, so every worker process picks them up. Without a file, admin
+    changes apply to the worker that served the request only.
+    """
+
+    def __init__(self, path: str, poll_seconds: float) -> None:
+        self.path = path
+        self.poll_seconds = poll_seconds
+        # (mtime_ns, size) of the file last applied
+        self._signature: Optional[Tuple[int, int]] = None
+        self._file_keys: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def read_file(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        try:
+            with open(self.path, "rb") as f:
+                return parse_routes(json.loads(f.read() or b"{}"))
+        except FileNotFoundError:
+            return {}
+
+    def apply(self, routes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        for key, entry in routes.items():
+            if entry is None:
+                if route_registry.route_state(key) is not None:
+                    route_registry.remove_route(key)
+            elif entry["drain"]:
+                if route_registry.route_state(key) is None:
+                    route_registry.add_route(key, entry["url"])
+                if route_registry.route_state(key) != DRAINING:
+                    route_registry.drain_route(key)
+            else:
+                route_registry.add_route(key, entry["url"])
+        for key in self._file_keys - routes.keys():
+            if route_registry.route_state(key) is not None:
+                route_registry.remove_route(key)
+        self._file_keys = {key for key, entry in routes.items() if entry is not None}
+
+    def sync_file(self) -> None:
+        """Apply the routes file if it changed since the last call."""
+        if not self.path:
+            return
+        try:
+            st = os.stat(self.path)
+            signature: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return
+        try:
+            routes = self.read_file()
+        except ValueError as exc:
+            logger.warning("routes_file_invalid", path=self.path, error=str(exc))
+            return
+        self._signature = signature
+        self.apply(routes)
+
+    def update_file(self, key: str, entry: Optional[Dict[str, Any]]) -> None:
+        """Set one route in the routes file (None removes it) and apply it."""
+        routes = self.read_file()
+        routes[key] = entry
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(routes, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+        self._signature = None
+        self.sync_file()
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                self.sync_file()
+                await route_registry.reap()
+            except Exception as exc:  # noqa: B902
+                logger.warning("route_sync_failed", error=str(exc))
+
+    def start(self) -> None:
+        self.sync_file()
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+_discovery: Optional[RouteDiscovery] = None
+
+
+def configure_route_discovery() -> RouteDiscovery:
+    global _discovery
+    s = get_settings()
+    _discovery = RouteDiscovery(s.routes_file, s.routes_poll_seconds)
+    return _discovery
+
+
+def get_route_discovery() -> RouteDiscovery:
+    global _discovery
+    if _discovery is None:
+        _discovery = configure_route_discovery()
+    return _discovery
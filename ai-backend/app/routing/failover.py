@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import structlog
+from fastapi import HTTPException
+
+from ..clients import vllm_client
+from ..config import get_settings
+from ..deps import route_registry
+from ..healthcheck import get_health_checker
+from ..metrics import STREAM_FAILOVERS, STREAM_RETRY_BUDGET_EXHAUSTED, is_content_chunk, route_label
+
+logger = structlog.get_logger()
+
+
+class RetryBudget:
+    """Allows retries up to ``ratio`` of the requests seen in the last ``window_seconds``.
+
+    ``min_retries`` per window are always allowed, so a quiet gateway can
+    still fail over. When every replica is failing, the budget runs out
+    instead of multiplying the load on them.
+    """
+
+    def __init__(self, ratio: float, min_retries: int, window_seconds: float = 10.0) -> None:
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window_seconds
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self) -> None:
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def available(self) -> bool:
+        self._trim(time.monotonic())
+        return len(self._retries) < max(self.min_retries, int(self.ratio * len(self._requests)))
+
+    def spend(self) -> None:
+        self._retries.append(time.monotonic())
+
+
+class UpstreamStream:
+    """An upstream stream chosen by ``open_stream``.
+
+    ``lines`` yields the non-empty SSE lines, including any read while
+    waiting for the first token. ``failovers`` lists the attempts given up
+    on, oldest first.
+    """
+
+    __slots__ = ("route_key", "response", "lines", "failovers")
+
+    def __init__(
+        self, route_key: str, response: httpx.Response, lines: AsyncIterator[bytes], failovers: List[Dict[str, Any]]
+    ) -> None:
+        self.route_key = route_key
+        self.response = response
+        self.lines = lines
+        self.failovers = failovers
+
+
+async def _lines(response: httpx.Response) -> AsyncIterator[bytes]:
+    async for line in response.aiter_lines():
+        if line:
+            yield (line + "\n").encode("utf-8")
+
+
+async def _chain(head: Sequence[bytes], rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    for line in head:
+        yield line
+    async for line in rest:
+        yield line
+
+
+async def _first_token(lines: AsyncIterator[bytes], timeout: float) -> Tuple[List[bytes], Optional[str]]:
+    """Read up to the first content delta; returns the lines read and a failure reason (None if it arrived)."""
+    head: List[bytes] = []
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            line = await asyncio.wait_for(lines.__anext__(), max(0.0, deadline - time.monotonic()))
+            head.append(line)
+            if is_content_chunk(line) or line.startswith(b"data: [DONE]"):
+                return head, None
+            if line.startswith(b'data: {"error"'):
+                return head, "error"
+    except StopAsyncIteration:
+        return head, "eof"
+    except asyncio.TimeoutError:
+        return head, "ttft_timeout"
+    except httpx.HTTPError:
+        return head, "error"
+
+
+async def _next_replica(model: str, tried: Sequence[str]) -> Optional[str]:
+    """Another active route serving ``model``, skipping those the health checker reports down."""
+    checker = get_health_checker()
+    keys = [
+        key
+        for key in await route_registry.replicas(model)
+        if key not in tried and checker.status(key) != "unavailable"
+    ]
+    return route_registry.pick_replica(keys) if keys else None
+
+
+_budget: Optional[RetryBudget] = None
+
+
+def get_retry_budget() -> RetryBudget:
+    global _budget
+    if _budget is None:
+        s = get_settings()
+        _budget = RetryBudget(s.stream_retry_budget_ratio, s.stream_retry_budget_min)
+    return _budget
+
+
+async def open_stream(route_key: str, model: str, body: Dict[str, Any], pinned: bool) -> UpstreamStream:
+    """Start a chat stream, failing over to another replica until the first token arrives.
+
+    Until then nothing has been sent to the client, so an attempt that
+    fails to connect, answers 5xx, errors, ends, or sends no content
+    within the route's TTFT deadline is abandoned for another replica of
+    ``model`` (not when the caller ``pinned`` a route with ``modelKey``),
+    within ``STREAM_FAILOVER_MAX_ATTEMPTS`` and the retry budget. The last
+    attempt has nowhere to go, so it is returned as soon as its headers
+    arrive and waited on as before. Raises the upstream ``HTTPException``
+    when that attempt fails to start.
+    """
+    s = get_settings()
+    budget = get_retry_budget()
+    budget.record_request()
+    failovers: List[Dict[str, Any]] = []
+    tried: List[str] = []
+    route = route_key
+    while True:
+        alternative = None
+        if s.stream_failover and not pinned and len(tried) + 1 < s.stream_failover_max_attempts:
+            alternative = await _next_replica(model, [*tried, route])
+            if alternative is not None and not budget.available():
+                STREAM_RETRY_BUDGET_EXHAUSTED.inc()
+                alternative = None
+        started = time.perf_counter()
+        try:
+            response = await vllm_client.stream_chat_completion(route, body)
+        except HTTPException as exc:
+            if alternative is None or exc.status_code < 500:
+                raise
+            reason = "timeout" if exc.status_code == 504 else "error"
+        else:
+            lines = _lines(response)
+            if alternative is None:
+                return UpstreamStream(route, response, lines, failovers)
+            head, reason = await _first_token(lines, s.stream_ttft_timeout_for(route))
+            if reason is None:
+                return UpstreamStream(route, response, _chain(head, lines), failovers)
+            await response.aclose()
+        budget.spend()
+        failovers.append({"route": route, "reason": reason, "after_ms": int((time.perf_counter() - started) * 1000)})
+        STREAM_FAILOVERS.labels(route_label(route), reason).inc()
+        logger.info("stream_failover", route=route, next_route=alternative, reason=reason)
+        tried.append(route)
+        route = alternative
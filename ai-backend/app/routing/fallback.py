@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import contextvars
+import time
+from typing import Dict, List, Optional, Tuple
+
+import structlog
+
+from ..config import get_settings
+from ..deps import route_registry
+from ..healthcheck import get_health_checker
+from ..metrics import MODEL_FALLBACKS, model_label
+
+logger = structlog.get_logger()
+
+# (requested model, reason) when the current request was moved to a fallback model
+_decision: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar("model_fallback", default=None)
+
+# Weight of the newest TTFT sample in each route's moving average
+_TTFT_EWMA_ALPHA = 0.2
+# Route -> (moving average, monotonic time of its last sample)
+_ttft_ewma: Dict[str, Tuple[float, float]] = {}
+_clock = time.monotonic
+
+
+def observe_ttft(route_key: str, seconds: float) -> None:
+    """Feed a stream's time to first token into the route's moving average (latency SLO trigger)."""
+    now = _clock()
+    previous = ttft_ewma(route_key)
+    average = seconds if previous is None else previous + _TTFT_EWMA_ALPHA * (seconds - previous)
+    _ttft_ewma[route_key] = (average, now)
+
+
+def ttft_ewma(route_key: str) -> Optional[float]:
+    """The route's TTFT average, or None once it is older than ``MODEL_FALLBACK_TTFT_MAX_AGE_SECONDS``.
+
+    A route that breached the SLO gets no traffic and so no new samples;
+    letting its average expire sends traffic back to it to be measured again.
+    """
+    entry = _ttft_ewma.get(route_key)
+    if entry is None:
+        return None
+    average, at = entry
+    if _clock() - at > get_settings().fallback_ttft_max_age_seconds:
+        del _ttft_ewma[route_key]
+        return None
+    return average
+
+
+def fallback_decision() -> Optional[Tuple[str, str]]:
+    """``(requested_model, reason)`` if this request was routed to a fallback model."""
+    return _decision.get()
+
+
+async def overload_reason(model: str) -> Optional[str]:
+    """Why ``model`` should not take more requests now, or None.
+
+    ``unavailable``: no active replica the health checker reports up.
+    ``queue_depth``: every replica has ``MODEL_FALLBACK_MAX_IN_FLIGHT``
+    requests in flight on this worker. ``latency_slo``: every replica's
+    recent TTFT average exceeds ``MODEL_FALLBACK_TTFT_SLO_MS``.
+    """
+    s = get_settings()
+    checker = get_health_checker()
+    keys = [k for k in await route_registry.replicas(model) if checker.status(k) != "unavailable"]
+    if not keys:
+        return "unavailable"
+    if s.fallback_max_in_flight and all(
+        route_registry.in_flight(k) >= s.fallback_max_in_flight for k in keys
+    ):
+        return "queue_depth"
+    slo = s.fallback_ttft_slo_ms / 1000.0
+    if slo and all((ttft_ewma(k) or 0.0) > slo for k in keys):
+        return "latency_slo"
+    return None
+
+
+async def choose_model(model: str, allowed: Optional[List[str]] = None) -> str:
+    """``model``, or the first model of its ``MODEL_FALLBACKS`` chain that is not overloaded.
+
+    When every model in the chain is overloaded the requested one is kept,
+    so behaviour is unchanged. Fallbacks outside ``allowed`` are skipped.
+    """
+    chain = get_settings().fallback_chains.get(model)
+    if not chain:
+        return model
+    reason = await overload_reason(model)
+    if reason is None:
+        return model
+    for candidate in chain:
+        if allowed and candidate not in allowed:
+            continue
+        if await overload_reason(candidate) is None:
+            _decision.set((model, reason))
+            MODEL_FALLBACKS.labels(model_label(model), model_label(candidate), reason).inc()
+            logger.info("model_fallback", requested_model=model, model=candidate, reason=reason)
+            return candidate
+    return model
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import time
 from typing import Optional, Tuple, Literal, List, Dict, Any
 
 from fastapi import HTTPException, status
 
 from ..config import get_settings
 from ..deps import route_registry
+from ..metrics import ROUTE_RESOLUTION, error_outcome
+from ..tracing import span
+from .fallback import choose_model
 
 
 def _validate_model_allowed(model: str) -> None:
@@ -25,8 +29,9 @@ async def _resolve_static_route(
     """
     Static routing resolution replicating existing behavior:
     - If modelKey provided: ensure route exists and serves the model
-    - Else try to infer route by model id across known routes
-    - If model explicit but ambiguous/unavailable: return 409 w/ guidance
+    - Else (chat) move to a MODEL_FALLBACKS model if this one is overloaded
+    - Then infer route by model id across active routes (least busy replica)
+    - If model explicit but unavailable: return 409 w/ guidance
     - Else fallback to default route and default model name
     """
     settings = get_settings()
@@ -61,6 +66,9 @@ async def _resolve_static_route(
             )
         return route_key, effective_model
 
+    if task == "chat":
+        effective_model = await choose_model(effective_model, settings.allowed_models_list)
+
     # No modelKey: try inference by model
     inferred = await route_registry.infer_route_by_model(effective_model)
     if inferred:
@@ -91,17 +99,34 @@ async def _resolve_static_route(
     return route_key, effective_model
 
 
+async def _timed_resolve(
+    task: Literal["chat", "embeddings"],
+    model: Optional[str],
+    model_key: Optional[str],
+) -> Tuple[str, str]:
+    started = time.perf_counter()
+    with span("route.resolve", task=task, model=model, model_key=model_key) as sp:
+        try:
+            result = await _resolve_static_route(task, model, model_key)
+        except HTTPException as exc:
+            ROUTE_RESOLUTION.labels(task, error_outcome(exc)).observe(time.perf_counter() - started)
+            raise
+        sp.set(route=result[0], resolved_model=result[1])
+    ROUTE_RESOLUTION.labels(task, "ok").observe(time.perf_counter() - started)
+    return result
+
+
 async def resolve_chat_route_and_model(
     model: Optional[str], model_key: Optional[str]
 ) -> Tuple[str, str]:
     # Placeholder for future strategies; default to static
-    return await _resolve_static_route("chat", model, model_key)
+    return await _timed_resolve("chat", model, model_key)
 
 
 async def resolve_embeddings_route_and_model(
     model: Optional[str], model_key: Optional[str]
 ) -> Tuple[str, str]:
     # Placeholder for future strategies; default to static
-    return await _resolve_static_route("embeddings", model, model_key)
+    return await _timed_resolve("embeddings", model, model_key)
 
 
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+import structlog
+
+from .config import get_settings
+
+try:
+    import redis.asyncio as aioredis  # type: ignore
+except Exception:  # pragma: no cover
+    aioredis = None  # type: ignore
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore
+
+logger = structlog.get_logger()
+
+
+class FileStore:
+    """Small JSON values shared by the worker processes on one host.
+
+    One file per key, replaced atomically, so readers never see a partial
+    write. Values are tiny (a route's model list) and read only when a
+    worker's own cache has expired, so reads happen inline.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace("/", "_").replace(":", "_") + ".json")
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires", 0) <= time.time():
+            return None
+        return entry["value"]
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires": time.time() + ttl, "value": value}, f)
+            os.replace(tmp, self._path(key))
+        except OSError as exc:
+            logger.warning("shared_store_write_failed", key=key, error=str(exc))
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+
+    async def aclose(self) -> None:
+        pass
+
+
+class RedisStore:
+    """The same interface over Redis, shared by every worker on every host.
+
+    Failures are treated as a miss: the caller falls back to its own cache
+    and upstream.
+    """
+
+    def __init__(self, client: Any, prefix: str = "gw:shared:") -> None:
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as exc:  # noqa: B902
+            logger.debug("shared_store_unavailable", error=str(exc))
+            return None
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, value: Dict[str, Any], ttl: float) -> None:
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value), px=max(1, int(ttl * 1000)))
+        except Exception as exc:  # noqa: B902
+            logger.debug("shared_store_unavailable", error=str(exc))
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_store: Any = None
+
+
+def configure_shared_store() -> Any:
+    """Redis when ``USE_REDIS`` is set, else a ``FileStore`` in ``SHARED_STATE_DIR``, else None."""
+    global _store
+    s = get_settings()
+    if s.use_redis and s.redis_url and aioredis is not None:
+        timeout = s.rate_limit_redis_timeout_ms / 1000.0
+        _store = RedisStore(aioredis.from_url(s.redis_url, socket_timeout=timeout, socket_connect_timeout=timeout))
+    elif s.shared_state_dir:
+        _store = FileStore(os.path.join(s.shared_state_dir, "cache"))
+    else:
+        _store = None
+    return _store
+
+
+def get_shared_store() -> Any:
+    return _store
+
+
+_leader_files: Dict[str, Any] = {}
+
+
+def try_lead(name: str) -> bool:
+    """Whether this process holds (or just took) the ``name`` lock among the workers.
+
+    Uses an exclusive ``flock`` in ``SHARED_STATE_DIR``, released by the OS
+    when the holder exits, so another worker takes over on its next try.
+    Without a shared directory (single process) or ``fcntl`` every process
+    leads.
+    """
+    if name in _leader_files:
+        return True
+    directory = get_settings().shared_state_dir
+    if not directory or fcntl is None:
+        return True
+    os.makedirs(directory, exist_ok=True)
+    f = open(os.path.join(directory, f"{name}.lock"), "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_files[name] = f
+    return True
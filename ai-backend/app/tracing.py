@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import contextvars
+import random
+import re
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Protocol
+
+from .config import get_settings
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_wall", "start", "end", "attributes", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_wall = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        self.end = time.perf_counter()
+        if exc is not None:
+            self.error = f"{type(exc).__name__}: {exc}"[:200]
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_wall,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Spans of one request, buffered until the root ends so sampling can look at the whole trace."""
+
+    __slots__ = ("trace_id", "spans", "forced")
+
+    def __init__(self, trace_id: Optional[str] = None, forced: bool = False) -> None:
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans: List[Span] = []
+        self.forced = forced
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned when no trace is active, so instrumentation costs one contextvar lookup."""
+
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    __slots__ = ("parent", "name", "attributes", "span", "token")
+
+    def __init__(self, parent: Span, name: str, attributes: Dict[str, Any]) -> None:
+        self.parent = parent
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        self.span = Span(self.parent.trace, self.name, self.parent.span_id, self.attributes)
+        self.parent.trace.spans.append(self.span)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        self.span.finish(exc)
+        _current.reset(self.token)
+
+
+def span(name: str, **attributes: Any) -> Any:
+    """Context manager for a child span of the current one (no-op outside a trace)."""
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return _ActiveSpan(parent, name, attributes)
+
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """Child span that is not made current; call ``finish`` on it.
+
+    For work that spans ``yield``s of a streaming generator, where setting the
+    context variable would leak into whoever iterates it.
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    parent.trace.spans.append(child)
+    return child
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def trace_headers() -> Dict[str, str]:
+    """W3C ``traceparent`` for outgoing calls, so upstream spans join this trace."""
+    current = _current.get()
+    return {"traceparent": current.traceparent()} if current is not None else {}
+
+
+class Exporter(Protocol):
+    def export(self, spans: List[Dict[str, Any]]) -> None: ...
+
+    def flush(self) -> None: ...
+
+
+class MemoryExporter:
+    """Keeps the most recent sampled traces for ``/api/admin/traces``."""
+
+    def __init__(self, max_traces: int = 200) -> None:
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        trace_id = spans[0]["trace_id"]
+        self._traces[trace_id] = spans
+        self._traces.move_to_end(trace_id)
+        while len(self._traces) > self.max_traces:
+            self._traces.popitem(last=False)
+
+    def flush(self) -> None:
+        pass
+
+    def get(self, trace_id: str) -> Optional[List[Dict[str, Any]]]:
+        return self._traces.get(trace_id)
+
+    def recent(self, limit: int = 50, min_ms: float = 0.0) -> List[Dict[str, Any]]:
+        out = []
+        for trace_id, spans in reversed(self._traces.items()):
+            root = spans[0]
+            if root["duration_ms"] < min_ms:
+                continue
+            out.append(
+                {
+                    "trace_id": trace_id,
+                    "name": root["name"],
+                    "start": root["start"],
+                    "duration_ms": root["duration_ms"],
+                    "attributes": root["attributes"],
+                    "spans": len(spans),
+                    "error": any(s["error"] for s in spans),
+                }
+            )
+            if len(out) >= limit:
+                break
+        return out
+
+
+class FileExporter:
+    """Appends one JSON line per span; writing happens on a background thread."""
+
+    def __init__(self, path: str) -> None:
+        import os
+
+        from .logsink import LogSink
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._sink = LogSink(open(path, "a", encoding="utf-8"))
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        for s in spans:
+            self._sink.put(s)
+
+    def flush(self) -> None:
+        self._sink.flush()
+
+
+class Tracer:
+    """Starts request traces and applies tail-based sampling when they end.
+
+    A finished trace is exported if the request failed, any span recorded an
+    error, the root took at least ``slow_ms``, the caller's ``traceparent``
+    was sampled, or it wins the ``sample_rate`` draw.
+    """
+
+    def __init__(self, exporter: Exporter, sample_rate: float = 0.0, slow_ms: float = 1000.0) -> None:
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    def start(self, name: str, traceparent: Optional[str] = None, **attributes: Any) -> "tuple[Span, contextvars.Token]":
+        trace, parent_id = Trace(), None
+        if traceparent:
+            match = _TRACEPARENT.match(traceparent.strip().lower())
+            if match:
+                trace = Trace(match.group(1), forced=bool(int(match.group(3), 16) & 1))
+                parent_id = match.group(2)
+        root = Span(trace, name, parent_id, attributes)
+        trace.spans.append(root)
+        return root, _current.set(root)
+
+    def finish(self, root: Span, token: contextvars.Token, status_code: int) -> bool:
+        _current.reset(token)
+        root.finish()
+        root.attributes["status"] = status_code
+        trace = root.trace
+        keep = (
+            trace.forced
+            or status_code >= 500
+            or root.duration_ms >= self.slow_ms
+            or any(s.error for s in trace.spans)
+            or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        )
+        if keep:
+            self.exporter.export([s.to_dict() for s in trace.spans])
+        return keep
+
+
+_tracer: Optional[Tracer] = None
+
+
+def configure_tracing() -> Optional[Tracer]:
+    """Create the process tracer from settings; None when tracing is disabled."""
+    global _tracer
+    s = get_settings()
+    if not s.trace_enable:
+        _tracer = None
+        return None
+    exporter: Exporter
+    if s.trace_exporter == "file":
+        exporter = FileExporter(s.trace_file)
+    else:
+        exporter = MemoryExporter(s.trace_memory_max)
+    _tracer = Tracer(exporter, s.trace_sample_rate, s.trace_slow_ms)
+    return _tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import asyncio
-from typing import AsyncIterator, Optional
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 
 HEARTBEAT_COMMENT = ": keepalive\n\n"
@@ -21,3 +22,42 @@ async def heartbeat_sender(interval_seconds: float) -> AsyncIterator[bytes]:
     while True:
         await asyncio.sleep(interval_seconds)
         yield HEARTBEAT_COMMENT.encode("utf-8")
+
+
+class StreamAssembler:
+    """Collects what a relayed chat stream persists: the raw ``data:`` lines,
+    the concatenated delta content and the final ``usage`` (if sent)."""
+
+    __slots__ = ("raw_lines", "parts", "usage")
+
+    def __init__(self) -> None:
+        self.raw_lines: List[str] = []
+        self.parts: List[str] = []
+        self.usage: Dict[str, Any] = {}
+
+    def feed(self, chunk: bytes) -> None:
+        try:
+            s = chunk.decode("utf-8", errors="ignore")
+        except Exception:
+            s = ""
+        if not s.startswith("data:"):
+            return
+        self.raw_lines.append(s)
+        try:
+            payload = json.loads(s[len("data:"):].strip())
+            if payload.get("usage"):
+                self.usage = payload["usage"]
+            delta = (payload.get("choices") or [{}])[0].get("delta") or {}
+            if delta.get("content"):
+                self.parts.append(delta["content"])
+        except Exception:
+            # Heartbeats, [DONE] and malformed lines carry nothing to assemble
+            pass
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def raw(self) -> str:
+        return "".join(self.raw_lines)
@@ -0,0 +1,374 @@
+"""End-to-end load test: gateway overhead against a mock vLLM.
+
+Starts ``benchmarks.mock_vllm`` and the gateway (uvicorn, fresh SQLite
+database, auth and rate limits off) as subprocesses, then drives
+``/api/chat``, ``/api/chat/stream`` and ``/api/embeddings`` at the given
+concurrency. Each scenario is also run directly against the mock with the
+same upstream body, so the reported ``added_ms`` is what the gateway adds:
+
+- ``latency_ms`` / ``ttft_ms``: p50/p99 via the gateway and direct, and the difference
+- ``throughput_rps``: completed gateway requests per second
+- ``rss_per_stream_kb``: gateway peak RSS growth during the stream scenario / concurrency (Linux;
+  summed over worker processes with ``--gateway-workers``)
+
+Results are written as JSON with the git commit; ``--compare`` prints the
+change in added latency and throughput against an earlier result file.
+
+``--upstream-transport`` picks how the gateway reaches the mock: ``tcp``
+(HTTP/1.1), ``uds`` (HTTP/1.1 over a unix socket, ``unix://`` route) or
+``http2`` (cleartext HTTP/2 over TCP; needs ``h2`` and ``hypercorn``). The
+direct baseline uses the same transport, so compare runs with ``--compare``.
+
+Usage: python -m benchmarks.loadtest [--requests 500] [--concurrency 32] [--json out.json]
+       [--compare before.json] [--gateway-workers 4] [--upstream-transport uds]
+       [--ttft-ms 50 --tokens-per-sec 200 --tokens 64 ...]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from .mock_vllm import add_arguments as add_mock_arguments
+
+SCENARIOS = ("chat", "stream", "embeddings")
+TRANSPORTS = ("tcp", "uds", "http2")
+PROMPT = "Summarise the plot of a three act play in two sentences."
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def rss_kb(pid: int) -> Optional[int]:
+    """Resident memory of ``pid`` and its child processes (uvicorn workers)."""
+    total = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total = int(line.split()[1])
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                total = (total or 0) + (rss_kb(int(child)) or 0)
+    except OSError:
+        pass
+    return total
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:  # noqa: B902
+        return None
+
+
+def make_client(base_url: str, concurrency: int, transport: str = "tcp", uds: Optional[str] = None) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    if transport == "tcp":
+        return httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0)
+    http2 = transport == "http2"
+    pool = httpx.AsyncHTTPTransport(uds=uds, http1=not http2, http2=http2, limits=limits)
+    return httpx.AsyncClient(base_url=base_url, transport=pool, timeout=120.0)
+
+
+async def wait_ready(url: str, proc: subprocess.Popen, timeout: float = 30.0, client_args: Optional[Dict[str, Any]] = None) -> None:
+    deadline = time.monotonic() + timeout
+    async with make_client("", 1, **(client_args or {})) as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+class Sample:
+    __slots__ = ("latency", "ttft", "ok")
+
+    def __init__(self, latency: float, ttft: Optional[float], ok: bool) -> None:
+        self.latency = latency
+        self.ttft = ttft
+        self.ok = ok
+
+
+def build_requests(scenario: str, model: str, max_tokens: int) -> Tuple[Tuple[str, Dict[str, Any]], Tuple[str, Dict[str, Any]]]:
+    """Return ``((gateway_path, body), (upstream_path, body))`` for a scenario."""
+    if scenario == "embeddings":
+        body = {"input": PROMPT, "model": model}
+        return ("/api/embeddings", body), ("/v1/embeddings", body)
+    stream = scenario == "stream"
+    gateway = {"message": PROMPT, "model": model, "max_tokens": max_tokens}
+    upstream: Dict[str, Any] = {
+        "model": model,
+        "messages": [{"role": "user", "content": PROMPT}],
+        "stream": stream,
+        "max_tokens": max_tokens,
+    }
+    if stream:
+        upstream["stream_options"] = {"include_usage": True}
+    return ("/api/chat/stream" if stream else "/api/chat", gateway), ("/v1/chat/completions", upstream)
+
+
+async def one_request(client: httpx.AsyncClient, path: str, body: Dict[str, Any], stream: bool) -> Sample:
+    started = time.perf_counter()
+    ttft = None
+    try:
+        if not stream:
+            r = await client.post(path, json=body)
+            return Sample(time.perf_counter() - started, None, r.status_code == 200)
+        ok = False
+        async with client.stream("POST", path, json=body) as r:
+            async for line in r.aiter_lines():
+                if ttft is None and '"content"' in line:
+                    ttft = time.perf_counter() - started
+                if line.startswith("data: [DONE]"):
+                    ok = r.status_code == 200
+        return Sample(time.perf_counter() - started, ttft, ok)
+    except httpx.HTTPError:
+        return Sample(time.perf_counter() - started, ttft, False)
+
+
+async def drive(
+    base_url: str, path: str, body: Dict[str, Any], stream: bool, requests: int, concurrency: int,
+    on_tick: Optional[Callable[[], None]] = None, client_args: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Sample], float]:
+    async with make_client(base_url, concurrency, **(client_args or {})) as client:
+        remaining = requests
+        samples: List[Sample] = []
+
+        async def worker() -> None:
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                samples.append(await one_request(client, path, body, stream))
+
+        async def sampler() -> None:
+            while True:
+                on_tick()  # type: ignore[misc]
+                await asyncio.sleep(0.05)
+
+        sampler_task = asyncio.create_task(sampler()) if on_tick else None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        if sampler_task is not None:
+            sampler_task.cancel()
+        return samples, elapsed
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {"p50": round(percentile(values, 50) * 1000, 2), "p99": round(percentile(values, 99) * 1000, 2)}
+
+
+def added(gateway: Dict[str, float], direct: Dict[str, float]) -> Dict[str, float]:
+    return {k: round(gateway[k] - direct[k], 2) for k in ("p50", "p99")}
+
+
+async def run_scenario(
+    scenario: str, gateway_url: str, mock_url: str, model: str, args: argparse.Namespace, gateway_pid: Optional[int],
+    mock_client_args: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    (gw_path, gw_body), (up_path, up_body) = build_requests(scenario, model, args.tokens)
+    stream = scenario == "stream"
+    # Warm up connections, route caches and SQLite
+    await drive(gateway_url, gw_path, gw_body, stream, min(20, args.requests), min(4, args.concurrency))
+
+    direct, _ = await drive(mock_url, up_path, up_body, stream, args.requests, args.concurrency, client_args=mock_client_args)
+    peak: List[int] = []
+    before = rss_kb(gateway_pid) if gateway_pid else None
+
+    def track_rss() -> None:
+        value = rss_kb(gateway_pid) if gateway_pid else None
+        if value is not None:
+            peak.append(value)
+
+    via, elapsed = await drive(
+        gateway_url, gw_path, gw_body, stream, args.requests, args.concurrency, track_rss if stream else None
+    )
+
+    ok = [s for s in via if s.ok]
+    result: Dict[str, Any] = {
+        "requests": len(via),
+        "errors": len(via) - len(ok),
+        "throughput_rps": round(len(ok) / elapsed, 1) if elapsed else None,
+    }
+    gw_latency = summarize([s.latency for s in ok])
+    direct_latency = summarize([s.latency for s in direct if s.ok])
+    result["latency_ms"] = {"gateway": gw_latency, "direct": direct_latency, "added": added(gw_latency, direct_latency)}
+    if stream:
+        gw_ttft = summarize([s.ttft for s in ok if s.ttft is not None])
+        direct_ttft = summarize([s.ttft for s in direct if s.ok and s.ttft is not None])
+        result["ttft_ms"] = {"gateway": gw_ttft, "direct": direct_ttft, "added": added(gw_ttft, direct_ttft)}
+        if before is not None and peak:
+            result["rss_per_stream_kb"] = round(max(0, max(peak) - before) / args.concurrency, 1)
+    return result
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    model = args.models.split(",")[0].strip()
+    mock_port, gateway_port = args.mock_port or free_port(), free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    gateway_url = args.gateway_url or f"http://127.0.0.1:{gateway_port}"
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    # How the gateway (route URL) and the direct baseline (client) reach the mock
+    route_url = f"{mock_url}/v1"
+    mock_listen = ["--port", str(mock_port)]
+    mock_client_args: Dict[str, Any] = {"transport": args.upstream_transport}
+    if args.upstream_transport == "uds":
+        sock = os.path.join(workdir, "mock.sock")
+        mock_url, route_url = "http://localhost", f"unix://{sock}?path=/v1"
+        mock_listen = ["--uds", sock]
+        mock_client_args["uds"] = sock
+    elif args.upstream_transport == "http2":
+        route_url += "?http2=1"
+        mock_listen.append("--http2")
+    procs: List[subprocess.Popen] = []
+    log = open(os.path.join(workdir, "servers.log"), "w")
+    mock_args = [
+        "--models", args.models, "--ttft-ms", str(args.ttft_ms), "--tokens-per-sec", str(args.tokens_per_sec),
+        "--tokens", str(args.tokens), "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+        "--embedding-dim", str(args.embedding_dim), "--seed", str(args.seed),
+    ]
+    try:
+        mock = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.mock_vllm", *mock_listen, *mock_args], stdout=log, stderr=log
+        )
+        procs.append(mock)
+        gateway_pid = None
+        if not args.gateway_url:
+            env = {
+                **os.environ,
+                "MODEL_ROUTE_MOCK": route_url,
+                "DEFAULT_MODEL_KEY": "mock",
+                "DATABASE_URL": f"sqlite:///{workdir}/gateway.db",
+                "AUTH_REQUIRED": "false",
+                "RATE_LIMIT_PER_MIN": "1000000000",
+                "LOG_SAMPLE_RATE": str(args.log_sample_rate),
+            }
+            worker_args: List[str] = []
+            if args.gateway_workers > 1:
+                # What start_server.py --prod sets up
+                env.update(
+                    WORKERS=str(args.gateway_workers),
+                    SHARED_STATE_DIR=os.path.join(workdir, "shared"),
+                    PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "prometheus"),
+                )
+                os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+                worker_args = ["--workers", str(args.gateway_workers)]
+            gateway = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(gateway_port),
+                 "--log-level", "warning", "--no-access-log", *worker_args],
+                env=env, stdout=subprocess.DEVNULL, stderr=log,
+            )
+            procs.append(gateway)
+            gateway_pid = gateway.pid
+            await wait_ready(f"{gateway_url}/health", gateway)
+        await wait_ready(f"{mock_url}/v1/models", mock, client_args=mock_client_args)
+
+        results: Dict[str, Any] = {}
+        for scenario in args.scenarios:
+            results[scenario] = await run_scenario(
+                scenario, gateway_url, mock_url, model, args, gateway_pid, mock_client_args
+            )
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        log.close()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "gateway_workers": args.gateway_workers,
+            "upstream_transport": args.upstream_transport,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mock": {"ttft_ms": args.ttft_ms, "tokens_per_sec": args.tokens_per_sec, "tokens": args.tokens, "error_rate": args.error_rate},
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Change in added latency (ms) and throughput (%) per scenario versus ``baseline``."""
+    out: Dict[str, Any] = {}
+    for scenario, now in current["results"].items():
+        before = baseline.get("results", {}).get(scenario)
+        if not before:
+            continue
+        delta: Dict[str, Any] = {}
+        for metric in ("latency_ms", "ttft_ms"):
+            if metric in now and metric in before:
+                delta[f"added_{metric}"] = {
+                    k: round(now[metric]["added"][k] - before[metric]["added"][k], 2) for k in ("p50", "p99")
+                }
+        if now.get("throughput_rps") and before.get("throughput_rps"):
+            delta["throughput_pct"] = round((now["throughput_rps"] / before["throughput_rps"] - 1) * 100, 1)
+        out[scenario] = delta
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario and target")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--scenarios", type=lambda v: [s.strip() for s in v.split(",")], default=list(SCENARIOS))
+    parser.add_argument("--gateway-url", help="Use a running gateway instead of starting one (route it to --mock-port)")
+    parser.add_argument("--mock-port", type=int, default=0, help="Default: a free port")
+    parser.add_argument("--gateway-workers", type=int, default=1, help="Gateway worker processes (as start_server.py --prod)")
+    parser.add_argument("--upstream-transport", choices=TRANSPORTS, default="tcp", help="Gateway to mock transport")
+    parser.add_argument("--log-sample-rate", type=float, default=1.0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--compare", help="Earlier result file to diff against")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.gateway_url:
+        args.gateway_url = args.gateway_url.rstrip("/")
+
+    results = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare) as f:
+            results["compare"] = {"baseline": args.compare, "delta": compare(results, json.load(f))}
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
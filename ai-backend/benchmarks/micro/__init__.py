@@ -0,0 +1,24 @@
+"""Component micro-benchmarks: storage (insert/commit, FTS search, deep pagination) and SSE.
+
+Run with ``python -m benchmarks.micro``; see ``benchmarks/micro/__main__.py``.
+Every reported number is a time (lower is better), so a result file can be
+used as the ``--baseline`` for a regression check.
+"""
+from __future__ import annotations
+
+import statistics
+import time
+from typing import Any, Callable
+
+
+def measure(fn: Callable[[], Any], number: int = 1, repeat: int = 5, warmup: int = 1) -> float:
+    """Median microseconds per call of ``fn`` over ``repeat`` rounds of ``number`` calls."""
+    for _ in range(warmup):
+        fn()
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - start) / number)
+    return round(statistics.median(rounds) * 1e6, 2)
@@ -0,0 +1,108 @@
+"""Run the component micro-benchmarks and optionally check them against a baseline.
+
+Groups: ``persistence``, ``search``, ``pagination``, ``sse``. Search and
+pagination use the cached seeded corpus from ``datasets.build_corpus``
+(built on first use; 1M messages takes a few minutes).
+
+With ``--baseline old.json`` every timing is compared to the same key in
+the baseline and the run exits with status 1 if any is more than
+``--threshold`` (default 20%) slower.
+
+Usage: python -m benchmarks.micro [--only search,sse] [--messages 1000000] [--seed 1234]
+       [--json out.json] [--baseline old.json --threshold 0.2]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+os.environ.setdefault("LOG_ASYNC", "false")
+
+GROUPS = ("persistence", "search", "pagination", "sse")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:  # noqa: B902
+        return None
+
+
+def regressions(current: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[Dict[str, Any]]:
+    out = []
+    for key, value in current.items():
+        before = baseline.get(key)
+        if before and value > before * (1 + threshold):
+            out.append({"benchmark": key, "baseline": before, "current": value, "change_pct": round((value / before - 1) * 100, 1)})
+    return out
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    from .datasets import build_corpus
+    from .storage import bench_pagination, bench_persistence, bench_search
+    from .streaming import bench_sse
+
+    results: Dict[str, float] = {}
+    if "sse" in args.only:
+        results.update(bench_sse(args.repeat, args.seed))
+    if "persistence" in args.only:
+        results.update(bench_persistence(args.repeat, args.seed))
+    if {"search", "pagination"} & set(args.only):
+        started = time.perf_counter()
+        corpus = build_corpus(args.messages, args.seed, rebuild=args.rebuild)
+        print(f"corpus: {corpus.path} ({time.perf_counter() - started:.1f}s)", file=sys.stderr)
+        if "search" in args.only:
+            results.update(bench_search(corpus, args.repeat))
+        if "pagination" in args.only:
+            results.update(bench_pagination(corpus, args.repeat))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", type=lambda v: [g.strip() for g in v.split(",") if g.strip()], default=list(GROUPS))
+    parser.add_argument("--messages", type=int, default=1_000_000, help="Corpus size for search/pagination")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate the cached corpus")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Earlier result file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+    unknown = set(args.only) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+
+    output: Dict[str, Any] = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "messages": args.messages,
+            "seed": args.seed,
+        },
+        "results": run(args),
+    }
+    failed: List[Dict[str, Any]] = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failed = regressions(output["results"], baseline.get("results", {}), args.threshold)
+        output["regressions"] = failed
+    print(json.dumps(output, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Deterministic datasets for the micro-benchmarks.
+
+The message corpus is built once per ``(messages, seed)`` into a cached
+SQLite file (``benchmarks/.cache`` by default) with the app's own schema
+and FTS triggers, so runs on different commits search the same data.
+Text is drawn from a Zipf-like vocabulary so common, mid-frequency and
+rare query terms behave like real chat history.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import random
+import string
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+VOCABULARY_SIZE = 5000
+BATCH = 10_000
+# Epoch for generated timestamps, so ``started_at`` ordering is reproducible
+EPOCH = datetime(2024, 1, 1)
+
+
+def vocabulary(seed: int) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+    return sorted(words, key=lambda w: (len(w), w))
+
+
+class TextGenerator:
+    """Sentences with Zipf-distributed words from a seeded vocabulary."""
+
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+        self.words = vocabulary(seed)
+        self.cum_weights = list(itertools.accumulate(1.0 / (rank + 1) ** 1.1 for rank in range(len(self.words))))
+
+    def text(self, min_words: int = 8, max_words: int = 60) -> str:
+        n = self.rng.randint(min_words, max_words)
+        return " ".join(self.rng.choices(self.words, cum_weights=self.cum_weights, k=n))
+
+    def query_terms(self) -> Dict[str, str]:
+        """FTS queries of known selectivity for this seed's vocabulary."""
+        return {
+            "common": self.words[0],
+            "mid": self.words[200],
+            "rare": self.words[VOCABULARY_SIZE - 1],
+            "and": f"{self.words[1]} {self.words[50]}",
+            "phrase": f'"{self.words[0]} {self.words[1]}"',
+        }
+
+
+@dataclass
+class Corpus:
+    path: str
+    messages: int
+    seed: int
+    deep_conversation_id: str
+    deep_messages: int
+    terms: Dict[str, str]
+
+    @property
+    def url(self) -> str:
+        return f"sqlite:///{self.path}"
+
+
+def use_database(url: str) -> None:
+    """Point the app's engine and ``get_session`` at ``url``."""
+    os.environ["DATABASE_URL"] = url
+    from app.config import get_settings
+    from app.db import base
+
+    # Settings are cached; without this the engine keeps the first URL
+    get_settings.cache_clear()
+    if base._engine is not None:
+        base._engine.dispose()
+    base._engine = None
+    base.SessionLocal = None
+    base.init_engine()
+
+
+def _hex_id(rng: random.Random) -> str:
+    return f"{rng.getrandbits(128):032x}"
+
+
+def build_corpus(messages: int = 1_000_000, seed: int = 1234, cache_dir: str = CACHE_DIR, rebuild: bool = False) -> Corpus:
+    """Create (or reuse) a corpus of ``messages`` rows.
+
+    Conversations hold 20 messages each, except one "deep" conversation with
+    a tenth of the corpus (at most 100k) for pagination benchmarks.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"corpus-{messages}-{seed}.db")
+    meta_path = path + ".json"
+    gen = TextGenerator(seed)
+    if not rebuild and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        use_database(f"sqlite:///{path}")
+        return Corpus(path, messages, seed, meta["deep_conversation_id"], meta["deep_messages"], gen.query_terms())
+
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    use_database(f"sqlite:///{path}")
+    from app.db.base import (
+        create_all,
+        create_fts_triggers,
+        drop_fts_triggers,
+        get_engine,
+        rebuild_fts,
+    )
+    from app.db.models import Conversation, Message
+
+    create_all()
+    engine = get_engine()
+    rng = random.Random(seed)
+    deep = min(100_000, messages // 10)
+    deep_id = _hex_id(rng)
+
+    with engine.begin() as conn:
+        # Bulk load without per-row FTS triggers, then index in one pass
+        drop_fts_triggers(conn)
+        conv_rows = [{"id": deep_id, "created_at": EPOCH, "pinned": False, "updated_at": EPOCH}]
+        conv_id, in_conv = deep_id, 0
+        batch: List[dict] = []
+        for i in range(messages):
+            if i >= deep and (in_conv >= 20 or conv_id == deep_id):
+                conv_id, in_conv = _hex_id(rng), 0
+                conv_rows.append({"id": conv_id, "created_at": EPOCH, "pinned": False, "updated_at": EPOCH})
+            ts = EPOCH + timedelta(seconds=i)
+            batch.append(
+                {
+                    "id": _hex_id(rng),
+                    "conversation_id": conv_id,
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content_text": gen.text(),
+                    "model": "bench/model",
+                    "model_key": "bench",
+                    "status": "completed",
+                    "started_at": ts,
+                    "updated_at": ts,
+                }
+            )
+            in_conv += 1
+            if len(batch) >= BATCH:
+                conn.execute(Conversation.__table__.insert(), conv_rows)
+                conn.execute(Message.__table__.insert(), batch)
+                conv_rows, batch = [], []
+        if conv_rows:
+            conn.execute(Conversation.__table__.insert(), conv_rows)
+        if batch:
+            conn.execute(Message.__table__.insert(), batch)
+        rebuild_fts(conn)
+        create_fts_triggers(conn)
+    with engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.exec_driver_sql("ANALYZE")
+
+    with open(meta_path, "w") as f:
+        json.dump({"deep_conversation_id": deep_id, "deep_messages": deep}, f)
+    return Corpus(path, messages, seed, deep_id, deep, gen.query_terms())
+
+
+def sse_stream(tokens: int = 256, seed: int = 1234, usage: bool = True) -> List[bytes]:
+    """Relayed vLLM stream lines as ``chat_stream`` sees them (role chunk, content, usage, [DONE])."""
+    gen = TextGenerator(seed)
+
+    def line(payload: dict) -> bytes:
+        return f"data: {json.dumps(payload)}\n".encode()
+
+    base = {"id": "cmpl-bench", "object": "chat.completion.chunk", "model": "bench/model"}
+    lines = [line({**base, "choices": [{"index": 0, "delta": {"role": "assistant"}, "finish_reason": None}]})]
+    for _ in range(tokens):
+        delta = {"content": gen.text(1, 1) + " "}
+        lines.append(line({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+    lines.append(line({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+    if usage:
+        lines.append(line({**base, "choices": [], "usage": {"prompt_tokens": 20, "completion_tokens": tokens, "total_tokens": tokens + 20}}))
+    lines.append(b"data: [DONE]\n")
+    return lines
@@ -0,0 +1,85 @@
+"""Storage benchmarks: insert/commit through ``get_session``, FTS search and deep pagination."""
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import tempfile
+from typing import Dict
+
+from . import measure
+from .datasets import Corpus, TextGenerator, use_database
+
+
+def bench_persistence(repeat: int = 5, seed: int = 1234) -> Dict[str, float]:
+    """One chat exchange per transaction (conversation + user + assistant rows), as ``/api/chat`` stores it."""
+    from app.db.base import create_all, get_engine, get_session
+    from app.db.models import Conversation, Message
+
+    with tempfile.TemporaryDirectory(prefix="micro-") as workdir:
+        use_database(f"sqlite:///{os.path.join(workdir, 'persist.db')}")
+        create_all()
+        gen = TextGenerator(seed)
+        body = {"model": "bench/model", "messages": [{"role": "user", "content": gen.text()}]}
+        raw = gzip.compress(json.dumps(body).encode("utf-8"))
+
+        def exchange() -> None:
+            db = get_session()
+            try:
+                conv = Conversation()
+                db.add(conv)
+                db.flush()
+                for role in ("user", "assistant"):
+                    db.add(
+                        Message(
+                            conversation_id=conv.id,
+                            role=role,
+                            content_text=gen.text(),
+                            model="bench/model",
+                            model_key="bench",
+                            raw_request_gzip=raw if role == "user" else None,
+                        )
+                    )
+                db.commit()
+            finally:
+                db.close()
+
+        try:
+            return {
+                "persist.exchange_commit_us": measure(exchange, number=50, repeat=repeat),
+            }
+        finally:
+            # Close pooled connections before the directory is removed
+            get_engine().dispose()
+
+
+def bench_search(corpus: Corpus, repeat: int = 5) -> Dict[str, float]:
+    from app.routers.search import search_messages
+
+    use_database(corpus.url)
+    results: Dict[str, float] = {}
+
+    def search(q: str, offset: int = 0):
+        return lambda: search_messages(q=q, conversation_id=None, role=None, model=None, limit=50, offset=offset)
+
+    for name, q in corpus.terms.items():
+        results[f"search.{name}_us"] = measure(search(q), number=3, repeat=repeat)
+    results["search.common_offset_1000_us"] = measure(search(corpus.terms["common"], 1000), number=3, repeat=repeat)
+    return results
+
+
+def bench_pagination(corpus: Corpus, repeat: int = 5) -> Dict[str, float]:
+    from app.routers.conversations import list_conversation_messages
+
+    use_database(corpus.url)
+    results: Dict[str, float] = {}
+
+    def page(offset: int, order: str = "asc"):
+        return lambda: list_conversation_messages(corpus.deep_conversation_id, limit=100, offset=offset, order=order)
+
+    offsets = sorted({0, 1_000, 10_000, max(0, corpus.deep_messages - 100)})
+    for offset in offsets:
+        if offset < corpus.deep_messages:
+            results[f"pagination.offset_{offset}_us"] = measure(page(offset), number=3, repeat=repeat)
+    results["pagination.desc_first_page_us"] = measure(page(0, "desc"), number=3, repeat=repeat)
+    return results
@@ -0,0 +1,35 @@
+"""SSE benchmarks: ``format_sse_data``, ``is_content_chunk`` and the ``chat_stream`` assembler."""
+from __future__ import annotations
+
+import json
+from typing import Dict, Tuple
+
+from . import measure
+from .datasets import sse_stream
+
+
+def bench_sse(repeat: int = 5, seed: int = 1234, tokens: int = 256) -> Dict[str, float]:
+    from app.metrics import is_content_chunk
+    from app.utils.sse import StreamAssembler, format_sse_data
+
+    lines = sse_stream(tokens, seed)
+    chunk = lines[1].decode()[len("data: "):].strip()
+    error = json.dumps({"error": {"message": "Upstream timeout"}})
+
+    def assemble() -> Tuple[str, str]:
+        assembler = StreamAssembler()
+        for line in lines:
+            assembler.feed(line)
+        # Include joining the text and raw SSE, as chat_stream does when finalizing
+        return assembler.text, assembler.raw
+
+    def scan() -> None:
+        for line in lines:
+            is_content_chunk(line)
+
+    return {
+        "sse.format_chunk_us": measure(lambda: format_sse_data(chunk), number=10_000, repeat=repeat),
+        "sse.format_error_event_us": measure(lambda: format_sse_data(error, event="error"), number=10_000, repeat=repeat),
+        f"sse.assemble_{tokens}_tokens_us": measure(assemble, number=50, repeat=repeat),
+        f"sse.content_scan_{tokens}_tokens_us": measure(scan, number=200, repeat=repeat),
+    }
@@ -0,0 +1,143 @@
+"""Per-request overhead of the middleware stack, before and after the pure-ASGI rewrite.
+
+Runs a trivial JSON endpoint and a 100-chunk SSE endpoint in-process (httpx
+ASGITransport, no sockets) behind:
+
+- ``legacy``: the previous three ``BaseHTTPMiddleware`` layers (reproduced here)
+- ``pipeline``: the single ``GatewayMiddleware`` layer
+- ``none``: no middleware, as the baseline
+
+Usage: python -m benchmarks.middleware_overhead [--requests 2000] [--json out.json]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict
+
+os.environ.setdefault("AUTH_REQUIRED", "false")
+os.environ.setdefault("RATE_LIMIT_PER_MIN", "100000000")
+
+import httpx
+import structlog
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.auth import ApiKeyAuth
+from app.middleware.pipeline import GatewayMiddleware
+from app.middleware.ratelimit import RateLimiter
+
+# Render log lines but drop them, so I/O does not dominate the measurement
+structlog.configure(
+    processors=[structlog.processors.JSONRenderer()], logger_factory=structlog.ReturnLoggerFactory()
+)
+logger = structlog.get_logger()
+
+SSE_CHUNKS = 100
+
+
+class LegacyLogging(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):  # type: ignore[override]
+        request_id = request.headers.get("X-Request-Id", str(uuid.uuid4()))
+        start = time.perf_counter()
+        response = await call_next(request)
+        logger.info(
+            "request",
+            path=request.url.path,
+            method=request.method,
+            status=response.status_code,
+            duration_ms=int((time.perf_counter() - start) * 1000),
+            request_id=request_id,
+        )
+        response.headers.setdefault("X-Request-Id", request_id)
+        return response
+
+
+class LegacyRateLimit(BaseHTTPMiddleware):
+    def __init__(self, app) -> None:  # type: ignore[no-untyped-def]
+        super().__init__(app)
+        self.limiter = RateLimiter()
+
+    async def dispatch(self, request: Request, call_next):  # type: ignore[override]
+        if not self.limiter.bucket.allow(request.client.host if request.client else "unknown"):
+            raise RuntimeError("limited")
+        return await call_next(request)
+
+
+class LegacyAuth(BaseHTTPMiddleware):
+    def __init__(self, app) -> None:  # type: ignore[no-untyped-def]
+        super().__init__(app)
+        self.auth = ApiKeyAuth()
+
+    async def dispatch(self, request: Request, call_next):  # type: ignore[override]
+        if self.auth.check(request.scope) is not None:
+            raise RuntimeError("unauthorized")
+        return await call_next(request)
+
+
+def build_app(stack: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping() -> Dict[str, bool]:
+        return {"ok": True}
+
+    @app.get("/sse")
+    async def sse() -> StreamingResponse:
+        async def gen():
+            for i in range(SSE_CHUNKS):
+                yield f'data: {{"choices":[{{"delta":{{"content":"t{i}"}}}}]}}\n\n'.encode()
+
+        return StreamingResponse(gen(), media_type="text/event-stream")
+
+    if stack == "legacy":
+        app.add_middleware(LegacyLogging)
+        app.add_middleware(LegacyRateLimit)
+        app.add_middleware(LegacyAuth)
+    elif stack == "pipeline":
+        app.add_middleware(GatewayMiddleware)
+    return app
+
+
+async def _measure(stack: str, path: str, requests: int) -> float:
+    transport = httpx.ASGITransport(app=build_app(stack))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(50):  # warm-up
+            await client.get(path)
+        start = time.perf_counter()
+        for _ in range(requests):
+            r = await client.get(path)
+            assert r.status_code == 200
+        return (time.perf_counter() - start) / requests * 1e6
+
+
+async def run(requests: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for path in ("/ping", "/sse"):
+        per_stack = {stack: await _measure(stack, path, requests) for stack in ("none", "legacy", "pipeline")}
+        results[path] = {
+            "us_per_request": {k: round(v, 1) for k, v in per_stack.items()},
+            "overhead_us": {k: round(per_stack[k] - per_stack["none"], 1) for k in ("legacy", "pipeline")},
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    results = asyncio.run(run(args.requests))
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
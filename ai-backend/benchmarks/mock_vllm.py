@@ -0,0 +1,204 @@
+"""Mock OpenAI/vLLM server for load tests.
+
+Serves ``/v1/models``, ``/v1/chat/completions`` (plain and SSE) and
+``/v1/embeddings`` with a configurable time to first token, token rate,
+response length, error injection and model list. Streams end with a
+``usage`` chunk when ``stream_options.include_usage`` is set, like vLLM.
+
+Usage: python -m benchmarks.mock_vllm [--port 8001] [--ttft-ms 50] [--tokens-per-sec 200]
+       [--tokens 64] [--error-rate 0.0] [--models mock/model-a,mock/model-b]
+       [--uds /tmp/mock.sock] [--http2]
+
+``--uds`` listens on a unix socket instead of TCP. ``--http2`` serves
+cleartext HTTP/2 (and HTTP/1.1) with hypercorn, which must be installed.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+@dataclass
+class MockConfig:
+    models: List[str] = field(default_factory=lambda: ["mock/model"])
+    ttft_ms: float = 50.0
+    tokens_per_sec: float = 200.0
+    tokens: int = 64
+    # Fraction of completion/embedding calls answered with ``error_status``
+    error_rate: float = 0.0
+    error_status: int = 503
+    embedding_dim: int = 384
+    seed: int = 0
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _prompt_tokens(body: Dict[str, Any]) -> int:
+    chars = sum(len(str(m.get("content") or "")) for m in body.get("messages") or [])
+    return max(1, chars // 4)
+
+
+def create_app(config: MockConfig) -> Starlette:
+    rng = random.Random(config.seed)
+    interval = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+
+    def injected_error() -> Response | None:
+        if config.error_rate > 0 and rng.random() < config.error_rate:
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=config.error_status)
+        return None
+
+    async def models(request: Request) -> Response:
+        return JSONResponse(
+            {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "mock"} for m in config.models]}
+        )
+
+    async def chat_completions(request: Request) -> Response:
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        model = body.get("model") or config.models[0]
+        n = min(config.tokens, body.get("max_tokens") or config.tokens)
+        prompt_tokens = _prompt_tokens(body)
+        completion_id = f"cmpl-{uuid.uuid4().hex[:12]}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.ttft_ms / 1000 + n * interval)
+            return JSONResponse(
+                {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {"index": 0, "message": {"role": "assistant", "content": "tok " * n}, "finish_reason": "length"}
+                    ],
+                    "usage": _usage(prompt_tokens, n),
+                }
+            )
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events() -> AsyncIterator[bytes]:
+            def chunk(delta: Dict[str, Any], finish: str | None = None) -> bytes:
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                }
+                return f"data: {json.dumps(data)}\n\n".encode()
+
+            await asyncio.sleep(config.ttft_ms / 1000)
+            yield chunk({"role": "assistant"})
+            # Pace against the start time so sleep overshoot does not accumulate
+            started = time.perf_counter()
+            for i in range(n):
+                delay = started + i * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield chunk({"content": "tok "})
+            yield chunk({}, "length")
+            if include_usage:
+                usage = {"id": completion_id, "object": "chat.completion.chunk", "choices": [], "usage": _usage(prompt_tokens, n)}
+                yield f"data: {json.dumps(usage)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(request: Request) -> Response:
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        inputs = body.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        await asyncio.sleep(config.ttft_ms / 1000)
+        vector = [0.0] * config.embedding_dim
+        return JSONResponse(
+            {
+                "object": "list",
+                "model": body.get("model") or config.models[0],
+                "data": [{"object": "embedding", "index": i, "embedding": vector} for i in range(len(inputs))],
+                "usage": _usage(sum(len(str(x)) // 4 + 1 for x in inputs), 0),
+            }
+        )
+
+    return Starlette(
+        routes=[
+            Route("/v1/models", models),
+            Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+            Route("/v1/embeddings", embeddings, methods=["POST"]),
+        ]
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = MockConfig()
+    parser.add_argument("--models", default=",".join(defaults.models), help="Comma-separated model ids")
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms)
+    parser.add_argument("--tokens-per-sec", type=float, default=defaults.tokens_per_sec)
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="Completion length")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--embedding-dim", type=int, default=defaults.embedding_dim)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        ttft_ms=args.ttft_ms,
+        tokens_per_sec=args.tokens_per_sec,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--uds", help="Listen on this unix socket instead of --host/--port")
+    parser.add_argument("--http2", action="store_true", help="Serve HTTP/2 too (requires hypercorn)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    app = create_app(config_from_args(args))
+    if args.http2:
+        try:
+            from hypercorn.asyncio import serve
+            from hypercorn.config import Config
+        except ImportError:
+            parser.error("--http2 requires hypercorn (pip install hypercorn)")
+        config = Config()
+        config.bind = [f"unix:{args.uds}" if args.uds else f"{args.host}:{args.port}"]
+        config.loglevel = "WARNING"
+        asyncio.run(serve(app, config))  # type: ignore[arg-type]
+        return
+    uvicorn.run(app, host=args.host, port=args.port, uds=args.uds, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Memory and per-call cost of the in-process rate limiter at a million distinct keys.
+
+Compares the previous two-dict token bucket (reproduced here, never evicts)
+with ``InMemoryBucket`` both uncapped and at the default 100k key cap.
+
+Usage: python -m benchmarks.ratelimit_memory [--keys 1000000] [--json out.json]
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from app.middleware.ratelimit import InMemoryBucket
+
+
+class LegacyBucket:
+    def __init__(self, capacity: int, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.allowance: Dict[str, float] = {}
+        self.last_check: Dict[str, float] = {}
+
+    def allow(self, key: str) -> bool:
+        now = time.time()
+        last = self.last_check.get(key, now)
+        self.last_check[key] = now
+        allowance = min(self.capacity, self.allowance.get(key, self.capacity) + (now - last) * self.refill_per_second)
+        if allowance < 1.0:
+            self.allowance[key] = allowance
+            return False
+        self.allowance[key] = allowance - 1.0
+        return True
+
+
+def _keys(n: int):
+    # Mimic the limiter's "class|ip" keys for n distinct IPv4 clients
+    for i in range(n):
+        yield f"default|10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+
+
+def measure(name: str, factory: Callable[[], Any], keys: int) -> Dict[str, Any]:
+    key_list = list(_keys(keys))
+    bucket = factory()
+    start = time.perf_counter()
+    for key in key_list:
+        bucket.allow(key)
+    elapsed = time.perf_counter() - start
+    del bucket
+
+    gc.collect()
+    bucket = factory()
+    # Keys are built per call, as in the server, so anything retaining them is counted
+    tracemalloc.start()
+    for key in _keys(keys):
+        bucket.allow(key)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stored = len(bucket) if hasattr(bucket, "__len__") else len(bucket.allowance)
+    return {
+        "name": name,
+        "keys_seen": keys,
+        "keys_stored": stored,
+        "retained_mb": round(current / 1e6, 1),
+        "peak_mb": round(peak / 1e6, 1),
+        "bytes_per_stored_key": round(current / max(1, stored), 1),
+        "ns_per_call": round(elapsed / keys * 1e9),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results = [
+        measure("legacy", lambda: LegacyBucket(60, 1.0), args.keys),
+        measure("sharded_uncapped", lambda: InMemoryBucket(60, 1.0, max_keys=args.keys * 2), args.keys),
+        measure("sharded_cap_100k", lambda: InMemoryBucket(60, 1.0, max_keys=100_000), args.keys),
+    ]
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
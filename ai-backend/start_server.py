@@ -2,37 +2,83 @@
 """
 Dynamic port allocation server startup script.
 This script finds an available port and starts the FastAPI server.
+
+Development (default): one process, auto-reload per RELOAD.
+Production (--prod): no reload, N worker processes behind uvicorn's
+pre-fork supervisor (one listening socket shared by all workers), with the
+state workers must agree on shared between them:
+
+- SHARED_STATE_DIR (default ./data/shared): model catalog cache and the
+  retention leader lock (Redis is used for the catalog when USE_REDIS=true)
+- PROMETHEUS_MULTIPROC_DIR: /metrics aggregates every worker
+- WORKERS: the in-memory rate limiter gives each worker 1/WORKERS of each
+  limit, and so do per-minute token quotas; daily token quotas are shared
+  through the token_usage table, re-read on every QUOTA_FLUSH_SECONDS flush
+- ROUTES_FILE: admin route changes are written here so every worker applies
+  them; without it they only reach the worker that served the call (a
+  warning is printed)
 """
 
+import argparse
+import glob
+import os
 import sys
 import uvicorn
 from app.config import get_settings
 
 
+def prepare_workers(workers: int) -> None:
+    """Export the settings worker processes read at startup."""
+    os.environ["WORKERS"] = str(workers)
+    shared_dir = os.environ.setdefault("SHARED_STATE_DIR", os.path.join("data", "shared"))
+    metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(shared_dir, "prometheus"))
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Files left by a previous run would be added to this run's counters
+    for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+        os.remove(path)
+
+
 def main():
     """Start the server with dynamic port allocation"""
+    parser = argparse.ArgumentParser(description="Start the AI Backend gateway")
+    parser.add_argument("--prod", action="store_true", help="No reload; run --workers processes")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: WORKERS, else one per CPU)")
+    args = parser.parse_args()
+
     settings = get_settings()
-    
+
     # Get available port
     port = settings.get_available_port()
-    
+    reload = settings.reload and not args.prod
+    workers = 1
+    if args.prod:
+        workers = max(1, args.workers or (settings.workers if settings.workers > 1 else os.cpu_count() or 1))
+        prepare_workers(workers)
+        if workers > 1 and not settings.routes_file:
+            print("⚠️  ROUTES_FILE is not set: /api/admin/routes changes only reach the worker that serves them")
+
     print(f"🚀 Starting AI Backend Server...")
     print(f"📍 Host: {settings.host}")
     print(f"🔌 Port: {port}")
     print(f"🌐 URL: http://{settings.host}:{port}")
     print(f"📊 API Docs: http://{settings.host}:{port}/docs")
-    print(f"🔧 Auto-reload: {settings.reload}")
+    print(f"🔧 Auto-reload: {reload}")
+    print(f"👷 Workers: {workers}")
     print(f"🐛 Debug mode: {settings.debug}")
     print("-" * 50)
-    
+
     try:
         uvicorn.run(
             "app.main:app",
             host=settings.host,
             port=port,
-            reload=settings.reload,
+            reload=reload,
+            workers=workers if workers > 1 else None,
             log_level=settings.log_level.lower(),
-            access_log=True,
+            # The gateway writes its own access log line per request
+            access_log=not args.prod,
+            # Streams end themselves at SHUTDOWN_DRAIN_SECONDS; cut anything else off shortly after
+            timeout_graceful_shutdown=int(settings.shutdown_drain_seconds) + 5,
         )
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
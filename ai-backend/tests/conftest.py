@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """App client backed by a fresh SQLite file with auth disabled."""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/test.db")
+    monkeypatch.setenv("AUTH_REQUIRED", "false")
+    from app.db import base
+
+    monkeypatch.setattr(base, "_engine", None)
+    monkeypatch.setattr(base, "SessionLocal", None)
+    from app.main import create_app
+
+    with TestClient(create_app()) as c:
+        yield c
+
+
+MOCK_MODEL = "mock/model"
+
+
+def sse_chunks(tokens: list[str], usage: dict | None = None) -> bytes:
+    """OpenAI-style SSE body: a role chunk, one chunk per token, an optional usage chunk, then [DONE]."""
+    import json
+
+    lines = [{"choices": [{"delta": {"role": "assistant"}}]}]
+    lines += [{"choices": [{"delta": {"content": t}}]} for t in tokens]
+    if usage:
+        lines.append({"choices": [], "usage": usage})
+    body = "".join(f"data: {json.dumps(x)}\n\n" for x in lines)
+    return (body + "data: [DONE]\n\n").encode("utf-8")
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    """Register a ``mock`` route served by an in-process httpx MockTransport.
+
+    Set ``handler`` on the returned object to override responses per test.
+    """
+    import httpx
+
+    from app.deps import route_registry
+
+    class Upstream:
+        route = "mock"
+        model = MOCK_MODEL
+        tokens = ["Hel", "lo"]
+        calls: list[httpx.Request] = []
+        handler = None
+
+        def default(self, request: httpx.Request) -> httpx.Response:
+            import json
+
+            if request.url.path.endswith("/models"):
+                return httpx.Response(200, json={"data": [{"id": self.model, "object": "model"}]})
+            body = json.loads(request.content)
+            if body.get("stream"):
+                usage = None
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    usage = {"prompt_tokens": 3, "completion_tokens": len(self.tokens), "total_tokens": 3 + len(self.tokens)}
+                return httpx.Response(
+                    200, content=sse_chunks(self.tokens, usage), headers={"content-type": "text/event-stream"}
+                )
+            return httpx.Response(
+                200,
+                json={
+                    "id": "cmpl-1",
+                    "choices": [{"message": {"role": "assistant", "content": "".join(self.tokens)}}],
+                    "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5},
+                },
+            )
+
+    upstream = Upstream()
+    upstream.calls = []
+
+    def dispatch(request: httpx.Request) -> httpx.Response:
+        upstream.calls.append(request)
+        return (upstream.handler or upstream.default)(request)
+
+    client = httpx.AsyncClient(base_url="http://mock/v1", transport=httpx.MockTransport(dispatch))
+    monkeypatch.setitem(route_registry.route_key_to_base_url, "mock", "http://mock/v1")
+    monkeypatch.setitem(route_registry._clients, "mock", client)
+    monkeypatch.setattr(route_registry, "_models_cache", {})
+    monkeypatch.setattr(route_registry, "_aggregate_models_cache", None)
+    return upstream
+
+
+@pytest.fixture
+def uds_upstream(tmp_path):
+    """Path of a unix socket served by ``benchmarks.mock_vllm`` (uvicorn in a background thread)."""
+    import threading
+    import time
+
+    import uvicorn
+
+    from benchmarks.mock_vllm import MockConfig, create_app
+
+    sock = str(tmp_path / "vllm.sock")
+    config = MockConfig(ttft_ms=0, tokens=4, tokens_per_sec=1000)
+    server = uvicorn.Server(uvicorn.Config(create_app(config), uds=sock, ws="none", log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started and time.monotonic() < deadline:
+        time.sleep(0.02)
+    yield sock
+    server.should_exit = True
+    thread.join(10)
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.apikeys import get_key_store, hash_key, parse_prefix, verify_key
+from app.config import get_settings
+
+
+@pytest.fixture
+def auth_client(client, monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "auth_required", True)
+    monkeypatch.setattr(settings, "api_key", "root-secret")
+    monkeypatch.setattr(settings, "api_key_hash_iterations", 1000)
+    return client
+
+
+ROOT = {"X-API-Key": "root-secret"}
+
+
+def test_hash_roundtrip():
+    stored = hash_key("gw_abc_secret", iterations=1000)
+    assert verify_key("gw_abc_secret", stored)
+    assert not verify_key("gw_abc_other", stored)
+    assert parse_prefix("gw_abc_secret") == "abc"
+    assert parse_prefix("sk-whatever") is None
+
+
+def test_issued_key_scopes_cache_and_revocation(auth_client):
+    r = auth_client.post("/api/admin/keys", json={"name": "team-a", "scopes": ["chat"]}, headers=ROOT)
+    assert r.status_code == 201
+    created = r.json()
+    key = {"X-API-Key": created["key"]}
+    assert "key_hash" not in created
+
+    store = get_key_store()
+    misses = store.misses
+    assert auth_client.get("/api/conversations", headers=key).status_code == 200
+    assert auth_client.get("/api/conversations", headers=key).status_code == 200
+    # Second request served from the cache: no DB lookup or hash verification
+    assert store.misses == misses + 1
+
+    r = auth_client.get("/api/backup/export", headers=key)
+    assert r.status_code == 403
+    assert r.json() == {"detail": "API key lacks scope 'admin'"}
+    assert auth_client.get("/api/admin/keys", headers=key).status_code == 403
+    assert auth_client.get("/api/conversations", headers={"X-API-Key": created["key"] + "x"}).status_code == 401
+
+    before = REGISTRY.get_sample_value("gateway_requests_total", {"key": "team-a", "status": "2xx"})
+    assert before and before >= 2
+
+    assert auth_client.delete(f"/api/admin/keys/{created['id']}", headers=ROOT).status_code == 200
+    assert auth_client.get("/api/conversations", headers=key).status_code == 401
+    listed = auth_client.get("/api/admin/keys", headers=ROOT).json()
+    assert listed[0]["revoked_at"] is not None
+
+
+def test_issued_keys_enable_auth_without_shared_key(auth_client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "api_key", None)
+    assert auth_client.get("/api/conversations").status_code == 200
+
+    store = get_key_store()
+    plaintext, _ = store.create_key("ops", ["*"], rate_limit_per_min=1)
+    store.clear()
+    assert auth_client.get("/api/conversations").status_code == 401
+
+    key = {"X-API-Key": plaintext}
+    assert auth_client.get("/api/conversations", headers=key).status_code == 200
+    # Per-key rate limit replaces the class default
+    assert auth_client.get("/api/conversations", headers=key).status_code == 429
+
+
+@pytest.fixture
+def priority_env(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_CLASSES", "default=2")
+    monkeypatch.setenv("RATE_LIMIT_PRIORITIES", "high=2,low=0.5")
+
+
+def test_key_priority_scales_rate_limit(priority_env, auth_client):
+    store = get_key_store()
+    high, _ = store.create_key("batch-high", ["*"], priority="high")
+    low, _ = store.create_key("batch-low", ["*"], priority="low")
+
+    codes = [auth_client.get("/api/conversations", headers={"X-API-Key": high}).status_code for _ in range(5)]
+    assert codes == [200, 200, 200, 200, 429]
+    codes = [auth_client.get("/api/conversations", headers={"X-API-Key": low}).status_code for _ in range(2)]
+    assert codes == [200, 429]
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import gzip
+import json
+
+
+def _seed(client) -> str:
+    conv_id = client.post("/api/conversations", json={"title": "backup"}).json()["id"]
+    for i in range(3):
+        r = client.post(
+            f"/api/conversations/{conv_id}/messages",
+            json={"role": "user", "content_text": f"message {i}"},
+        )
+        assert r.status_code == 200
+    return conv_id
+
+
+def _records(body: bytes) -> list[dict]:
+    return [json.loads(line) for line in body.splitlines() if line]
+
+
+def test_export_streams_ndjson(client):
+    conv_id = _seed(client)
+    r = client.get("/api/backup/export")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    records = _records(r.content)
+    assert records[0]["type"] == "header"
+    convs = [x["data"] for x in records if x["type"] == "conversation"]
+    msgs = [x["data"] for x in records if x["type"] == "message"]
+    assert [c["id"] for c in convs] == [conv_id]
+    assert len(msgs) == 3
+    assert "raw_request_gzip" not in msgs[0]
+
+
+def test_export_gzip_with_blobs(client):
+    _seed(client)
+    r = client.get("/api/backup/export", params={"compress": "gzip", "include_blobs": True, "batch_size": 1})
+    assert r.status_code == 200
+    records = _records(gzip.decompress(r.content))
+    msgs = [x["data"] for x in records if x["type"] == "message"]
+    assert len(msgs) == 3
+    assert "raw_request_gzip" in msgs[0]
+
+
+def test_import_round_trip_skips_existing(client):
+    conv_id = _seed(client)
+    export = client.get("/api/backup/export", params={"compress": "gzip", "include_blobs": True}).content
+
+    # Re-importing into the same store only skips
+    r = client.post(
+        "/api/backup/import",
+        content=export,
+        headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"},
+    )
+    assert r.status_code == 200
+    body = r.json()
+    assert body["imported"] == {"conversation": 0, "message": 0, "stream": 0}
+    assert body["skipped"]["message"] == 3
+
+    # After deleting, the import restores rows and the FTS index
+    assert client.delete(f"/api/conversations/{conv_id}").status_code == 200
+    r = client.post(
+        "/api/backup/import",
+        content=gzip.decompress(export),
+        headers={"Content-Type": "application/x-ndjson"},
+        params={"batch_size": 2},
+    )
+    assert r.status_code == 200
+    assert r.json()["imported"] == {"conversation": 1, "message": 3, "stream": 0}
+    assert len(client.get(f"/api/conversations/{conv_id}/messages").json()) == 3
+    hits = client.get("/api/search/messages", params={"q": "message"}).json()
+    assert len(hits) == 3
+
+
+def test_import_legacy_json_and_bad_ndjson(client):
+    payload = {
+        "conversations": [{"id": "c1", "title": "legacy", "created_at": "2025-01-01T00:00:00"}],
+        "messages": [{"id": "m1", "conversation_id": "c1", "content_text": "old"}],
+        "streams": [],
+    }
+    r = client.post("/api/backup/import", json=payload)
+    assert r.status_code == 200
+    assert r.json()["imported"]["message"] == 1
+
+    r = client.post(
+        "/api/backup/import", content=b'{"type": "header"}\nnot json\n', headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert r.status_code == 400
+
+
+def test_import_rejects_row_whose_parent_is_missing(client):
+    records = [
+        {"type": "conversation", "data": {"id": "c1"}},
+        {"type": "message", "data": {"id": "m1", "conversation_id": "c1", "content_text": "kept"}},
+        # Its parent only arrives in the next batch
+        {"type": "message", "data": {"id": "m2", "conversation_id": "c1", "parent_id": "m3"}},
+        {"type": "message", "data": {"id": "m3", "conversation_id": "c1"}},
+    ]
+    body = b"".join(json.dumps(r).encode() + b"\n" for r in records)
+    r = client.post(
+        "/api/backup/import", content=body, headers={"Content-Type": "application/x-ndjson"}, params={"batch_size": 3}
+    )
+    assert r.status_code == 400
+    detail = r.json()["detail"]
+    assert "message m2 references missing message m3" in detail["message"]
+    assert detail["progress"]["imported"]["message"] == 0
+    assert client.get("/api/conversations/c1/messages").status_code == 404
+
+
+def test_fts_triggers_only_suspended_for_large_imports(client):
+    from app.db.backup import BulkImporter
+    from app.db.base import get_engine
+
+    def triggers() -> int:
+        with get_engine().connect() as conn:
+            return conn.exec_driver_sql("SELECT count(*) FROM sqlite_master WHERE type = 'trigger'").scalar()
+
+    expected = triggers()
+    importer = BulkImporter(get_engine(), batch_size=2, fts_suspend_rows=3)
+    importer.add({"type": "conversation", "data": {"id": "c1"}})
+    importer.add({"type": "message", "data": {"id": "m1", "conversation_id": "c1", "content_text": "indexed"}})
+    importer.flush()
+    assert not importer.fts_suspended and triggers() == expected
+
+    importer.add({"type": "message", "data": {"id": "m2", "conversation_id": "c1", "content_text": "rebuilt"}})
+    importer.add({"type": "message", "data": {"id": "m3", "conversation_id": "c1", "content_text": "rebuilt"}})
+    importer.flush()
+    assert importer.fts_suspended and triggers() < expected
+    importer.restore_fts()
+    assert triggers() == expected
+    hits = client.get("/api/search/messages", params={"q": "indexed OR rebuilt"}).json()
+    assert len(hits) == 3
+
+
+def test_incremental_export_and_apply(client):
+    conv_id = _seed(client)
+    full = client.get("/api/backup/export").content
+    watermark = _records(full)[0]["watermark"]
+
+    msgs = client.get(f"/api/conversations/{conv_id}/messages").json()
+    r = client.patch(f"/api/conversations/{conv_id}/messages/{msgs[0]['id']}", json={"content_text": "edited"})
+    assert r.status_code == 200
+    assert client.delete(f"/api/conversations/{conv_id}/messages/{msgs[1]['id']}").status_code == 200
+
+    delta = client.get("/api/backup/export", params={"since": watermark}).content
+    records = _records(delta)
+    assert {x["type"] for x in records} >= {"header", "message", "delete"}
+    assert {"entity": "message", "id": msgs[1]["id"]}.items() <= next(
+        x["data"] for x in records if x["type"] == "delete"
+    ).items()
+
+    # Restore full backup into a clean store, then apply the delta on top
+    assert client.delete(f"/api/conversations/{conv_id}").status_code == 200
+    headers = {"Content-Type": "application/x-ndjson"}
+    assert client.post("/api/backup/import", content=full, headers=headers).status_code == 200
+    r = client.post("/api/backup/import", content=delta, headers=headers, params={"mode": "apply"})
+    assert r.status_code == 200
+    assert r.json()["deleted"] >= 1
+    restored = client.get(f"/api/conversations/{conv_id}/messages").json()
+    assert [m["content_text"] for m in restored] == ["edited", "message 2"]
+
+
+def test_apply_keeps_blobs_missing_from_the_export(client):
+    from app.db.base import get_session
+    from app.db.models import Message, MessageStream
+
+    conv_id = _seed(client)
+    msg_id = client.get(f"/api/conversations/{conv_id}/messages").json()[0]["id"]
+    db = get_session()
+    try:
+        db.query(Message).filter(Message.id == msg_id).update({"raw_request_gzip": gzip.compress(b"request")})
+        db.add(MessageStream(id="s1", message_id=msg_id, raw_sse_gzip=gzip.compress(b"data: x")))
+        db.commit()
+    finally:
+        db.close()
+    export = client.get("/api/backup/export").content
+    assert b"raw_request_gzip" not in export
+
+    r = client.post(
+        "/api/backup/import", content=export, headers={"Content-Type": "application/x-ndjson"}, params={"mode": "apply"}
+    )
+    assert r.status_code == 200
+    db = get_session()
+    try:
+        assert gzip.decompress(db.get(Message, msg_id).raw_request_gzip) == b"request"
+        assert gzip.decompress(db.get(MessageStream, "s1").raw_sse_gzip) == b"data: x"
+    finally:
+        db.close()
+
+
+def test_snapshot_streams_and_writes_target(client, tmp_path, monkeypatch):
+    import sqlite3
+
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "backup_dir", str(tmp_path / "backups"))
+    _seed(client)
+
+    r = client.post("/api/backup/snapshot", params={"compress": "gzip", "pages": 1})
+    assert r.status_code == 200
+    assert int(r.headers["X-Snapshot-Pages"]) > 0
+    snap = tmp_path / "snap.db"
+    snap.write_bytes(gzip.decompress(r.content))
+    with sqlite3.connect(snap) as conn:
+        assert conn.execute("SELECT count(*) FROM messages").fetchone()[0] == 3
+
+    r = client.post("/api/backup/snapshot", params={"target": "../nightly.db"})
+    assert r.status_code == 200
+    assert r.json()["path"] == str(tmp_path / "backups" / "nightly.db")
+    assert sorted(p.name for p in (tmp_path / "backups").iterdir()) == ["nightly.db"]
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import os
+import sqlite3
 
+import httpx
+from conftest import sse_chunks
 from fastapi.testclient import TestClient
 
 from app.main import create_app
@@ -13,3 +16,58 @@ def test_chat_requires_api_key_when_configured(monkeypatch):
     client = TestClient(app)
     resp = client.post("/api/chat", json={"message": "hi"})
     assert resp.status_code == 401
+
+
+def test_stream_assembler_collects_content_and_usage():
+    from app.utils.sse import HEARTBEAT_COMMENT, StreamAssembler
+
+    assembler = StreamAssembler()
+    lines = sse_chunks(["Hel", "lo"], usage={"prompt_tokens": 3, "completion_tokens": 2}).split(b"\n\n")
+    for line in [HEARTBEAT_COMMENT.encode(), *lines]:
+        if line:
+            assembler.feed(line + b"\n")
+    assert assembler.text == "Hello"
+    assert assembler.usage == {"prompt_tokens": 3, "completion_tokens": 2}
+    # Role, two content, usage and [DONE] lines are kept raw; the heartbeat is not
+    assert len(assembler.raw_lines) == 5
+
+
+def test_chat_persists_only_after_upstream_succeeds(client, mock_upstream, tmp_path):
+    from app.db.base import get_session
+    from app.db.models import Conversation, Message
+
+    statuses = [503, 200]
+    locked = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/models"):
+            return mock_upstream.default(request)
+        # Nothing may hold the SQLite write lock while the upstream call is in progress
+        conn = sqlite3.connect(tmp_path / "test.db", timeout=0)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            locked.append(request)
+        finally:
+            conn.close()
+        status = statuses.pop(0)
+        return mock_upstream.default(request) if status == 200 else httpx.Response(status, text="overloaded")
+
+    mock_upstream.handler = handler
+    r = client.post("/api/chat", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 502
+    assert r.json()["detail"] == "Upstream error: 503"
+    db = get_session()
+    try:
+        assert db.query(Message).count() == 0 and db.query(Conversation).count() == 0
+    finally:
+        db.close()
+
+    r = client.post("/api/chat", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 200
+    db = get_session()
+    try:
+        assert sorted(m.role for m in db.query(Message).all()) == ["assistant", "user"]
+    finally:
+        db.close()
+    assert locked == []
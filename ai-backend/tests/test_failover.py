@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import httpx
+import pytest
+from conftest import sse_chunks
+
+from app.config import get_settings
+from app.routing.failover import RetryBudget
+
+
+@pytest.fixture
+def replicas(mock_upstream, monkeypatch):
+    """A second route, ``mock2``, serving the same model through the same handler."""
+    from app.deps import route_registry
+
+    def dispatch(request: httpx.Request) -> httpx.Response:
+        request.extensions["route"] = "mock2"
+        mock_upstream.calls.append(request)
+        return (mock_upstream.handler or mock_upstream.default)(request)
+
+    client = httpx.AsyncClient(base_url="http://mock2/v1", transport=httpx.MockTransport(dispatch))
+    monkeypatch.setitem(route_registry.route_key_to_base_url, "mock2", "http://mock2/v1")
+    monkeypatch.setitem(route_registry._clients, "mock2", client)
+    return mock_upstream
+
+
+def route_of(request: httpx.Request) -> str:
+    return request.extensions.get("route", "mock")
+
+
+def assistant_message():
+    from app.db.base import get_session
+    from app.db.models import Message
+
+    db = get_session()
+    try:
+        return db.query(Message).filter(Message.role == "assistant").one()
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("failure", ["error", "ttft_timeout"])
+def test_stream_fails_over_before_first_token(replicas, client, monkeypatch, failure):
+    monkeypatch.setattr(get_settings(), "stream_ttft_timeout_seconds", 0.3)
+    attempts = []
+
+    async def stalled():
+        yield b'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+        await asyncio.sleep(30)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/models"):
+            return replicas.default(request)
+        attempts.append(route_of(request))
+        if len(attempts) > 1:
+            return replicas.default(request)
+        if failure == "error":
+            return httpx.Response(503)
+        return httpx.Response(200, content=stalled(), headers={"content-type": "text/event-stream"})
+
+    replicas.handler = handler
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": replicas.model})
+    assert r.status_code == 200
+    # Only the attempt that answered reached the client: one role chunk, no error event
+    assert r.text.count('"role"') == 1 and "event: error" not in r.text
+
+    assert len(attempts) == 2 and attempts[0] != attempts[1]
+    msg = assistant_message()
+    assert msg.content_text == "Hello"
+    assert msg.model_key == attempts[1]
+    assert [(f["route"], f["reason"]) for f in msg.failovers] == [(attempts[0], failure)]
+    if failure == "ttft_timeout":
+        assert msg.failovers[0]["after_ms"] >= 300
+
+
+def test_pinned_route_does_not_fail_over(replicas, client):
+    replicas.handler = lambda request: (
+        replicas.default(request) if request.url.path.endswith("/models") else httpx.Response(503)
+    )
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": replicas.model, "modelKey": "mock2"})
+    assert "event: error" in r.text
+    assert [route_of(c) for c in replicas.calls if c.url.path.endswith("/chat/completions")] == ["mock2"]
+
+
+def test_failover_releases_in_flight_slots(client, mock_upstream, monkeypatch):
+    from app.deps import route_registry
+
+    attempts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        # Open streams, as a real transport returns, so closing them is what releases the slot
+        if request.url.path.endswith("/models"):
+            body = json.dumps({"data": [{"id": mock_upstream.model, "object": "model"}]}).encode()
+            return httpx.Response(200, stream=httpx.ByteStream(body))
+        attempts.append(request.url.host)
+        if len(attempts) == 1:
+            return httpx.Response(503, stream=httpx.ByteStream(b"overloaded"))
+        body = sse_chunks(["Hel", "lo"])
+        return httpx.Response(200, stream=httpx.ByteStream(body), headers={"content-type": "text/event-stream"})
+
+    # Built like configured routes so requests pass through the in-flight counter
+    for key in ("mock", "mock2"):
+        counted = route_registry._make_client(f"http://{key}/v1")
+        route_registry._counters[counted].inner = httpx.MockTransport(handler)
+        monkeypatch.setitem(route_registry.route_key_to_base_url, key, f"http://{key}/v1")
+        monkeypatch.setitem(route_registry._clients, key, counted)
+    monkeypatch.setattr(route_registry, "_models_cache", {})
+    monkeypatch.setattr(route_registry, "_aggregate_models_cache", None)
+
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": mock_upstream.model})
+    assert r.status_code == 200 and "[DONE]" in r.text
+    assert len(attempts) == 2 and attempts[0] != attempts[1]
+    assert route_registry.in_flight("mock") == route_registry.in_flight("mock2") == 0
+
+
+def test_relay_survives_pauses_between_tokens(client, mock_upstream):
+    async def slow():
+        for line in sse_chunks(["Hel", "lo"]).split(b"\n\n"):
+            await asyncio.sleep(0.25)
+            yield line + b"\n\n"
+
+    mock_upstream.handler = lambda request: (
+        mock_upstream.default(request)
+        if request.url.path.endswith("/models")
+        else httpx.Response(200, content=slow(), headers={"content-type": "text/event-stream"})
+    )
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": mock_upstream.model})
+    assert "[DONE]" in r.text
+    assert assistant_message().content_text == "Hello"
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, min_retries=1)
+    assert budget.available()
+    budget.spend()
+    assert not budget.available()
+    for _ in range(4):
+        budget.record_request()
+    assert budget.available()
+    budget.spend()
+    assert not budget.available()
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import json
+
+import httpx
+import pytest
+
+from app.config import get_settings
+
+SMALL_MODEL = "tiny-model"
+
+
+@pytest.fixture
+def fallback_route(mock_upstream, client, monkeypatch):
+    """A ``small`` route serving ``tiny-model``, configured as the fallback of the mock model."""
+    from app.deps import route_registry
+    from app.routing import fallback
+
+    def dispatch(request: httpx.Request) -> httpx.Response:
+        request.extensions["route"] = "small"
+        mock_upstream.calls.append(request)
+        if request.url.path.endswith("/models"):
+            return httpx.Response(200, json={"data": [{"id": SMALL_MODEL, "object": "model"}]})
+        return mock_upstream.default(request)
+
+    client = httpx.AsyncClient(base_url="http://small/v1", transport=httpx.MockTransport(dispatch))
+    monkeypatch.setitem(route_registry.route_key_to_base_url, "small", "http://small/v1")
+    monkeypatch.setitem(route_registry._clients, "small", client)
+    monkeypatch.setattr(get_settings(), "fallback_models", f"{mock_upstream.model}>{SMALL_MODEL}")
+    monkeypatch.setattr(fallback, "_ttft_ewma", {})
+    return mock_upstream
+
+
+def mark_down(monkeypatch, *route_keys: str) -> None:
+    from app.healthcheck import get_health_checker
+
+    checker = get_health_checker()
+    monkeypatch.setattr(checker, "status", lambda key: "unavailable" if key in route_keys else "ok")
+
+
+def chat_requests(upstream):
+    return [r for r in upstream.calls if r.url.path.endswith("/chat/completions")]
+
+
+def test_no_fallback_while_requested_model_is_healthy(fallback_route, client):
+    r = client.post("/api/chat", json={"message": "hi", "model": fallback_route.model})
+    assert r.status_code == 200
+    assert "x-model-fallback" not in r.headers
+    (sent,) = chat_requests(fallback_route)
+    assert sent.extensions.get("route", "mock") == "mock"
+
+
+def test_falls_back_when_no_replica_is_up(fallback_route, client, monkeypatch):
+    from app.db.base import get_session
+    from app.db.models import Message
+
+    mark_down(monkeypatch, "mock")
+    r = client.post("/api/chat", json={"message": "hi", "model": fallback_route.model})
+    assert r.status_code == 200
+    assert r.headers["x-model-fallback"] == SMALL_MODEL
+    assert r.headers["x-requested-model"] == fallback_route.model
+    assert r.headers["x-model-fallback-reason"] == "unavailable"
+
+    (sent,) = chat_requests(fallback_route)
+    assert sent.extensions["route"] == "small"
+    assert json.loads(sent.content)["model"] == SMALL_MODEL
+    db = get_session()
+    try:
+        assert {m.model for m in db.query(Message).all()} == {SMALL_MODEL}
+    finally:
+        db.close()
+
+
+def test_stream_falls_back_on_queue_depth_and_latency(fallback_route, client, monkeypatch):
+    from app.deps import route_registry
+    from app.routing.fallback import observe_ttft
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "fallback_max_in_flight", 2)
+    monkeypatch.setattr(route_registry, "in_flight", lambda key: 2 if key == "mock" else 0)
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": fallback_route.model})
+    assert r.status_code == 200 and "Hel" in r.text
+    assert r.headers["x-model-fallback"] == SMALL_MODEL
+    assert r.headers["x-model-fallback-reason"] == "queue_depth"
+
+    monkeypatch.setattr(settings, "fallback_max_in_flight", 0)
+    monkeypatch.setattr(settings, "fallback_ttft_slo_ms", 500)
+    observe_ttft("mock", 2.0)
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": fallback_route.model})
+    assert r.headers["x-model-fallback-reason"] == "latency_slo"
+
+    # Pinning a route with modelKey opts out of fallback
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": fallback_route.model, "modelKey": "mock"})
+    assert "x-model-fallback" not in r.headers
+
+
+def test_primary_gets_traffic_back_once_its_latency_average_expires(fallback_route, client, monkeypatch):
+    from app.routing import fallback
+
+    settings = get_settings()
+    monkeypatch.setattr(settings, "fallback_ttft_slo_ms", 500)
+    monkeypatch.setattr(settings, "fallback_ttft_max_age_seconds", 30)
+    now = [1000.0]
+    monkeypatch.setattr(fallback, "_clock", lambda: now[0])
+
+    fallback.observe_ttft("mock", 2.0)
+    r = client.post("/api/chat", json={"message": "hi", "model": fallback_route.model})
+    assert r.headers["x-model-fallback-reason"] == "latency_slo"
+
+    # No new samples reach the primary while it is bypassed; its average expires instead
+    now[0] += 31
+    r = client.post("/api/chat", json={"message": "hi", "model": fallback_route.model})
+    assert "x-model-fallback" not in r.headers
+    assert chat_requests(fallback_route)[-1].extensions.get("route", "mock") == "mock"
+
+    # Fresh samples from the recovered primary keep it in use
+    fallback.observe_ttft("mock", 0.1)
+    r = client.post("/api/chat", json={"message": "hi", "model": fallback_route.model})
+    assert "x-model-fallback" not in r.headers
+
+
+def test_keeps_requested_model_when_whole_chain_is_overloaded(fallback_route, client, monkeypatch):
+    mark_down(monkeypatch, "mock", "small")
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": fallback_route.model})
+    assert "x-model-fallback" not in r.headers
+    (sent,) = chat_requests(fallback_route)
+    assert sent.extensions.get("route", "mock") == "mock"
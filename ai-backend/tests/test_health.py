@@ -12,3 +12,34 @@ def test_health_public():
     data = resp.json()
     assert data.get("ok") is True
     assert "vllm" in data
+
+
+def test_probes_read_cached_route_state(mock_upstream, client):
+    import time
+
+    import httpx
+
+    from app.healthcheck import get_health_checker
+
+    checker = get_health_checker()
+    deadline = time.monotonic() + 5
+    while checker.status("mock") != "ok" and time.monotonic() < deadline:
+        time.sleep(0.02)
+    models_calls = sum(r.url.path.endswith("/models") for r in mock_upstream.calls)
+
+    for _ in range(10):
+        assert client.get("/health").status_code == 200
+        assert client.get("/livez").json() == {"ok": True}
+        client.get("/readyz")
+    # Probes never reach the upstream
+    assert sum(r.url.path.endswith("/models") for r in mock_upstream.calls) == models_calls
+    state = client.get("/health").json()["routes"]["mock"]
+    assert state["status"] == "ok"
+    assert state["last_success"] and state["latency_ms"] is not None
+
+    mock_upstream.handler = lambda request: httpx.Response(503)
+    client.portal.call(checker.check_all)
+    state = client.get("/readyz").json()["routes"]["mock"]
+    assert state["status"] == "unavailable"
+    assert state["consecutive_failures"] == 1
+    assert state["last_success"] is not None
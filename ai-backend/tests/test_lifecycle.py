@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+from app import lifecycle as lifecycle_module
+from app.deps import route_registry
+from app.lifecycle import Lifecycle, get_lifecycle
+
+
+def wait_until(check, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_ready_once_catalog_loads_and_pools_close_on_shutdown(mock_upstream, tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path}/test.db")
+    monkeypatch.setenv("AUTH_REQUIRED", "false")
+    monkeypatch.setattr(lifecycle_module, "_CATALOG_RETRY_SECONDS", 0.05)
+    from app.db import base
+
+    monkeypatch.setattr(base, "_engine", None)
+    monkeypatch.setattr(base, "SessionLocal", None)
+    state = {"up": False}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if not state["up"]:
+            return httpx.Response(503)
+        return mock_upstream.default(request)
+
+    mock_upstream.handler = handler
+    upstream_client = route_registry._clients["mock"]
+    from app.main import create_app
+
+    with TestClient(create_app()) as client:
+        assert client.get("/readyz").status_code == 503
+        state["up"] = True
+        assert wait_until(lambda: client.get("/readyz").status_code == 200)
+        # Warm-up opened the pool before the catalog was fetched
+        assert sum(r.url.path.endswith("/models") for r in mock_upstream.calls) >= 3
+        assert client.get("/api/conversations").status_code == 200
+
+    assert upstream_client.is_closed
+    assert route_registry._clients == {}
+
+
+def test_drain_refuses_new_work_but_keeps_probes(client):
+    lifecycle = get_lifecycle()
+    lifecycle.begin_drain()
+
+    r = client.get("/api/conversations")
+    assert r.status_code == 503
+    assert r.headers["connection"] == "close"
+    r = client.get("/readyz")
+    assert r.status_code == 503
+    assert r.json()["draining"] is True
+    assert client.get("/health").status_code == 200
+
+
+def test_wait_for_streams_gives_up_at_the_deadline():
+    lifecycle = Lifecycle(drain_seconds=0.1)
+    lifecycle.stream_opened()
+    lifecycle.stream_opened()
+    lifecycle.stream_closed()
+    lifecycle.begin_drain()
+    assert not lifecycle.drain_expired
+
+    assert asyncio.run(lifecycle.wait_for_streams()) == 1
+    assert lifecycle.drain_expired
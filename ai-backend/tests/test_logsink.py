@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import io
+import json
+import sys
+
+import pytest
+
+from app.logsink import LogSink, RequestSampler, configure_logging, get_sink
+from tests.test_middleware import gateway
+
+
+@pytest.fixture
+def log_buffer():
+    buf = io.StringIO()
+    configure_logging(stream=buf)
+    yield buf
+    configure_logging(stream=sys.stdout)
+
+
+def request_lines(buf: io.StringIO) -> list[dict]:
+    get_sink().flush()
+    lines = [json.loads(line) for line in buf.getvalue().splitlines() if line.strip()]
+    return [line for line in lines if line.get("event") == "request"]
+
+
+def test_sink_writes_on_background_thread():
+    buf = io.StringIO()
+    sink = LogSink(buf, max_queue=100)
+    for i in range(10):
+        sink.put({"event": "x", "i": i})
+    sink.flush()
+    assert [json.loads(line)["i"] for line in buf.getvalue().splitlines()] == list(range(10))
+    sink.close()
+    assert not sink._thread.is_alive()
+
+
+def test_sampler_keeps_errors_and_slow_requests():
+    sampler = RequestSampler(default_rate=0.0, rates={"/api/chat": 1.0, "/api/chat/stream": 0.0}, slow_ms=500)
+    assert sampler.keep("/api/models", 200, 10) is None
+    assert sampler.keep("/api/models", 500, 10) == 1.0
+    assert sampler.keep("/api/models", 200, 600) == 1.0
+    assert sampler.keep("/api/chat", 200, 10) == 1.0
+    # Longest prefix wins
+    assert sampler.keep("/api/chat/stream", 200, 10) is None
+
+
+def test_request_log_carries_stream_fields(log_buffer, client, mock_upstream):
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 200
+
+    (line,) = [line for line in request_lines(log_buffer) if line["path"] == "/api/chat/stream"]
+    assert line["route_key"] == "mock"
+    assert line["model"] == mock_upstream.model
+    assert line["stream_chunks"] == 2
+    assert line["prompt_tokens"] == 3
+    assert line["ttft_ms"] is not None
+    assert line["level"] == "info" and line["timestamp"]
+
+
+def test_successful_requests_are_sampled(log_buffer, client):
+    gateway(client).sampler = RequestSampler(default_rate=0.0)
+    assert client.get("/api/conversations").status_code == 200
+    assert client.get("/api/conversations/missing").status_code == 404
+
+    paths = [(line["path"], line["status"]) for line in request_lines(log_buffer)]
+    assert paths == [("/api/conversations/missing", 404)]
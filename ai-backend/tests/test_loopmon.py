@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import asyncio
+import gzip
+import time
+
+from app.loopmon import LoopMonitor, bind_request, current_request_id, install_blocking_detector
+from app.metrics import BLOCKING_CALLS, EVENT_LOOP_LAG
+
+
+def blocking_handler() -> None:
+    time.sleep(0.3)
+
+
+def test_blocked_loop_is_reported_with_stack_and_request_id():
+    async def scenario():
+        monitor = LoopMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            token = bind_request("req-123")
+
+            async def child():
+                # Streaming bodies run in tasks created by the request task
+                blocking_handler()
+
+            await asyncio.create_task(child())
+            current_request_id.reset(token)
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+        return list(monitor.reports)
+
+    lag_before = EVENT_LOOP_LAG._sum.get()
+    reports = asyncio.run(scenario())
+    assert len(reports) == 1
+    (report,) = reports
+    assert report["request_id"] == "req-123"
+    assert report["blocked_ms"] >= 100
+    assert any("blocking_handler" in line for line in report["stack"])
+    assert EVENT_LOOP_LAG._sum.get() - lag_before >= 0.2
+
+
+def test_blocking_detector_flags_calls_on_the_loop_only():
+    install_blocking_detector()
+    counter = BLOCKING_CALLS.labels("gzip")
+    before = counter._value.get()
+
+    gzip.compress(b"off the loop")
+    assert counter._value.get() == before
+
+    async def on_loop():
+        gzip.compress(b"on the loop")
+        await asyncio.to_thread(gzip.compress, b"worker thread")
+
+    asyncio.run(on_loop())
+    assert counter._value.get() == before + 1
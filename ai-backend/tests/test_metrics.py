@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from prometheus_client import REGISTRY
+
+from app.metrics import BoundedLabel, is_content_chunk
+
+
+def _sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_content_chunk_detection():
+    assert is_content_chunk(b'data: {"choices":[{"delta":{"content":"hi"}}]}\n')
+    assert is_content_chunk(b'data: {"choices": [{"delta": {"content": "hi"}}]}\n')
+    assert not is_content_chunk(b'data: {"choices":[{"delta":{"role":"assistant","content":""}}]}\n')
+    assert not is_content_chunk(b'data: {"choices":[{"delta":{"content":null}}]}\n')
+    assert not is_content_chunk(b"data: [DONE]\n")
+    assert not is_content_chunk(b": keepalive\n")
+
+
+def test_bounded_label_caps_cardinality():
+    label = BoundedLabel(2)
+    assert [label(v) for v in ("a", "b", "c", "a")] == ["a", "b", "other", "a"]
+
+
+def test_stream_records_token_metrics(client, mock_upstream):
+    labels = {"route": "mock", "model": mock_upstream.model}
+    ttft_before = _sample("gateway_time_to_first_token_seconds_count", **labels)
+    tokens_before = _sample("gateway_stream_tokens_total", **labels)
+
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 200
+
+    assert _sample("gateway_time_to_first_token_seconds_count", **labels) == ttft_before + 1
+    assert _sample("gateway_stream_tokens_total", **labels) == tokens_before + 2
+    assert _sample("gateway_inflight_streams", **labels) == 0
+    assert _sample(
+        "gateway_upstream_requests_total", endpoint="chat_stream", outcome="ok", **labels
+    ) >= 1
+    assert "gateway_time_to_first_token_seconds" in client.get("/metrics").text
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from app.config import get_settings
+from app.middleware.pipeline import GatewayMiddleware
+from app.middleware.ratelimit import InMemoryBucket
+
+
+def gateway(client) -> GatewayMiddleware:
+    layer = client.app.middleware_stack
+    while not isinstance(layer, GatewayMiddleware):
+        layer = layer.app
+    return layer
+
+
+def test_rejections_are_clean_json(client, monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "auth_required", True)
+    monkeypatch.setattr(settings, "api_key", "secret")
+
+    r = client.get("/api/conversations")
+    assert r.status_code == 401
+    assert r.json() == {"detail": "Missing or invalid API key"}
+    assert r.headers["X-Request-Id"]
+
+    r = client.get("/api/conversations", headers={"X-API-Key": "secret", "X-Request-Id": "req-1"})
+    assert r.status_code == 200
+    assert r.headers["X-Request-Id"] == "req-1"
+
+    assert client.get("/health").status_code == 200
+    assert client.get("/livez").status_code == 200
+    assert client.get("/api/readyz").status_code in (200, 503)
+
+
+def test_rate_limit_returns_429(client):
+    limiter = gateway(client).limiter
+    limiter.limits.update({"default": 1, "chat": 2})
+
+    assert client.get("/api/conversations").status_code == 200
+    r = client.get("/api/conversations")
+    assert r.status_code == 429
+    assert r.json() == {"detail": "Rate limit exceeded"}
+    assert int(r.headers["Retry-After"]) >= 1
+
+    # Separate budget per endpoint class; health and metrics are never limited
+    assert client.get("/api/models").status_code == 429
+    assert client.post("/api/chat", json={}).status_code != 429
+    assert client.post("/api/chat", json={}).status_code != 429
+    assert client.post("/api/chat", json={}).status_code == 429
+    for _ in range(3):
+        assert client.get("/health").status_code == 200
+        assert client.get("/metrics").status_code != 429
+
+
+def test_rate_limit_keys_by_api_key(client):
+    limiter = gateway(client).limiter
+    limiter.limits["default"] = 1
+    limiter.key_parts = ["api_key"]
+
+    assert client.get("/api/conversations", headers={"X-API-Key": "a"}).status_code == 200
+    assert client.get("/api/conversations", headers={"X-API-Key": "a"}).status_code == 429
+    assert client.get("/api/conversations", headers={"X-API-Key": "b"}).status_code == 200
+
+
+def test_memory_limit_is_split_across_workers(client):
+    limiter = gateway(client).limiter
+    limiter.limits["default"] = 4
+    limiter.workers = 2
+
+    assert client.get("/api/conversations").status_code == 200
+    assert client.get("/api/conversations").status_code == 200
+    assert client.get("/api/conversations").status_code == 429
+
+
+def test_bucket_memory_is_bounded():
+    bucket = InMemoryBucket(capacity=2, refill_per_second=1000.0, max_keys=64, shards=4)
+    for i in range(1000):
+        assert bucket.allow(f"ip-{i}")
+    assert len(bucket) <= 64
+    assert bucket.evicted_idle + bucket.evicted_lru >= 1000 - 64
+
+    # Refilled keys are evicted first; active keys keep their state
+    slow = InMemoryBucket(capacity=1, refill_per_second=1e-6, max_keys=4, shards=1)
+    assert slow.allow("hot")
+    assert not slow.allow("hot")
+    for i in range(3):
+        slow.allow(f"cold-{i}")
+    assert not slow.allow("hot")
+
+
+def test_stream_passes_through(client, mock_upstream):
+    with client.stream(
+        "POST", "/api/chat/stream", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"}
+    ) as r:
+        assert r.status_code == 200
+        assert r.headers["X-Request-Id"]
+        body = b"".join(r.iter_bytes())
+    assert b'"content": "Hel"' in body
+    assert b"[DONE]" in body
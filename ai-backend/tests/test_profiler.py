@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.loopmon import bind_request, current_request_id
+from app.profiler import RequestProfiler, profile_process, render_folded
+
+
+def spin(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_process_profile_samples_other_threads_as_folded_stacks():
+    worker = threading.Thread(target=spin, args=(0.3,), name="busy-worker")
+    worker.start()
+    counts = profile_process(0.2, interval=0.005)
+    worker.join()
+
+    folded = render_folded(counts)
+    busy = [line for line in folded.splitlines() if line.startswith("thread:busy-worker;")]
+    assert busy and any(";spin (" in line for line in busy)
+    stack, count = busy[0].rsplit(" ", 1)
+    assert int(count) >= 1
+    # The sampling thread itself is left out
+    assert "profile_process (" not in folded
+
+
+def test_armed_and_slow_requests_are_captured_on_the_loop():
+    async def handle(profiler: RequestProfiler, request_id: str, path: str, model: str, seconds: float):
+        profiler.begin(request_id, path)
+        token = bind_request(request_id)
+        started = time.perf_counter()
+
+        async def body():
+            # Streaming bodies run in tasks created by the request task
+            spin(seconds)
+
+        await asyncio.create_task(body())
+        current_request_id.reset(token)
+        return profiler.end(request_id, path, model, 200, int((time.perf_counter() - started) * 1000))
+
+    async def scenario():
+        profiler = RequestProfiler(interval=0.005, slow_ms=150, max_captures=2)
+        profiler.start()
+        try:
+            profiler.arm(1, path_prefix="/api/chat", model="m1")
+            reasons = [
+                await handle(profiler, "other-model", "/api/chat", "m2", 0.05),
+                await handle(profiler, "selected", "/api/chat", "m1", 0.05),
+                await handle(profiler, "after-count", "/api/chat", "m1", 0.05),
+                await handle(profiler, "slow", "/api/models", "m1", 0.2),
+            ]
+        finally:
+            await profiler.stop()
+        return profiler, reasons
+
+    profiler, reasons = asyncio.run(scenario())
+    assert reasons == [None, "requested", None, "slow"]
+    assert profiler.armed() is None
+    assert [c["request_id"] for c in profiler.recent()] == ["slow", "selected"]
+    capture = profiler.get("slow")
+    assert capture["samples"] >= 5
+    leaf = [stack.split(";")[-2:] for stack in capture["stacks"]]
+    assert any(caller.startswith("body (") and fn.startswith("spin (tests") for caller, fn in leaf)
+
+
+
+@pytest.fixture
+def profiler_env(monkeypatch):
+    monkeypatch.setenv("PROFILER_ENABLED", "true")
+
+
+@pytest.fixture
+def profiler_client(profiler_env, client):
+    return client
+
+
+def test_profile_endpoints_are_off_unless_enabled(client):
+    assert client.get("/api/admin/profile", params={"seconds": 0.05}).status_code == 404
+    assert client.get("/api/admin/profile/requests").status_code == 404
+
+
+def test_profile_endpoints_when_enabled(profiler_client):
+    r = profiler_client.get("/api/admin/profile", params={"seconds": 0.05})
+    assert r.status_code == 200
+    assert profiler_client.get("/api/admin/profile/requests").json()["captures"] == []
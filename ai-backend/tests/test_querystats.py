@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from sqlalchemy import create_engine, text
+
+from app.db.querystats import QueryStats, normalize_sql
+
+
+def test_normalize_sql_strips_literals_and_in_lists():
+    a = normalize_sql("SELECT * FROM messages WHERE id IN (?, ?, ?) AND role = 'user'  LIMIT 10")
+    b = normalize_sql("SELECT *\n FROM messages WHERE id IN (?, ?) AND role = 'assistant' LIMIT 50")
+    assert a == b == "SELECT * FROM messages WHERE id IN (?...) AND role = ? LIMIT ?"
+    assert normalize_sql("SELECT anon_1.x FROM messages_fts") == "SELECT anon_1.x FROM messages_fts"
+
+
+def test_statements_are_timed_and_slow_ones_get_a_query_plan(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'q.db'}")
+    stats = QueryStats(slow_ms=0.0)
+    stats.install(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("CREATE INDEX ix_items_name ON items (name)"))
+        for i in range(3):
+            conn.execute(text("INSERT INTO items (name) VALUES (:n)"), {"n": f"item-{i}"})
+        conn.execute(text("SELECT id FROM items WHERE name = :n"), {"n": "item-1"})
+
+    top = stats.top(order="count")
+    insert = top[0]
+    assert insert["sql"] == "INSERT INTO items (name) VALUES (?)"
+    assert insert["count"] == 3 and insert["total_ms"] >= insert["max_ms"] > 0
+    (select,) = [e for e in top if e["operation"] == "SELECT"]
+    assert select["slow"] == 1
+    assert any("ix_items_name" in line for line in select["plan"])
+    # DDL is timed but never explained
+    assert all(e["plan"] is None for e in top if e["operation"] == "CREATE")
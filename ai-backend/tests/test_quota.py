@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.db.base import get_session
+from app.db.models import Message, TokenUsage
+from app.quota import IDLE_USAGE_SECONDS, QuotaManager, estimate_chat_tokens, get_quota_manager
+
+
+@pytest.fixture
+def quota_env(monkeypatch):
+    monkeypatch.setenv("QUOTA_ENABLE", "true")
+    monkeypatch.setenv("QUOTA_TPM", "40")
+    monkeypatch.setenv("QUOTA_FLUSH_SECONDS", "3600")
+
+
+@pytest.fixture
+def quota_client(quota_env, client):
+    return client
+
+
+def test_reservation_and_settlement():
+    quota = QuotaManager(tpm=100, daily=150)
+    r1 = quota.reserve("key:a", "m", 60)
+    with pytest.raises(HTTPException) as exc:
+        quota.reserve("key:a", "m", 60)
+    assert exc.value.status_code == 429
+    assert "per minute" in exc.value.detail
+    # Other subjects and models have their own budget
+    quota.release(quota.reserve("key:b", "m", 60))
+    quota.settle(r1, 5, 5)
+    quota.settle(quota.reserve("key:a", "m", 60), 70, 10)
+    # 90 used today; another 61 would break the daily quota even in a new minute
+    quota._usage[("key:a", "m")].minute_tokens = 0
+    quota._usage[("key:a", "m")].prev_minute_tokens = 0
+    with pytest.raises(HTTPException) as exc:
+        quota.reserve("key:a", "m", 61)
+    assert "daily" in exc.value.detail
+    assert [d["requests"] for d in quota.drain()] == [2]
+    assert quota.drain() == []
+
+
+def test_idle_counters_are_dropped_and_daily_total_reloaded(monkeypatch):
+    import app.quota as quota_module
+
+    quota = QuotaManager(daily=100)
+    quota.settle(quota.reserve("ip:a", "m", 10), 30, 10)
+    quota._persisted = True
+    assert [d["requests"] for d in quota.drain()] == [1]
+    assert ("ip:a", "m") in quota._usage  # kept until its delta is known to be written
+
+    quota._usage[("ip:a", "m")].last_used -= IDLE_USAGE_SECONDS + 1
+    assert quota.drain() == [] and quota._usage == {}
+    lookups = []
+
+    def stored_day_tokens(subject, model, day):
+        lookups.append((subject, model))
+        return 40 if subject == "ip:a" else 0
+
+    monkeypatch.setattr(quota_module, "_stored_day_tokens", stored_day_tokens)
+    # reserve itself never reads the database
+    quota.reserve("ip:a", "m", 61)
+    quota._usage.clear()
+
+    for _ in range(2):
+        asyncio.run(quota.ensure_loaded("ip:a", "m"))
+        asyncio.run(quota.ensure_loaded("ip:b", "m"))
+    # Looked up once per pair, an empty total included
+    assert lookups == [("ip:a", "m"), ("ip:b", "m")]
+    with pytest.raises(HTTPException):
+        quota.reserve("ip:a", "m", 61)
+    quota.reserve("ip:b", "m", 61)
+
+
+
+def test_workers_split_minute_quota_and_share_daily_totals(monkeypatch):
+    import app.quota as quota_module
+    from app.quota import QuotaFlusher
+
+    quota = QuotaManager(tpm=100, daily=1000, workers=2)
+    with pytest.raises(HTTPException):
+        quota.reserve("key:a", "m", 51)
+    reservation = quota.reserve("key:a", "m", 50)
+    quota.settle(reservation, 20, 10)
+
+    written = []
+    monkeypatch.setattr(quota_module, "write_usage", written.extend)
+    # Another worker has charged 600 more tokens by the time this one flushes
+    monkeypatch.setattr(quota_module, "_stored_totals", lambda day: {("key:a", "m"): 30 + 600})
+    asyncio.run(QuotaFlusher(quota, 3600).flush())
+    assert [d["requests"] for d in written] == [1]
+    (row,) = quota.snapshot("key:a")
+    assert row["tokens_today"] == 630
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    def __init__(self) -> None:
+        self.closed = False
+
+    async def __aiter__(self):
+        yield b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n'
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+def test_stream_dropped_before_body_is_read_releases_reservation(quota_client, mock_upstream):
+    upstream = _TrackedStream()
+    mock_upstream.handler = lambda request: (
+        mock_upstream.default(request)
+        if request.url.path.endswith("/models")
+        else httpx.Response(200, stream=upstream, headers={"content-type": "text/event-stream"})
+    )
+    body = json.dumps({"message": "hi", "model": mock_upstream.model, "modelKey": "mock"}).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/chat/stream",
+        "raw_path": b"/api/chat/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"host", b"testserver")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+        "state": dict(quota_client.app_state),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        # The client is gone before the response starts, so the body is never iterated
+        raise OSError("connection reset")
+
+    async def call():
+        with contextlib.suppress(Exception):
+            await quota_client.app(scope, receive, send)
+
+    quota_client.portal.call(call)
+    assert upstream.closed
+    assert [u.reserved for u in get_quota_manager()._usage.values()] == [0]
+
+
+def test_over_quota_request_never_reaches_upstream(quota_client, mock_upstream):
+    big = "x" * 400  # ~100 estimated tokens against a 40 TPM quota
+    r = quota_client.post("/api/chat", json={"message": big, "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 429
+    assert r.headers["Retry-After"]
+    assert mock_upstream.calls == [] or all(c.url.path.endswith("/models") for c in mock_upstream.calls)
+
+    r = quota_client.post("/api/chat/stream", json={"message": big, "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 429
+
+
+def test_streamed_usage_is_charged_and_flushed(quota_client, mock_upstream):
+    r = quota_client.post("/api/chat/stream", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 200
+    sent = [c for c in mock_upstream.calls if c.url.path.endswith("/chat/completions")][0]
+    assert b'"include_usage": true' in sent.content or b'"include_usage":true' in sent.content
+
+    r = quota_client.post("/api/chat", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 200
+
+    quota = get_quota_manager()
+    (row,) = quota.snapshot("ip:testclient")
+    assert row["tokens_today"] == 5 + 5
+
+    quota_client.__exit__(None, None, None)  # shutdown flushes counters
+    db = get_session()
+    try:
+        (usage,) = db.query(TokenUsage).all()
+        assert (usage.prompt_tokens, usage.completion_tokens, usage.requests) == (6, 4, 2)
+        streamed = db.query(Message).filter(Message.role == "assistant", Message.total_tokens == 5).count()
+        assert streamed == 2
+    finally:
+        db.close()
+
+
+def test_chat_estimate_counts_messages_and_max_tokens():
+    messages = [{"role": "system", "content": "x" * 8}, {"role": "user", "content": "y" * 4}]
+    assert estimate_chat_tokens(messages) == 2 + 1 + 8
+    assert estimate_chat_tokens(messages, max_tokens=100) == 111
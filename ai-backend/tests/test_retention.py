@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import gzip
+import json
+from datetime import datetime, timedelta
+
+
+def _age_conversation(conv_id: str, days: int) -> None:
+    from app.db.base import get_engine
+
+    old = datetime.utcnow() - timedelta(days=days)
+    with get_engine().begin() as conn:
+        conn.exec_driver_sql(
+            "UPDATE conversations SET created_at = ?, updated_at = ? WHERE id = ?", (old, old, conv_id)
+        )
+        conn.exec_driver_sql(
+            "UPDATE messages SET started_at = ?, updated_at = ?, raw_request_gzip = ? WHERE conversation_id = ?",
+            (old, old, gzip.compress(b"{}"), conv_id),
+        )
+
+
+def _conversation(client, title: str, pinned: bool = False) -> str:
+    conv_id = client.post("/api/conversations", json={"title": title}).json()["id"]
+    client.post(f"/api/conversations/{conv_id}/messages", json={"role": "user", "content_text": title})
+    if pinned:
+        client.patch(f"/api/conversations/{conv_id}", json={"pinned": True})
+    return conv_id
+
+
+def test_report_is_dry_run(client):
+    old = _conversation(client, "old")
+    _age_conversation(old, 90)
+
+    r = client.get("/api/retention/report", params={"raw_days": 30, "archive_days": 60})
+    assert r.status_code == 200
+    report = r.json()
+    assert report["raw_blobs"]["messages"] == 1
+    assert report["archive"] == {"conversations": 1, "messages": 1, "bytes": report["archive"]["bytes"]}
+    assert report["projected_savings_bytes"] > 0
+    assert client.get(f"/api/conversations/{old}").status_code == 200
+
+
+def test_run_archives_stale_unpinned_conversations(client, tmp_path, monkeypatch):
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "archive_dir", str(tmp_path / "archive"))
+    old = _conversation(client, "old")
+    pinned = _conversation(client, "pinned", pinned=True)
+    fresh = _conversation(client, "fresh")
+    _age_conversation(old, 90)
+    _age_conversation(pinned, 90)
+
+    r = client.post("/api/retention/run", params={"archive_days": 60})
+    assert r.status_code == 200
+    assert r.json()["archived"]["conversations"] == 1
+
+    assert client.get(f"/api/conversations/{old}").status_code == 404
+    assert client.get(f"/api/conversations/{pinned}").status_code == 200
+    assert client.get(f"/api/conversations/{fresh}").status_code == 200
+
+    (archive,) = (tmp_path / "archive").iterdir()
+    records = [json.loads(line) for line in gzip.decompress(archive.read_bytes()).splitlines()]
+    assert [r["type"] for r in records] == ["conversation", "message"]
+    assert records[0]["data"]["id"] == old
+
+
+def test_dropping_raw_blobs_does_not_restart_the_archive_clock(client, tmp_path, monkeypatch):
+    from app.config import get_settings
+
+    monkeypatch.setattr(get_settings(), "archive_dir", str(tmp_path / "archive"))
+    old = _conversation(client, "old")
+    _age_conversation(old, 45)
+
+    r = client.post("/api/retention/run", params={"raw_days": 30, "archive_days": 60})
+    assert r.json()["archived"]["conversations"] == 0
+    report = client.get("/api/retention/report", params={"raw_days": 30, "archive_days": 40}).json()
+    assert report["raw_blobs"]["messages"] == 0
+    # Still 45 days idle: the blob drop above was not counted as activity
+    assert report["archive"]["conversations"] == 1
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from app.deps import RouteRegistry, route_registry
+from app.routing.discovery import get_route_discovery
+
+
+def test_replicas_drain_and_remove_without_disrupting_streams(uds_upstream):
+    url = f"unix://{uds_upstream}?path=/v1"
+    body = {"model": "mock/model", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+
+    async def scenario():
+        registry = RouteRegistry()
+        registry.route_key_to_base_url.clear()
+        registry.add_route("a", url)
+        registry.add_route("b", url)
+        try:
+            # Idle replicas take turns
+            picks = {await registry.infer_route_by_model("mock/model") for _ in range(4)}
+            assert picks == {"a", "b"}
+
+            client_a = registry.get_client("a")
+            stream = await client_a.send(client_a.build_request("POST", "/chat/completions", json=body), stream=True)
+            assert registry.in_flight("a") == 1
+            # The busy replica is skipped while another is idle
+            assert {await registry.infer_route_by_model("mock/model") for _ in range(4)} == {"b"}
+
+            registry.remove_route("a")
+            assert registry.list_route_keys() == ["b"]
+            assert await registry.reap() == []
+            # The open stream still finishes on its pool
+            assert b"[DONE]" in await stream.aread()
+            await stream.aclose()
+            assert registry.in_flight("a") == 0
+            assert await registry.reap() == ["a"]
+            assert client_a.is_closed
+            assert registry.route_state("a") is None
+
+            # Same URL keeps the pool; a new URL retires it once idle
+            client_b = registry.get_client("b")
+            registry.add_route("b", url)
+            assert registry.get_client("b") is client_b
+            registry.add_route("b", url + "&http2=0")
+            assert registry.get_client("b") is not client_b
+            await registry.reap()
+            assert client_b.is_closed
+        finally:
+            await registry.aclose()
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def routes_file(tmp_path, monkeypatch):
+    path = tmp_path / "routes.json"
+    monkeypatch.setenv("ROUTES_FILE", str(path))
+    return path
+
+
+def test_admin_routes_write_through_routes_file(routes_file, client):
+    r = client.put("/api/admin/routes/Extra", json={"url": "http://127.0.0.1:9/v1"})
+    assert r.status_code == 200
+    assert r.json() == {"route": "extra", "url": "http://127.0.0.1:9/v1", "state": "active", "in_flight": 0}
+    assert json.loads(routes_file.read_text()) == {"extra": {"url": "http://127.0.0.1:9/v1", "drain": False}}
+    assert "extra" in route_registry.list_route_keys()
+
+    assert client.post("/api/admin/routes/extra/drain").json()["state"] == "draining"
+    assert "extra" not in route_registry.list_route_keys()
+    assert client.put("/api/admin/routes/extra", json={"url": "ftp://x"}).status_code == 400
+
+    assert client.delete("/api/admin/routes/extra").json()["state"] == "removing"
+    assert json.loads(routes_file.read_text()) == {"extra": None}
+    assert client.portal.call(route_registry.reap) == ["extra"]
+    assert client.delete("/api/admin/routes/extra").status_code == 404
+
+    # Edits to the file itself are picked up too
+    routes_file.write_text(json.dumps({"later": "http://127.0.0.1:9/v1"}))
+    get_route_discovery().sync_file()
+    assert [r["route"] for r in client.get("/api/admin/routes").json()].count("later") == 1
+    routes_file.write_text("{}")
+    get_route_discovery().sync_file()
+    assert route_registry.route_state("later") == "removing"
+    client.portal.call(route_registry.reap)
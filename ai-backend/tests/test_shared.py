@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import asyncio
+import subprocess
+import sys
+
+from app import shared
+from app.config import get_settings
+from app.deps import route_registry
+from app.shared import FileStore, try_lead
+
+
+def test_model_catalog_is_fetched_once_for_all_workers(tmp_path, mock_upstream, monkeypatch):
+    store = FileStore(str(tmp_path))
+    monkeypatch.setattr(shared, "_store", store)
+
+    first = asyncio.run(route_registry._fetch_models_for_route("mock"))
+    assert [m["id"] for m in first] == [mock_upstream.model]
+    assert len(mock_upstream.calls) == 1
+
+    # Another worker: empty local cache, same shared store
+    monkeypatch.setattr(route_registry, "_models_cache", {})
+    assert asyncio.run(route_registry._fetch_models_for_route("mock")) == first
+    assert len(mock_upstream.calls) == 1
+
+    # Expired entries are refetched
+    asyncio.run(store.set("models:mock", {"at": 0, "models": []}, ttl=-1))
+    monkeypatch.setattr(route_registry, "_models_cache", {})
+    asyncio.run(route_registry._fetch_models_for_route("mock"))
+    assert len(mock_upstream.calls) == 2
+
+
+def test_only_one_process_leads(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_settings(), "shared_state_dir", str(tmp_path))
+    monkeypatch.setattr(shared, "_leader_files", {})
+    assert try_lead("job")
+    assert try_lead("job")
+
+    other = "from app.shared import try_lead; print(try_lead('job'), try_lead('other-job'))"
+    out = subprocess.run(
+        [sys.executable, "-c", other], env={"SHARED_STATE_DIR": str(tmp_path), "PATH": ""}, capture_output=True, text=True
+    )
+    assert out.stdout.split() == ["False", "True"], out.stderr
+    shared._leader_files["job"].close()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from app.tracing import MemoryExporter, Tracer, span, trace_headers
+
+
+@pytest.fixture
+def traced(monkeypatch):
+    monkeypatch.setenv("TRACE_ENABLE", "true")
+    monkeypatch.setenv("TRACE_SAMPLE_RATE", "1.0")
+
+
+def run_trace(tracer: Tracer, status: int = 200, traceparent: str | None = None, sleep: float = 0.0) -> bool:
+    root, token = tracer.start("http.request", traceparent)
+    with span("child"):
+        time.sleep(sleep)
+    return tracer.finish(root, token, status)
+
+
+def test_tail_sampling_keeps_errors_and_slow_traces():
+    exporter = MemoryExporter()
+    tracer = Tracer(exporter, sample_rate=0.0, slow_ms=50)
+    assert run_trace(tracer) is False
+    assert run_trace(tracer, status=502) is True
+    assert run_trace(tracer, sleep=0.06) is True
+    assert len(exporter.recent()) == 2
+    assert exporter.recent(min_ms=50)[0]["duration_ms"] >= 50
+
+
+def test_incoming_traceparent_is_continued():
+    exporter = MemoryExporter()
+    tracer = Tracer(exporter, sample_rate=0.0)
+    trace_id, parent = "ab" * 16, "cd" * 8
+    assert run_trace(tracer, traceparent=f"00-{trace_id}-{parent}-01") is True
+    root, child = exporter.get(trace_id)
+    assert root["parent_id"] == parent
+    assert child["parent_id"] == root["span_id"]
+
+
+def test_spans_are_noops_outside_a_trace():
+    with span("orphan") as s:
+        s.set(x=1)
+    assert trace_headers() == {}
+
+
+def test_stream_request_is_traced_end_to_end(traced, client, mock_upstream):
+    r = client.post("/api/chat/stream", json={"message": "hi", "model": mock_upstream.model, "modelKey": "mock"})
+    assert r.status_code == 200
+    trace_id = r.headers["x-trace-id"]
+
+    # The upstream call carries the trace context
+    upstream = mock_upstream.calls[-1]
+    assert upstream.headers["traceparent"].split("-")[1] == trace_id
+
+    spans = client.get(f"/api/admin/traces/{trace_id}").json()
+    by_name = {s["name"]: s for s in spans}
+    assert {"http.request", "route.resolve", "upstream.chat_stream", "db.persist_request", "stream.relay", "stream.finalize"} <= set(by_name)
+    assert upstream.headers["traceparent"].split("-")[2] == by_name["upstream.chat_stream"]["span_id"]
+    assert by_name["route.resolve"]["attributes"]["route"] == "mock"
+    assert by_name["stream.relay"]["attributes"]["chunks"] == 2
+
+    listed = client.get("/api/admin/traces").json()
+    assert any(t["trace_id"] == trace_id for t in listed)
+
+
+def test_traces_endpoint_requires_memory_exporter(client):
+    assert client.get("/api/admin/traces").status_code == 404
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.clients import vllm_client
+from app.deps import RouteRegistry, parse_route_url, route_registry
+
+
+def test_parse_route_url():
+    assert parse_route_url("unix:///run/vllm.sock?path=/v1") == ("http://localhost/v1", "/run/vllm.sock", None)
+    assert parse_route_url("http://gpu:8000/v1?http2=1") == ("http://gpu:8000/v1", None, True)
+    assert parse_route_url("http://gpu:8000/v1") == ("http://gpu:8000/v1", None, None)
+
+
+def test_unix_socket_route(uds_upstream, monkeypatch):
+    monkeypatch.setenv("MODEL_ROUTE_LOCAL", f"unix://{uds_upstream}?path=/v1")
+    registry = RouteRegistry()
+
+    async def fetch():
+        try:
+            return await registry.aggregate_models()
+        finally:
+            await registry.aclose()
+
+    models = asyncio.run(fetch())
+    assert [(m["id"], m["sources"][0]["source"]) for m in models] == [("mock/model", "local")]
+
+
+def test_failed_stream_releases_in_flight_slot(monkeypatch):
+    statuses = [503, 503, 400, 200]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        # An open stream, as a real transport returns (content=... would arrive already closed)
+        return httpx.Response(statuses.pop(0), stream=httpx.ByteStream(b"data: [DONE]\n\n"))
+
+    # Built like a configured route so requests pass through the in-flight counter
+    client = route_registry._make_client("http://counted/v1")
+    route_registry._counters[client].inner = httpx.MockTransport(handler)
+    monkeypatch.setitem(route_registry.route_key_to_base_url, "counted", "http://counted/v1")
+    monkeypatch.setitem(route_registry._clients, "counted", client)
+
+    async def run():
+        for expected in (502, 502, 400):
+            with pytest.raises(HTTPException) as exc:
+                await vllm_client.stream_chat_completion("counted", {"model": "m"})
+            assert exc.value.status_code == expected
+        assert route_registry.in_flight("counted") == 0
+        resp = await vllm_client.stream_chat_completion("counted", {"model": "m"})
+        assert route_registry.in_flight("counted") == 1
+        await resp.aclose()
+        assert route_registry.in_flight("counted") == 0
+
+    asyncio.run(run())